@@ -0,0 +1,248 @@
+import numpy as np
+
+import FieldObjects
+import SimClock
+from TagIndex import TYPE_BOOL, TYPE_NONE, TYPE_OTHER, TYPE_REAL, TYPE_UDT, TagIndex
+
+# Relation slot columns, same order as FieldObjects.RELATION_SLOTS
+EXT1, EXT2, INC1, INC2, INC3, DEC1, DEC2, DEC3 = range(8)
+INC_SLOTS = slice(INC1, INC3 + 1)
+DEC_SLOTS = slice(DEC1, DEC3 + 1)
+
+# Raw PLC counts range used by AnalogInput._unscale and AnalogInput._calculated_roc
+RAW_MIN = 6240
+RAW_MAX = 31208
+
+
+def decode_tag(tag) -> tuple:
+    """
+    :param tag: Pycomm3 Tag read
+    :return: Type code and numeric value of the tag, from the type of the Tag
+    """
+    tag_type = tag.type
+    if tag_type is None:
+        return TYPE_NONE, 0.0
+    if tag_type == 'BOOL':
+        return TYPE_BOOL, 1.0 if tag.value else 0.0
+    if tag_type == 'REAL':
+        return TYPE_REAL, tag.value
+    if tag_type == 'UDT_zzAnaIN':
+        return TYPE_UDT, tag.value['Channel']
+    return TYPE_OTHER, 0.0
+
+
+# Value of a tag of a known type
+_ACCESSORS = {TYPE_BOOL: lambda value: 1.0 if value else 0.0,
+              TYPE_REAL: lambda value: value,
+              TYPE_UDT: lambda value: value['Channel'],
+              TYPE_OTHER: lambda value: 0.0}
+
+
+class AnalogKernel:
+
+    def __init__(self, inputs: list, tag_index: TagIndex = None):
+        """
+        Array backed simulation of a group of AnalogInput objects, all the inputs are stepped in a single batched
+        update per scan with the same results as calling AnalogInput.process() on every object
+
+        :param inputs: List of AnalogInput objects, compile() must be called again if their configuration changes
+        :param tag_index: Types of the relation tags, resolved when compiled so every step only extracts the values.
+        Without it the type of every tag is taken from the Tag read on every step.
+        """
+
+        self.inputs = inputs
+        self.tag_index = tag_index
+        self.feedback_tags = []
+        self.relation_tags = []  # Distinct relation tags used by the evaluation plans
+        self.compile()
+
+    def compile(self):
+        """
+        Builds the configuration arrays and the initial state from the AnalogInput objects
+
+        :return:
+        """
+        inputs = self.inputs
+        n = len(inputs)
+
+        # Every slot points into the table of distinct relation tags decoded on each step, index 0 is reserved for
+        # the slots the evaluation plan doesn't use and always decodes as TYPE_NONE
+        tag_index = {}
+        slot_index = np.zeros((n, 8), dtype=np.intp)
+        for row, inp in enumerate(inputs):
+            for col, tag in inp.plan_slots:
+                slot_index[row, col] = tag_index.setdefault(tag, len(tag_index) + 1)
+        self.relation_tags = list(tag_index)
+        self._slot_index = slot_index
+
+        # Value accessor of every relation tag, bound to its type. Tags missing from the tag database may still be
+        # served locally by the Dependency Graph, like the tags of an unknown type they're decoded from the Tag read.
+        self._decoders = []
+        for name in self.relation_tags:
+            handle = self.tag_index.resolve(name) if self.tag_index is not None else None
+            code = handle.code if handle is not None and handle.exists else None
+            self._decoders.append((name, code, None if code is None else _ACCESSORS[code]))
+
+        # Branch flags, taken from the evaluation plans compiled by the inputs
+        plans = np.array([inp.plan for inp in inputs], dtype=np.int64)
+        self._ext_mode = plans == FieldObjects.PLAN_EXT_REFERENCE
+        self._inc_mode = np.array([bool(inp.inc_slots) for inp in inputs], dtype=bool)
+        self._dec_mode = np.array([bool(inp.dec_slots) for inp in inputs], dtype=bool)
+        self._fixed_mode = plans == FieldObjects.PLAN_FIXED
+        self._or_mode = plans == FieldObjects.PLAN_INTEGRATING_OR
+
+        self.inc_roc = np.array([inp.incROC for inp in inputs], dtype=np.int64)
+        self.dec_roc = np.array([inp.decROC for inp in inputs], dtype=np.int64)
+        self.fixed_value = np.array([inp.fixed_value for inp in inputs], dtype=np.int64)
+        self.min_rng = np.array([inp.minRng for inp in inputs], dtype=np.int64)
+        self.max_rng = np.array([inp.maxRng for inp in inputs], dtype=np.int64)
+
+        self.simulated_value = np.array([inp.simulated_value for inp in inputs], dtype=np.int64)
+        self.feedback_value = np.array([inp.feedback_tag_value for inp in inputs], dtype=np.int64)
+        self.time_last = np.array([inp.time_last for inp in inputs], dtype=np.float64)
+        self.feedback_tags = [inp.feedback_tag for inp in inputs]
+
+    def _decode(self, tag_data: dict):
+        """
+        Decodes every distinct relation tag into a type code and a numeric value
+
+        :param tag_data: Dictionary of tag name -> Pycomm3 Tag
+        :return: Arrays of type codes and values, index 0 is the unset slot
+        """
+        # Filled as lists and converted once, item assignment on NumPy arrays is slow
+        codes = [TYPE_NONE]
+        values = [0.0]
+
+        for name, code, accessor in self._decoders:
+            tag = tag_data.get(name)
+            if tag is None or tag.type is None:
+                codes.append(TYPE_NONE)
+                values.append(0.0)
+            elif accessor is not None:
+                codes.append(code)
+                values.append(accessor(tag.value))
+            else:
+                code, value = decode_tag(tag)
+                codes.append(code)
+                values.append(value)
+
+        codes = np.array(codes, dtype=np.int8)
+        values = np.array(values, dtype=np.float64)
+
+        return codes, values
+
+    @staticmethod
+    def _unscale(values):
+        return np.trunc(((RAW_MAX - RAW_MIN) * values / 100) + RAW_MIN)
+
+    def _integrating_condition(self, mode, codes, values, min_rng, roc_max):
+        """
+        Vectorized AnalogInput._handle_integrating_inc_condition / _handle_integrating_dec_condition for 3 slots
+
+        :return: Allowed flag from the BOOL slots, counts delta from the UDT slots and flag of rows changed by UDT slots
+        """
+        evaluated = mode[:, None] & (codes != TYPE_NONE)
+
+        # BOOL slots are AND/OR combined into the allowed flag
+        bools = evaluated & (codes == TYPE_BOOL)
+        and_allowed = np.all(np.where(bools, values != 0, True), axis=1)
+        or_allowed = np.any(np.where(bools, values != 0, False), axis=1)
+        allowed = mode & np.where(self._or_mode, or_allowed, and_allowed)
+
+        # Analog slots move the feedback proportionally to their Channel, only UDT_zzAnaIN tags are supported
+        analogs = evaluated & (codes != TYPE_BOOL)
+        unsupported = analogs & ((codes == TYPE_OTHER) |
+                                 ((codes == TYPE_REAL) & (self._unscale(values) > min_rng[:, None])))
+        if unsupported.any():
+            raise TypeError('Increase/Decrease condition tags must be BOOL or UDT_zzAnaIN')
+
+        udts = analogs & (codes == TYPE_UDT) & (values > min_rng[:, None])
+        calculated_roc = np.trunc((np.maximum(values, RAW_MIN) - RAW_MIN) * roc_max[:, None] / (RAW_MAX - RAW_MIN))
+        delta = np.where(udts, calculated_roc, 0).sum(axis=1).astype(np.int64)
+
+        return allowed, delta, udts.any(axis=1)
+
+    def step(self, tag_data: dict, now=None) -> list:
+        """
+        Steps all the inputs once
+
+        :param tag_data: Dictionary of tag name -> Pycomm3 Tag, must contain the relation tags of all the inputs
+        :param now: Time of the step, defaults to the current time of the simulation clock
+        :return: List of (tag name, value) pairs to be written back to the PLC
+        """
+        if not self.inputs:
+            return []
+
+        now = SimClock.now() if now is None else now
+        codes, values = self._decode(tag_data)
+        slot_codes = codes[self._slot_index]
+        slot_values = values[self._slot_index]
+        valid = slot_codes != TYPE_NONE
+
+        time_diff = now - self.time_last
+        feedback = self.feedback_value.copy()
+        simulated = self.simulated_value.copy()
+
+        # ==============================================
+        # Non-Integrating Process, use the max of the External References
+        ext_codes = slot_codes[:, EXT1:EXT2 + 1]
+        ext_valid = valid[:, EXT1:EXT2 + 1]
+        if (self._ext_mode[:, None] & ext_valid & ((ext_codes == TYPE_BOOL) | (ext_codes == TYPE_OTHER))).any():
+            raise TypeError('External Reference tags must be REAL or UDT_zzAnaIN')
+
+        ext_values = slot_values[:, EXT1:EXT2 + 1]
+        extracted = np.where(ext_codes == TYPE_REAL, self._unscale(ext_values), ext_values)
+        extracted = np.where(ext_valid, extracted, 0).astype(np.int64)
+
+        ext_invalid = self._ext_mode & ~ext_valid.any(axis=1)
+        if ext_invalid.any():
+            print(f'External Reference Tags are Invalid... ({np.count_nonzero(ext_invalid)} inputs)')
+        ext_ok = self._ext_mode & ~ext_invalid
+        ext_feedback = np.maximum(extracted.max(axis=1), self.min_rng)
+        feedback = np.where(ext_ok, ext_feedback, feedback)
+        simulated = np.where(ext_ok, ext_feedback, simulated)
+
+        # ==============================================
+        # Integrating Process, rows that didn't take the External Reference path
+        rest = ~self._ext_mode
+        roc_inc = np.trunc(self.inc_roc * time_diff).astype(np.int64)
+        roc_dec = np.trunc(self.dec_roc * time_diff).astype(np.int64)
+
+        inc_allowed, inc_delta, inc_touched = self._integrating_condition(
+            rest & self._inc_mode, slot_codes[:, INC_SLOTS], slot_values[:, INC_SLOTS], self.min_rng, roc_inc)
+        dec_allowed, dec_delta, dec_touched = self._integrating_condition(
+            rest & self._dec_mode, slot_codes[:, DEC_SLOTS], slot_values[:, DEC_SLOTS], self.min_rng, roc_dec)
+
+        feedback = feedback + inc_delta - dec_delta
+        simulated = np.where(inc_touched | dec_touched, feedback, simulated)
+
+        # Only Booleans can allow an increase/decrease
+        inc_allowed &= (slot_codes[:, INC_SLOTS] == TYPE_BOOL).any(axis=1)
+        dec_allowed &= (slot_codes[:, DEC_SLOTS] == TYPE_BOOL).any(axis=1)
+
+        simulated = np.where(inc_allowed, np.minimum(simulated + roc_inc, self.max_rng), simulated)
+        simulated = np.where(dec_allowed, np.maximum(simulated - roc_dec, self.min_rng), simulated)
+        adjusted = inc_allowed | dec_allowed
+        feedback = np.where(adjusted, simulated, feedback)
+
+        # Sends FixedValue if no tags have been specified
+        feedback = np.where(rest & ~adjusted & self._fixed_mode, self.fixed_value, feedback)
+
+        # Trim signal and snapshot the time for the next step
+        self.feedback_value = np.clip(feedback, self.min_rng, self.max_rng)
+        self.simulated_value = simulated
+        self.time_last[:] = now
+
+        return list(zip(self.feedback_tags, self.feedback_value.tolist()))
+
+    def sync_inputs(self):
+        """
+        Copies the simulation state back to the AnalogInput objects so their public attributes stay readable
+
+        :return:
+        """
+        for inp, feedback, simulated, time_last in zip(self.inputs, self.feedback_value.tolist(),
+                                                       self.simulated_value.tolist(), self.time_last.tolist()):
+            inp.feedback_tag_value = feedback
+            inp.simulated_value = simulated
+            inp.time_last = time_last
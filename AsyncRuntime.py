@@ -0,0 +1,278 @@
+import asyncio
+import concurrent.futures
+import math
+import threading
+import time
+
+import SimClock
+from ConnectionPool import CachedTagDriver, ConnectionPool, ControllerSession
+from ScanEngine import ScanEngine
+from ScanStats import instrument_driver
+
+
+class PeriodicTicker:
+
+    def __init__(self, period: float):
+        """
+        Drift-free periodic ticker, deadlines are multiples of the period from the first tick so the time spent
+        between ticks doesn't accumulate. Deadlines missed after an overrun are skipped, the phase is kept.
+
+        :param period: Time between ticks, in sec
+        """
+
+        self.period = period
+        self.missed_ticks = 0
+        self._next_tick = None
+
+    def reset(self):
+        """
+        Restarts the ticker, the next tick is due straight away
+
+        :return:
+        """
+        self._next_tick = None
+
+    async def tick(self) -> float:
+        """
+        Sleeps until the next deadline
+
+        :return: Lateness of the wake up against the deadline, in sec
+        """
+        now = time.monotonic()
+        if self._next_tick is None:
+            self._next_tick = now
+            return 0.0
+
+        self._next_tick += self.period
+        if self._next_tick < now:
+            missed = math.ceil((now - self._next_tick) / self.period)
+            self.missed_ticks += missed
+            self._next_tick += missed * self.period
+
+        await asyncio.sleep(self._next_tick - now)
+        return time.monotonic() - self._next_tick
+
+
+class AsyncControllerWorker:
+
+    def __init__(self, plc_address: str, engine: ScanEngine, session: ControllerSession, cycle_time=0.5):
+        """
+        Scan coroutine that owns a session to a single PLC. The blocking LogixDriver calls run in an executor while
+        the device logic runs on the event loop, so any number of PLCs scan concurrently on one loop.
+
+        :param plc_address: PLC IP/Slot number to R/W Tag data
+        :param engine: Scan Engine holding the devices owned by this PLC
+        :param session: Controller Session of the Connection Pool, opens the connection and backs off after failures
+        :param cycle_time: Time between the start of two consecutive scans, in sec of simulation time
+        """
+
+        self.plc_address = plc_address
+        self.engine = engine
+        self.session = session
+        self.cycle_time = cycle_time
+        self.scan_count = 0
+        self.error_count = 0
+        self.last_scan_time = 0.0  # Duration of the last scan, in sec
+        self.ticker = PeriodicTicker(cycle_time)
+        self._connect_count = 0  # Connection of the session the engine is synced with
+        self._next_step = None  # Simulation time of the next scan on a stepped clock
+
+    async def run(self, executor: concurrent.futures.Executor, stop_event: asyncio.Event):
+        """
+        Scans the PLC until the stop event is set
+
+        :param executor: Executor running the blocking PLC calls
+        :param stop_event: Stops the worker after its current scan when set
+        :return:
+        """
+        loop = asyncio.get_running_loop()
+        engine = self.engine
+        session = self.session
+        self.ticker.period = self.cycle_time / SimClock.get_clock().rate  # Wall clock time between scans
+        try:
+            while not stop_event.is_set():
+                if not session.connected and session.retry_in() > 0:
+                    # Backing off after a failure
+                    try:
+                        await asyncio.wait_for(stop_event.wait(), session.retry_in())
+                    except asyncio.TimeoutError:
+                        pass
+                    self.ticker.reset()
+                    continue
+
+                lateness = await self.ticker.tick()
+                if stop_event.is_set():
+                    break
+                if engine.stats is not None:
+                    engine.stats.record_jitter(lateness)
+
+                await self.scan_once(executor)
+        finally:
+            await loop.run_in_executor(executor, session.close)
+
+    async def scan_once(self, executor: concurrent.futures.Executor) -> bool:
+        """
+        Scans the PLC once, the connection is opened first if needed. A failure closes the connection and starts the
+        backoff of the session.
+
+        :param executor: Executor running the blocking PLC calls
+        :return: TRUE if the scan completed
+        """
+        loop = asyncio.get_running_loop()
+        engine = self.engine
+        session = self.session
+        scan_start = time.time()
+        try:
+            plc = await loop.run_in_executor(executor, self._connect)
+            tag_data = await loop.run_in_executor(executor, engine.read, plc)
+            write_data = engine.process(tag_data)
+            await loop.run_in_executor(executor, engine.write, plc, write_data)
+            self.scan_count += 1
+            self.last_scan_time = time.time() - scan_start
+            if engine.stats is not None:
+                engine.stats.record_scan(self.last_scan_time)
+        except Exception as err:
+            self.error_count += 1
+            await loop.run_in_executor(executor, session.failed, err)
+            print(f'Connection lost to PLC {self.plc_address}! ({err!r}), '
+                  f're-trying in {session.backoff():.1f}sec...')
+            return False
+
+        if session.keepalive_due():
+            await loop.run_in_executor(executor, session.keepalive)
+        return True
+
+    async def step(self, executor: concurrent.futures.Executor, now: float, tolerance=0.0) -> bool:
+        """
+        Scans the PLC if a scan is due at simulation time now, replaces run() on a stepped clock
+
+        :param executor: Executor running the blocking PLC calls
+        :param now: Current simulation time
+        :param tolerance: Scans due up to this time after now are scanned too, in sec
+        :return: TRUE if the PLC was scanned
+        """
+        if self._next_step is not None and now + tolerance < self._next_step:
+            return False
+        if not self.session.connected and self.session.retry_in() > 0:
+            return False
+
+        self._next_step = now if self._next_step is None else max(self._next_step + self.cycle_time, now)
+        return await self.scan_once(executor)
+
+    def _connect(self):
+        plc = self.session.connect()
+        if self.session.connect_count != self._connect_count:
+            # New connection, the engine drops the state tied to the previous one
+            self._connect_count = self.session.connect_count
+            if self.engine.stats is not None:
+                instrument_driver(plc, self.engine.stats)
+            self.engine.reset()
+        return plc
+
+
+class AsyncScanScheduler:
+
+    def __init__(self, max_io_threads=None, pool: ConnectionPool = None):
+        """
+        Runs one scan coroutine per PLC connection on a single asyncio event loop, same interface as the Scan
+        Scheduler. The loop runs in its own thread after start(), or can be awaited directly with run().
+
+        :param max_io_threads: Threads running the blocking PLC calls, one per PLC by default
+        :param pool: Connection Pool holding the session of every worker, a new one by default
+        """
+        self.workers = []
+        self.pool = pool if pool is not None else ConnectionPool()
+        self.max_io_threads = max_io_threads
+        self._loop = None
+        self._stop_event = None
+        self._thread = None
+
+    def add_controller(self, plc_address: str, engine: ScanEngine, plc_tags: dict, cycle_time=0.5, reconnect_time=5,
+                       driver=CachedTagDriver):
+        """
+        Adds a worker for a PLC
+
+        :param plc_address: PLC IP/Slot number to R/W Tag data
+        :param engine: Scan Engine holding the devices owned by this PLC
+        :param plc_tags: Tag database uploaded from the PLC at startup
+        :param cycle_time: Time between the start of two consecutive scans, in sec
+        :param reconnect_time: Time to wait before the first re-connection attempt after a failure, doubled on every
+        consecutive failure, in sec
+        :param driver: Creates the PLC connections, CachedTagDriver or a stand-in with the same interface
+        :return: The Async Controller Worker created
+        """
+        session = self.pool.add(plc_address, plc_tags, driver, reconnect_time)
+        worker = AsyncControllerWorker(plc_address, engine, session, cycle_time)
+        self.workers.append(worker)
+        return worker
+
+    async def run(self):
+        """
+        Runs all the workers until stop() is called
+
+        :return:
+        """
+        self._loop = asyncio.get_running_loop()
+        self._stop_event = asyncio.Event()
+        # Every PLC has at most one call in flight, one thread per PLC never queues a call behind another PLC
+        with concurrent.futures.ThreadPoolExecutor(self.max_io_threads or max(len(self.workers), 1),
+                                                   thread_name_prefix='PLC-IO') as executor:
+            clock = SimClock.get_clock()
+            if isinstance(clock, SimClock.SteppedClock):
+                await self._run_stepped(executor, clock)
+            else:
+                await asyncio.gather(*(worker.run(executor, self._stop_event) for worker in self.workers))
+
+    async def step(self, executor: concurrent.futures.Executor, clock: SimClock.SteppedClock):
+        """
+        Scans every PLC due at the current time of the clock, in the order they were added, and advances the clock one
+        step. Drives the simulation deterministically, run() calls it in a loop on a stepped clock.
+
+        :param executor: Executor running the blocking PLC calls
+        :param clock: Stepped Clock in use
+        :return:
+        """
+        now = clock.time()
+        for worker in self.workers:
+            await worker.step(executor, now, clock.step / 2)
+        clock.advance()
+
+    async def _run_stepped(self, executor: concurrent.futures.Executor, clock: SimClock.SteppedClock):
+        loop = asyncio.get_running_loop()
+        try:
+            while not self._stop_event.is_set():
+                retry_in = [worker.session.retry_in() for worker in self.workers if not worker.session.connected]
+                if self.workers and len(retry_in) == len(self.workers) and min(retry_in) > 0:
+                    # Every PLC is backing off, the simulation time is held until one of them can be scanned
+                    try:
+                        await asyncio.wait_for(self._stop_event.wait(), min(retry_in))
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                await self.step(executor, clock)
+                await asyncio.sleep(0)  # Lets stop() through between steps
+        finally:
+            for worker in self.workers:
+                await loop.run_in_executor(executor, worker.session.close)
+
+    def start(self):
+        started = threading.Event()
+
+        def _run_loop():
+            async def _main():
+                task = asyncio.ensure_future(self.run())
+                await asyncio.sleep(0)  # Lets run() create the stop event before start() returns
+                started.set()
+                await task
+
+            asyncio.run(_main())
+
+        self._thread = threading.Thread(target=_run_loop, name='AsyncScanScheduler', daemon=True)
+        self._thread.start()
+        started.wait()
+
+    def stop(self):
+        if self._loop is not None and self._stop_event is not None:
+            self._loop.call_soon_threadsafe(self._stop_event.set)
+        if self._thread is not None:
+            self._thread.join()
@@ -0,0 +1,264 @@
+import threading
+import time
+
+from pycomm3 import CommError, LogixDriver
+
+
+class CachedTagDriver(LogixDriver):
+
+    def __init__(self, path: str, *args, tag_definitions: dict = None, **kwargs):
+        """
+        LogixDriver that uses the tag definitions of the Tag Database instead of uploading them when the connection is
+        opened. The definitions are handed in to the constructor, nothing outside the driver touches its tag cache.
+
+        Pycomm3 has no public way to hand tag definitions to a connection, they are shared the way its documentation
+        recommends (plc2._tags = plc1.tags), in _share_tags() only, once the connection is open.
+
+        :param path: PLC IP/Slot number
+        :param tag_definitions: Tag definitions uploaded before (LogixDriver.tags), None uploads them as LogixDriver does
+        """
+        if tag_definitions is not None:
+            kwargs['init_tags'] = False
+        super().__init__(path, *args, **kwargs)
+        self._tag_definitions = tag_definitions
+
+    def open(self):
+        ret = super().open()
+        if ret:
+            self._share_tags()
+        return ret
+
+    def use_tag_definitions(self, tag_definitions: dict):
+        """
+        Replaces the tag definitions of the open connection, the tags of a reloaded tag export
+
+        :param tag_definitions: Tag definitions uploaded from the PLC (LogixDriver.tags)
+        :return:
+        """
+        self._tag_definitions = tag_definitions
+        if self.connected:
+            self._share_tags()
+
+    def _share_tags(self):
+        if self._tag_definitions is not None:
+            self._tags = self._tag_definitions  # Shared by all the connections to the PLC, never modified
+
+
+class ControllerSession:
+
+    def __init__(self, plc_address: str, tag_definitions: dict, driver=CachedTagDriver, reconnect_time=5.0,
+                 max_backoff=60.0, keepalive_time=10.0, recorder=None):
+        """
+        Managed connection to a single PLC. A failed connection is closed and re-opened after a backoff that doubles
+        on every consecutive failure, up to max_backoff, other sessions aren't touched. A connection idle for
+        keepalive_time is kept alive with a light request on the next tick of its worker, so a dead PLC is found
+        before a scan needs it.
+
+        Meant to be used by a single worker, it isn't thread safe.
+
+        :param plc_address: PLC IP/Slot number
+        :param tag_definitions: Tag database uploaded from the PLC at startup, handed to every new connection
+        :param driver: Creates the connections, called as driver(plc_address, init_tags=False,
+        tag_definitions=tag_definitions), CachedTagDriver or a stand-in with the same interface
+        :param reconnect_time: Backoff after the first failure, in sec
+        :param max_backoff: Longest backoff between re-connection attempts, in sec
+        :param keepalive_time: Idle time before a keepalive request is sent, in sec, 0 disables the keepalive
+        :param recorder: Tag Recorder recording the reads and writes of every connection opened, None doesn't record
+        """
+
+        self.plc_address = plc_address
+        self.tag_definitions = tag_definitions
+        self.driver = driver
+        self.reconnect_time = reconnect_time
+        self.max_backoff = max_backoff
+        self.keepalive_time = keepalive_time
+        self.recorder = recorder
+        self.plc = None  # Open connection, None while disconnected
+        self.connect_count = 0  # Connections opened, changes every time a new connection is handed out
+        self.reconnect_count = 0  # Connections opened after a failure
+        self.failure_count = 0  # Failed connection attempts and connections lost
+        self.keepalive_count = 0
+        self.consecutive_failures = 0
+        self.last_error = None
+        self._next_attempt = 0.0  # time.monotonic() of the next connection attempt
+        self._last_activity = 0.0
+
+    @property
+    def connected(self) -> bool:
+        return self.plc is not None
+
+    def connect(self):
+        """
+        Returns the open connection, a new one is opened if there's none and the backoff is over
+
+        :return: Connection to the PLC
+        """
+        if self.plc is not None:
+            return self.plc
+
+        now = time.monotonic()
+        if now < self._next_attempt:
+            raise CommError(f'PLC {self.plc_address} backing off, next attempt in {self._next_attempt - now:.1f}sec')
+
+        plc = self.driver(self.plc_address, init_tags=False, tag_definitions=self.tag_definitions)
+        try:
+            plc.open()
+        except Exception:
+            self._close(plc)
+            raise
+        print(plc.info)
+
+        # Every request sent over the connection postpones the keepalive, fragmented requests included
+        send = plc._send
+
+        def _send(message):
+            send(message)
+            self._last_activity = time.monotonic()
+
+        plc._send = _send
+        if self.recorder is not None:
+            self.recorder.attach(plc, self.plc_address)
+
+        if self.consecutive_failures:
+            self.reconnect_count += 1
+        self.connect_count += 1
+        self.consecutive_failures = 0
+        self._last_activity = time.monotonic()
+        self.plc = plc
+        return plc
+
+    def use_tag_definitions(self, tag_definitions: dict):
+        """
+        Replaces the tag definitions handed to the connections, the open connection switches straight away
+
+        :param tag_definitions: Tag definitions uploaded from the PLC
+        :return:
+        """
+        self.tag_definitions = tag_definitions
+        if self.plc is not None and hasattr(self.plc, 'use_tag_definitions'):
+            self.plc.use_tag_definitions(tag_definitions)
+
+    def failed(self, err: Exception = None):
+        """
+        Reports a failed connection attempt or a failure on the connection, the connection is closed and the backoff
+        starts
+
+        :param err: Exception raised
+        :return:
+        """
+        self._close(self.plc)
+        self.plc = None
+        self.failure_count += 1
+        self.consecutive_failures += 1
+        self.last_error = repr(err) if err is not None else None
+        self._next_attempt = time.monotonic() + self.backoff()
+
+    def backoff(self) -> float:
+        """
+        :return: Time between the last failure and the next connection attempt, in sec
+        """
+        if not self.consecutive_failures:
+            return 0.0
+        return min(self.reconnect_time * 2 ** (self.consecutive_failures - 1), self.max_backoff)
+
+    def retry_in(self) -> float:
+        """
+        :return: Time left before the next connection attempt, in sec
+        """
+        return max(self._next_attempt - time.monotonic(), 0.0)
+
+    def keepalive_due(self) -> bool:
+        """
+        :return: TRUE if the connection has been idle for keepalive_time
+        """
+        return self.plc is not None and bool(self.keepalive_time) and \
+            time.monotonic() - self._last_activity >= self.keepalive_time
+
+    def keepalive(self):
+        """
+        Sends a keepalive request if the connection has been idle for keepalive_time, a failure closes it
+
+        :return:
+        """
+        if not self.keepalive_due():
+            return
+        try:
+            self.plc.get_plc_time()
+            self.keepalive_count += 1
+        except Exception as err:
+            print(f'Keepalive to PLC {self.plc_address} failed! ({err!r})')
+            self.failed(err)
+
+    def close(self):
+        self._close(self.plc)
+        self.plc = None
+
+    def summary(self) -> dict:
+        return {'plc_address': self.plc_address,
+                'connected': self.connected,
+                'connects': self.connect_count,
+                'reconnects': self.reconnect_count,
+                'failures': self.failure_count,
+                'keepalives': self.keepalive_count,
+                'backoff': self.retry_in(),
+                'last_error': self.last_error}
+
+    @staticmethod
+    def _close(plc):
+        if plc is not None:
+            try:
+                plc.close()
+            except Exception:
+                pass
+
+
+class ConnectionPool:
+
+    def __init__(self, max_backoff=60.0, keepalive_time=10.0, recorder=None):
+        """
+        One Controller Session per PLC, replaces tearing down and re-opening every connection when any of them fails
+
+        :param max_backoff: Longest backoff between re-connection attempts of a session, in sec
+        :param keepalive_time: Idle time before a session sends a keepalive request, in sec, 0 disables the keepalive
+        :param recorder: Tag Recorder recording the tag traffic of all the sessions, None doesn't record
+        """
+        self.max_backoff = max_backoff
+        self.keepalive_time = keepalive_time
+        self.recorder = recorder
+        self.sessions = []  # Controller Sessions, a PLC has several when its devices are split in parts
+        self._lock = threading.Lock()
+
+    def add(self, plc_address: str, tag_definitions: dict, driver=CachedTagDriver,
+            reconnect_time=5.0) -> ControllerSession:
+        """
+        Adds a session to a PLC
+
+        :param plc_address: PLC IP/Slot number
+        :param tag_definitions: Tag database uploaded from the PLC at startup
+        :param driver: Creates the connections
+        :param reconnect_time: Backoff after the first failure, in sec
+        :return: Controller Session
+        """
+        session = ControllerSession(plc_address, tag_definitions, driver, reconnect_time, self.max_backoff,
+                                    self.keepalive_time, self.recorder)
+        with self._lock:
+            self.sessions.append(session)
+        return session
+
+    def close(self):
+        """
+        Closes all the sessions and the recorder, the workers using them must be stopped first
+
+        :return:
+        """
+        with self._lock:
+            for session in self.sessions:
+                session.close()
+        if self.recorder is not None:
+            self.recorder.close()
+
+    def summary(self) -> list:
+        """
+        :return: Connection state and counters of every session
+        """
+        return [session.summary() for session in self.sessions]
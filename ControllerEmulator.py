@@ -0,0 +1,387 @@
+import math
+import os
+import random
+import threading
+import time
+from typing import NamedTuple
+
+from pycomm3 import CommError, Tag
+
+import TagExport
+
+ATOMIC_SIZES = {'BOOL': 1, 'SINT': 1, 'INT': 2, 'DINT': 4, 'LINT': 8, 'REAL': 4, 'LREAL': 8}
+# Members (name, datatype, initial value) of the structures the simulator reads by member
+STRUCT_TEMPLATES = {'UDT_zzAnaIN': (('Channel', 'INT', 0), ('MIN', 'REAL', 0.0), ('MAX', 'REAL', 100.0))}
+STRUCT_SIZE = 32  # Assumed size of the structures without a template, in bytes
+PACKET_OVERHEAD = 40  # Encapsulation and multi-service headers of a packet, approximated, in bytes
+TAG_NOT_FOUND = 'Tag doesn\'t exist'
+
+
+class EmulatedRequest(NamedTuple):
+    service: str  #: 'read', 'write' or 'get_plc_time'
+    items: list  #: Tag names, or (tag name, value) pairs for writes
+    message: bytes  #: Placeholder of the size the request would have on the wire
+
+
+class EmulatedResponse(NamedTuple):
+    results: list  #: Pycomm3 Tags
+    raw: bytes  #: Placeholder of the size the reply would have on the wire
+
+
+def _split_array(datatype: str) -> tuple:
+    """
+    :param datatype: Datatype as written in the tag export, ie. REAL[17]
+    :return: (element datatype, number of elements or None if not an array)
+    """
+    if datatype.endswith(']') and '[' in datatype:
+        base, _, dims = datatype[:-1].partition('[')
+        return base, math.prod(int(dim) for dim in dims.split(','))
+    return datatype, None
+
+
+def _initial_value(datatype: str):
+    base, length = _split_array(datatype)
+    if length is not None:
+        return [_initial_value(base) for _ in range(length)]
+    if base == 'BOOL':
+        return False
+    if base in ('REAL', 'LREAL'):
+        return 0.0
+    if base in ATOMIC_SIZES:
+        return 0
+    return {member: value for member, _, value in STRUCT_TEMPLATES.get(base, ())}
+
+
+def _data_size(datatype: str) -> int:
+    base, length = _split_array(datatype)
+    if base in ATOMIC_SIZES:
+        size = ATOMIC_SIZES[base]
+    elif base in STRUCT_TEMPLATES:
+        size = sum(ATOMIC_SIZES[member_type] for _, member_type, _ in STRUCT_TEMPLATES[base])
+    else:
+        size = STRUCT_SIZE
+    return size * (length or 1)
+
+
+def _path_size(tag: str) -> int:
+    # Symbolic segments of the request path, padded to an even length
+    return sum(2 + len(part) + len(part) % 2 for part in tag.split('.'))
+
+
+def _coerce(datatype: str, value):
+    if datatype == 'BOOL':
+        return bool(value)
+    if datatype in ('REAL', 'LREAL'):
+        return float(value)
+    if datatype in ATOMIC_SIZES:
+        return int(value)
+    return value
+
+
+class EmulatedController:
+
+    def __init__(self, plc_address: str, tag_types: dict, name='Emulated', revision=(1, 0), latency=0.0, jitter=0.0,
+                 connection_size=4000):
+        """
+        In-process stand-in for a ControlLogix controller, holds the value of every tag of the program
+
+        :param plc_address: PLC IP/Slot number the controller answers on
+        :param tag_types: Tag name -> datatype, as written in the tag export
+        :param name: Program name reported by the controller
+        :param revision: (major, minor) firmware revision reported by the controller
+        :param latency: Round trip time of every request, in sec
+        :param jitter: Random extra time added to the round trip of every request, up to this value, in sec
+        :param connection_size: Maximum size of a request or reply packet, in bytes, reads and writes are split in as
+        many requests as needed to stay below it
+        """
+
+        self.plc_address = plc_address
+        self.tag_types = tag_types
+        self.values = {tag: _initial_value(datatype) for tag, datatype in tag_types.items()}
+        self.info = {'name': name, 'revision': {'major': revision[0], 'minor': revision[1]},
+                     'product_name': 'Emulated Logix Controller'}
+        self.latency = latency
+        self.jitter = jitter
+        self.connection_size = connection_size
+        self.available = True  # FALSE refuses new connections and fails open ones, emulates a lost PLC
+        self.request_count = 0
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['lock']  # Locks can't be pickled, the controller can be handed to other processes
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_tag_export(cls, plc_address: str, tag_file: str, **kwargs):
+        """
+        Creates a controller serving the tags of an RSLogix 5000 CSV tag export, program scoped tags are served as
+        Program:<program name>.<tag name>
+
+        :param plc_address: PLC IP/Slot number the controller answers on
+        :param tag_file: RSLogix 5000 CSV tag export
+        :param kwargs: Arguments passed on to the constructor
+        :return: Emulated Controller
+        """
+        tag_types = {}
+        for record in TagExport.read_tag_export(tag_file, ('TAG',)):
+            name = f'Program:{record.scope}.{record.name}' if record.scope else record.name
+            tag_types[name] = record.datatype
+        kwargs.setdefault('name', os.path.splitext(os.path.basename(tag_file))[0])
+        return cls(plc_address, tag_types, **kwargs)
+
+    def tag_definitions(self) -> dict:
+        """
+        :return: Tag name -> definition, with the keys of the Pycomm3 tag definitions the simulator uses
+        """
+        definitions = {}
+        for tag, datatype in self.tag_types.items():
+            base, length = _split_array(datatype)
+            if base in ATOMIC_SIZES:
+                data_type = base
+            else:
+                # Structures are described by their members like Pycomm3 does, only the ones of the known templates
+                data_type = {'name': base,
+                             'internal_tags': {member: {'tag_type': 'atomic', 'data_type': member_type,
+                                                        'data_type_name': member_type}
+                                               for member, member_type, _ in STRUCT_TEMPLATES.get(base, ())},
+                             'attributes': [member for member, _, _ in STRUCT_TEMPLATES.get(base, ())]}
+            definitions[tag] = {'tag_name': tag,
+                                'tag_type': 'atomic' if base in ATOMIC_SIZES else 'struct',
+                                'data_type_name': base,
+                                'data_type': data_type,
+                                'dim': 1 if length else 0,
+                                'dimensions': [length or 0, 0, 0]}
+        return definitions
+
+    def _resolve(self, tag: str):
+        """
+        :param tag: Tag name, a structure member (Tag.Member) or an array element (Tag[n])
+        :return: (container, key, datatype) of the value, None if the tag doesn't exist
+        """
+        if tag in self.values:
+            return self.values, tag, self.tag_types[tag]
+
+        base, _, member = tag.rpartition('.')
+        if base in self.values:
+            template = STRUCT_TEMPLATES.get(self.tag_types[base], ())
+            for member_name, member_type, _ in template:
+                if member_name == member:
+                    return self.values[base], member, member_type
+            return None
+
+        if tag.endswith(']') and '[' in tag:
+            base, _, index = tag[:-1].partition('[')
+            if base in self.values and index.isdigit():
+                element_type, length = _split_array(self.tag_types[base])
+                if length is not None and int(index) < length:
+                    return self.values[base], int(index), element_type
+        return None
+
+    def tag_size(self, tag: str) -> int:
+        """
+        :param tag: Tag name
+        :return: Size of the tag data, in bytes, 0 if the tag doesn't exist
+        """
+        resolved = self._resolve(tag)
+        return _data_size(resolved[2]) if resolved is not None else 0
+
+    def read_tag(self, tag: str) -> Tag:
+        resolved = self._resolve(tag)
+        if resolved is None:
+            return Tag(tag, None, None, TAG_NOT_FOUND)
+        container, key, datatype = resolved
+        value = container[key]
+        if isinstance(value, (dict, list)):
+            value = value.copy()  # Callers can't modify the controller data through the returned value
+        return Tag(tag, value, datatype, None)
+
+    def write_tag(self, tag: str, value) -> Tag:
+        resolved = self._resolve(tag)
+        if resolved is None:
+            return Tag(tag, None, None, TAG_NOT_FOUND)
+        container, key, datatype = resolved
+        try:
+            container[key] = _coerce(datatype, value)
+        except (TypeError, ValueError) as err:
+            return Tag(tag, value, datatype, f'Invalid value for {datatype}: {err}')
+        return Tag(tag, value, datatype, None)
+
+
+class EmulatedDriver:
+
+    def __init__(self, controller: EmulatedController, init_tags=True, tag_definitions: dict = None, **kwargs):
+        """
+        Connection to an Emulated Controller, exposes the subset of the LogixDriver interface used by the simulator.
+        Every read/write is split in packets like Pycomm3 does and each packet goes through send(), so the requests
+        can be counted the same way as on a real connection.
+
+        :param controller: Emulated Controller to connect to, None if nothing answers on the address
+        :param init_tags: Uploads the tag definitions when the connection is opened
+        :param tag_definitions: Tag definitions uploaded before, used instead of uploading them, like CachedTagDriver
+        """
+
+        self.controller = controller
+        self.init_tags = init_tags and tag_definitions is None
+        self.connected = False
+        self._tag_definitions = tag_definitions if tag_definitions is not None else {}
+        self._reply = b''  # Reply of the last request, returned by _receive()
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def info(self) -> dict:
+        return self.controller.info if self.controller is not None else {}
+
+    @property
+    def tags(self) -> dict:
+        return self._tag_definitions
+
+    def use_tag_definitions(self, tag_definitions: dict):
+        self._tag_definitions = tag_definitions
+
+    def open(self):
+        if self.controller is None or not self.controller.available:
+            raise CommError('failed to open a connection')
+        self.connected = True
+        if self.init_tags:
+            self.get_tag_list()
+        return True
+
+    def close(self):
+        self.connected = False
+
+    def get_tag_list(self, program=None) -> list:
+        self._check_connection()
+        self._tag_definitions = self.controller.tag_definitions()
+        return list(self._tag_definitions.values())
+
+    def get_plc_time(self) -> Tag:
+        response = self.send(EmulatedRequest('get_plc_time', [], bytes(PACKET_OVERHEAD)))
+        return response.results[0]
+
+    def read(self, *tags):
+        controller = self.controller
+        request_sizes = [4 + _path_size(tag) for tag in tags]
+        reply_sizes = [6 + controller.tag_size(tag) for tag in tags]
+
+        results = []
+        for packet in self._packets(tags, request_sizes, reply_sizes):
+            results.extend(self.send(EmulatedRequest('read', *packet)).results)
+        return results if len(tags) != 1 else results[0]
+
+    def write(self, *tags_values):
+        if len(tags_values) == 2 and isinstance(tags_values[0], str):
+            tags_values = (tags_values,)
+        controller = self.controller
+        request_sizes = [8 + _path_size(tag) + controller.tag_size(tag) for tag, _ in tags_values]
+        reply_sizes = [4] * len(tags_values)
+
+        results = []
+        for packet in self._packets(tags_values, request_sizes, reply_sizes):
+            results.extend(self.send(EmulatedRequest('write', *packet)).results)
+        return results if len(tags_values) != 1 else results[0]
+
+    def send(self, request: EmulatedRequest) -> EmulatedResponse:
+        """
+        Sends a request to the controller, waits for the emulated round trip and executes it
+
+        :param request: Emulated Request
+        :return: Emulated Response
+        """
+        self._send(request.message)
+        controller = self.controller
+        round_trip = controller.latency + (random.uniform(0, controller.jitter) if controller.jitter else 0)
+        if round_trip > 0:
+            time.sleep(round_trip)
+
+        with controller.lock:
+            controller.request_count += 1
+            if request.service == 'read':
+                results = [controller.read_tag(tag) for tag in request.items]
+            elif request.service == 'write':
+                results = [controller.write_tag(tag, value) for tag, value in request.items]
+            else:
+                now = time.time()
+                results = [Tag('__VALUE', {'string': time.strftime('%A, %B %d, %Y %I:%M:%S%p', time.localtime(now)),
+                                           'microseconds': int(now * 1e6)}, None, None)]
+
+        reply_size = PACKET_OVERHEAD + sum(6 + _data_size(result.type) if request.service == 'read' and result.type
+                                           else 4 for result in results)
+        self._reply = bytes(reply_size)
+        return EmulatedResponse(results, self._receive())
+
+    def _send(self, message: bytes):
+        # Wire level hooks of the CIPDriver, every request goes through them, the connection instrumentation wraps them
+        self._check_connection()
+
+    def _receive(self) -> bytes:
+        return self._reply
+
+    def _check_connection(self):
+        if not self.connected or not self.controller.available:
+            self.connected = False
+            raise CommError('connection to the emulated controller lost')
+
+    def _packets(self, items, request_sizes: list, reply_sizes: list):
+        """
+        Splits the items of a read/write in packets that fit the connection size
+
+        :return: Generator of (items, request message) tuples
+        """
+        limit = self.controller.connection_size - PACKET_OVERHEAD
+        packet, request_size, reply_size = [], 0, 0
+        for item, item_request, item_reply in zip(items, request_sizes, reply_sizes):
+            if packet and (request_size + item_request > limit or reply_size + item_reply > limit):
+                yield packet, bytes(PACKET_OVERHEAD + request_size)
+                packet, request_size, reply_size = [], 0, 0
+            packet.append(item)
+            request_size += item_request
+            reply_size += item_reply
+        if packet:
+            yield packet, bytes(PACKET_OVERHEAD + request_size)
+
+
+class ControllerEmulator:
+
+    def __init__(self):
+        """
+        Set of Emulated Controllers, stands in for the PLC network. driver() replaces LogixDriver wherever a
+        connection is opened, addresses without a controller behave like an unreachable PLC.
+        """
+
+        self.controllers = {}  # PLC Address -> EmulatedController
+
+    def add_controller(self, controller: EmulatedController) -> EmulatedController:
+        self.controllers[controller.plc_address] = controller
+        return controller
+
+    def add_tag_export(self, plc_address: str, tag_file: str, **kwargs) -> EmulatedController:
+        """
+        Adds a controller serving the tags of an RSLogix 5000 CSV tag export
+
+        :param plc_address: PLC IP/Slot number the controller answers on
+        :param tag_file: RSLogix 5000 CSV tag export
+        :param kwargs: Arguments passed on to the Emulated Controller
+        :return: Emulated Controller
+        """
+        return self.add_controller(EmulatedController.from_tag_export(plc_address, tag_file, **kwargs))
+
+    def driver(self, plc_address: str, init_tags=True, **kwargs) -> EmulatedDriver:
+        """
+        Drop-in replacement of the CachedTagDriver constructor
+
+        :param plc_address: PLC IP/Slot number
+        :param init_tags: Uploads the tag definitions when the connection is opened
+        :return: Emulated Driver, not connected yet
+        """
+        return EmulatedDriver(self.controllers.get(plc_address), init_tags, **kwargs)
@@ -0,0 +1,137 @@
+from pycomm3 import Tag
+
+import FieldObjects
+from DeviceRegistry import ControllerDevices
+
+# What a producer device exposes through a tag
+_OPEN_LS = 0  # Open limit switch, BOOL
+_CLOSE_LS = 1  # Closed limit switch, BOOL
+_CHANNEL = 2  # UDT_zzAnaIN whose Channel is the feedback of the device
+_TANK_LEVEL = 3  # UDT_zzAnaIN whose Channel is the level of a tank
+_TANK_PRESSURE = 4  # UDT_zzAnaIN whose Channel is the pressure of a tank
+
+
+class DependencyGraph:
+
+    def __init__(self, partition: ControllerDevices, producers: ControllerDevices = None):
+        """
+        Dependency graph of the Analog Input relations of a PLC partition. Relation tags produced by a device of the
+        partition (valve limit switches, Channel of a control valve, of a tank transmitter or of another input) are
+        served from the state of the producing device instead of being read from the PLC, and the inputs are evaluated
+        in dependency order so a consumer sees the value its producer calculated on the same scan. Only the remaining
+        tags are read.
+
+        Local UDT_zzAnaIN values only hold the Channel member, the only one the relations use.
+
+        :param partition: Devices owned by the PLC, compile() must be called again if it changes
+        :param producers: Devices whose state can serve relation tags, the partition by default. When the partition is
+        a part of the devices of a PLC, producers outside of it serve the value of their last scan.
+        """
+
+        self.partition = partition
+        self.producers = producers if producers is not None else partition
+        self.levels = []  # Analog Inputs grouped in evaluation order, an input only depends on earlier levels
+        self.cyclic = []  # Analog Inputs in dependency loops, evaluated last with the previous scan values
+        self.external_tags = []  # Tags still read from the PLC
+        self.level_locals = []  # Local tags consumed by every level
+        self._local = {}  # Relation tag name -> (producer device, what it exposes)
+        self.compile()
+
+    def compile(self):
+        """
+        Finds the producer of every relation tag and sorts the inputs in levels
+
+        :return:
+        """
+        producers = {}  # Tag name, lower case as Logix tag names aren't case sensitive -> (device, kind)
+        for valve in self.producers.valves_sw:
+            producers[valve.open_ind_tag.lower()] = (valve, _OPEN_LS)
+            producers[valve.close_ind_tag.lower()] = (valve, _CLOSE_LS)
+        for valve in self.producers.valves_anl:
+            producers[valve.opn_ind_ls_tag.lower()] = (valve, _OPEN_LS)
+            producers[valve.cls_ind_ls_tag.lower()] = (valve, _CLOSE_LS)
+            producers[valve.valve_name.lower()] = (valve, _CHANNEL)
+        for inp in self.producers.anl_inp:
+            if inp.feedback_tag.lower().endswith('.channel'):
+                producers[inp.feedback_tag[:-len('.Channel')].lower()] = (inp, _CHANNEL)
+        for tank in self.producers.tanks:
+            for tag, kind in ((tank.level_tag, _TANK_LEVEL), (tank.pressure_tag, _TANK_PRESSURE)):
+                if tag.lower().endswith('.channel'):
+                    producers[tag[:-len('.Channel')].lower()] = (tank, kind)
+
+        # Dependencies between inputs, references to itself take the previous scan value and aren't dependencies
+        inputs = self.partition.anl_inp
+        input_set = set(inputs)
+        self._local = {}
+        depends_on = {}  # Input -> inputs it depends on
+        consumed = {}  # Input -> local tags it consumes
+        for inp in inputs:
+            depends_on[inp] = set()
+            consumed[inp] = []
+            for tag in inp.scan_tags():
+                producer = producers.get(tag.lower())
+                if producer is None:
+                    continue
+                self._local[tag] = producer
+                consumed[inp].append(tag)
+                if producer[0] in input_set and producer[0] is not inp:
+                    depends_on[inp].add(producer[0])
+
+        # Kahn's algorithm, one level per pass
+        self.levels = []
+        pending = dict(depends_on)
+        while pending:
+            level = [inp for inp in inputs if inp in pending and not (pending[inp] & pending.keys())]
+            if not level:
+                break
+            self.levels.append(level)
+            for inp in level:
+                del pending[inp]
+
+        self.cyclic = [inp for inp in inputs if inp in pending]
+        if self.cyclic:
+            print(f'Analog Input relations with dependency loops, evaluated with previous scan values: '
+                  f'{", ".join(inp.input_name for inp in self.cyclic)}')
+            self.levels.append(self.cyclic)
+
+        # Local tags loaded right before every level is evaluated, its producers are done by then
+        self.level_locals = [list(dict.fromkeys(tag for inp in level for tag in consumed[inp]))
+                             for level in self.levels]
+
+        device_tags = [tag for device in self.partition.valves_sw + self.partition.valves_anl
+                       for tag in device.scan_tags()]
+        relation_tags = [tag for inp in inputs for tag in inp.scan_tags() if tag not in self._local]
+        self.external_tags = list(dict.fromkeys(device_tags + relation_tags))
+
+    def local_tag(self, tag: str) -> Tag:
+        """
+        :param tag: Relation tag produced by a device of the partition
+        :return: Pycomm3 Tag with the current value of the producer, as it would be read from the PLC
+        """
+        device, kind = self._local[tag]
+        if kind == _TANK_LEVEL:
+            return Tag(tag, {'Channel': device.level_counts()}, 'UDT_zzAnaIN', None)
+        if kind == _TANK_PRESSURE:
+            return Tag(tag, {'Channel': device.pressure_counts()}, 'UDT_zzAnaIN', None)
+        if kind == _CHANNEL:
+            if isinstance(device, FieldObjects.AnalogInput):
+                value = max(min(device.maxRng, device.feedback_tag_value), device.minRng)  # Trimmed as written
+            else:
+                value = device.valve_fbk_value
+            return Tag(tag, {'Channel': value}, 'UDT_zzAnaIN', None)
+        if isinstance(device, FieldObjects.Valve):
+            value = device.opn_ind if kind == _OPEN_LS else device.cls_ind
+        else:
+            value = device.opn_ind_ls_value if kind == _OPEN_LS else device.cls_ind_ls_value
+        return Tag(tag, bool(value), 'BOOL', None)
+
+    def load_locals(self, tag_data: dict, tags: list):
+        """
+        Adds the current value of locally produced tags to the scan data
+
+        :param tag_data: Dictionary of tag name -> Pycomm3 Tag of the scan
+        :param tags: Local tags to refresh
+        :return:
+        """
+        for tag in tags:
+            tag_data[tag] = self.local_tag(tag)
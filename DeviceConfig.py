@@ -0,0 +1,340 @@
+import os
+import threading
+
+import FieldObjects
+from DeviceRegistry import ControllerDevices, DeviceRegistry
+from RelationList import RelationList
+from TagDatabase import TagDatabase, file_hash
+from TagIndex import TagIndex
+
+
+def create_devices(plc_address: str, devices: list, tag_names: set, class_scan: dict = None) -> list:
+    """
+    Creates the field devices of a PLC from the device tags of its tag export
+
+    Switching Valves are the UDT_zzVNC (Normally Closed) and UDT_zzVNO (Normally Open) tags, the output is at
+    O<name>_OP and the limit switches at I<name>_LS1 / I<name>_LS2.
+    UDT_zzAnaIN tags are Control Valves when their O<name>_SET setpoint tag exists in any PLC, Analog Inputs otherwise.
+    The feedback is at <name>.Channel, data must be returned in PLC RAW Counts 0-65535.
+
+    :param plc_address: PLC IP/Slot number owning the devices
+    :param devices: List of (name, datatype, description) tuples parsed from the tag export
+    :param tag_names: Tag names of all the PLCs, used for global tag search
+    :param class_scan: Device class name -> (scan period, priority) set on the devices created
+    :return: List of Valve, Valve_Analog and AnalogInput objects
+    """
+    created = []
+    for name, datatype, description in devices:
+        opn_ind_ls_tag = 'I' + name[1:] + '_LS1'
+        cls_ind_ls_tag = 'I' + name[1:] + '_LS2'
+        if datatype in ('UDT_zzVNC', 'UDT_zzVNO'):
+            device = FieldObjects.Valve(name, 'O' + name[1:] + '_OP', opn_ind_ls_tag, cls_ind_ls_tag, plc_address,
+                                        datatype != 'UDT_zzVNC')
+        elif datatype == 'UDT_zzAnaIN':
+            setpoint_tag = 'O' + name[1:] + '_SET'
+            if setpoint_tag in tag_names:
+                device = FieldObjects.Valve_Analog(name, setpoint_tag, name + '.Channel', opn_ind_ls_tag,
+                                                   cls_ind_ls_tag, plc_address)
+            else:
+                device = FieldObjects.AnalogInput(name, name + '.Channel', plc_address)
+        else:
+            continue
+        device.description = description
+        if class_scan is not None:
+            device.scan_period, device.priority = class_scan[type(device).__name__]
+        created.append(device)
+    return created
+
+
+def device_kind(device) -> tuple:
+    """
+    :return: Device class and valve type, the tags of a device all follow from its name and kind
+    """
+    return type(device).__name__, getattr(device, 'valve_type', None)
+
+
+class DeviceChanges:
+
+    def __init__(self, plc_address: str):
+        """
+        Configuration changes of the devices of a PLC, picklable so they can be handed to the shard processes. Devices
+        are referred to by name, the changes can be applied to any partition holding them.
+
+        :param plc_address: PLC IP/Slot number owning the devices
+        """
+
+        self.plc_address = plc_address
+        self.added = []  # New devices, replaced devices are also listed as removed
+        self.removed = []  # Names of the devices removed
+        self.updated = {}  # Device name -> {attribute: value}
+        self.settings = {}  # Analog Input name -> relation settings, see RelationList
+        self.tag_definitions = None  # New tag definitions of the PLC, None keeps the ones in use
+
+    def apply(self, partition: ControllerDevices, add=True):
+        """
+        Patches a partition in place, the devices not changed keep their state. Applying the same changes twice
+        leaves the partition as applying them once.
+
+        :param partition: Devices of the PLC, or part of them
+        :param add: Adds the new devices, only one of the partitions of a PLC split in parts takes them
+        :return:
+        """
+        devices = {DeviceRegistry.device_name(device): device for device in partition.devices}
+        for name in self.removed:
+            device = devices.pop(name, None)
+            if device is not None:
+                partition.remove(device)
+        if add:
+            for device in self.added:
+                name = DeviceRegistry.device_name(device)
+                if name not in devices:
+                    partition.add(device)
+                    devices[name] = device
+
+        # Flow Links follow the valves replaced
+        for tank in partition.tanks:
+            for link in tank.links:
+                if link.valve is not None:
+                    link.valve = devices.get(DeviceRegistry.device_name(link.valve), link.valve)
+
+        for name, attributes in self.updated.items():
+            device = devices.get(name)
+            if device is not None:
+                for attribute, value in attributes.items():
+                    setattr(device, attribute, value)
+        for name, settings in self.settings.items():
+            inp = devices.get(name)
+            if isinstance(inp, FieldObjects.AnalogInput):
+                RelationList.apply(inp, settings)
+        partition.build_tag_list()
+
+    def replaced(self) -> set:
+        """
+        :return: Names of the devices both removed and added
+        """
+        return {DeviceRegistry.device_name(device) for device in self.added} & set(self.removed)
+
+    def __len__(self):
+        return len(self.added) + len(self.removed) - len(self.replaced()) + len(set(self.updated) | set(self.settings))
+
+    def __repr__(self):
+        replaced = self.replaced()
+        return f'PLC {self.plc_address} - {len(self.added) - len(replaced)} devices added, ' \
+               f'{len(self.removed) - len(replaced)} removed, {len(replaced)} replaced, ' \
+               f'{len(set(self.updated) | set(self.settings))} patched' + \
+               (', new tag definitions' if self.tag_definitions is not None else '')
+
+
+def patch_worker(worker, changes: DeviceChanges, add=True, registry: DeviceRegistry = None):
+    """
+    Hands the changes to a Scan Worker, applied by the worker between two scans. Feedback writes go on with the next
+    scan, the Write Cache of the engine is kept.
+
+    :param worker: ControllerWorker or AsyncControllerWorker scanning the PLC
+    :param changes: Device Changes of the PLC
+    :param add: Adds the new devices to the partition of the worker
+    :param registry: Device Registry re-indexed once the changes are applied, if given
+    :return:
+    """
+    def change():
+        engine = worker.engine
+        changes.apply(engine.partition, add)
+        if changes.tag_definitions is not None:
+            worker.session.use_tag_definitions(changes.tag_definitions)
+        # Tags of the devices changed are resolved against the tag database, the engine is compiled with them next
+        if engine.tag_index is not None:
+            if changes.tag_definitions is not None:
+                engine.tag_index = TagIndex(changes.tag_definitions, changes.plc_address)
+                engine.tag_index.report(engine.partition.devices)
+            else:
+                engine.tag_index.report([device for device in engine.partition.devices
+                                         if DeviceRegistry.device_name(device) in changes.settings])
+        if registry is not None:
+            registry.reindex()
+
+    worker.engine.between_scans(change)
+
+
+class ConfigReloader:
+
+    def __init__(self, registry: DeviceRegistry, relation_list: RelationList, tag_database: TagDatabase,
+                 tag_files: dict, class_scan: dict = None, scheduler=None, supervisor=None, check_time=5.0):
+        """
+        Watches the relation list and the tag exports and patches the live devices when they change, without
+        restarting the simulator. The new configuration is diffed against the Device Registry and only the devices
+        that changed are patched, in place and between two scans of their PLC: relation settings are applied to the
+        Analog Inputs, devices added to or removed from a tag export are added or removed, and the devices whose kind
+        changed are replaced. Tags are only uploaded again from the PLCs whose tag export changed.
+
+        Tanks and Flow Links aren't reloaded.
+
+        :param registry: Device Registry of the devices scanned
+        :param relation_list: Relation List loaded at startup
+        :param tag_database: Tag Database the PLC tags were loaded from
+        :param tag_files: PLC address -> tag export
+        :param class_scan: Device class name -> (scan period, priority) of the devices created
+        :param scheduler: ScanScheduler or AsyncScanScheduler scanning the devices in this process
+        :param supervisor: ShardSupervisor scanning the devices in shard processes, instead of the scheduler
+        :param check_time: Time between checks of the files, in sec
+        """
+
+        self.registry = registry
+        self.relation_list = relation_list
+        self.tag_database = tag_database
+        self.tag_files = tag_files
+        self.class_scan = class_scan
+        self.scheduler = scheduler
+        self.supervisor = supervisor
+        self.check_time = check_time
+        self.reload_count = 0
+        self.error_count = 0
+        self._stats = {}  # File -> (mtime, size) when last checked, the file is only hashed again when they change
+        self._hashes = {plc_address: file_hash(tag_file) for plc_address, tag_file in tag_files.items()}
+        self._retry = set()  # PLC addresses and relation list whose last reload failed, hashed on every check
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        for filename in [self.relation_list.filename] + list(self.tag_files.values()):
+            self._modified(filename)
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._watch_loop, name='ConfigReloader', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def check(self) -> list:
+        """
+        Reloads the files changed since the last check and hands the changes to the scans
+
+        :return: List of Device Changes applied
+        """
+        # Every file is stat'ed once per check, several PLCs can share a tag export
+        relation_file = self.relation_list.filename
+        modified = {filename for filename in {relation_file, *self.tag_files.values()} if self._modified(filename)}
+
+        # The relation list is loaded first, the inputs created by a tag export reloaded on the same check take the
+        # new settings
+        relations_changed = (relation_file in modified or relation_file in self._retry) and \
+            self.relation_list.changed() and self._reload_relation_list()
+
+        changes = {}  # PLC address -> Device Changes
+        for plc_address, tag_file in self.tag_files.items():
+            if (tag_file in modified or plc_address in self._retry) and \
+                    file_hash(tag_file) != self._hashes[plc_address]:
+                plc_changes = self._reload_tag_export(plc_address, tag_file)
+                if plc_changes is not None:
+                    changes[plc_address] = plc_changes
+
+        if relations_changed:
+            # Only the inputs already scanned are compared, the ones added or replaced above have their settings
+            added = {plc_address: {DeviceRegistry.device_name(device) for device in plc_changes.added}
+                     for plc_address, plc_changes in changes.items()}
+            for inp, settings in self.relation_list.diff(self.registry).items():
+                if inp.input_name in added.get(inp.plc_address, ()):
+                    continue
+                if inp.plc_address not in changes:
+                    changes[inp.plc_address] = DeviceChanges(inp.plc_address)
+                changes[inp.plc_address].settings[inp.input_name] = settings
+
+        applied = [plc_changes for plc_changes in changes.values() if len(plc_changes) or plc_changes.tag_definitions]
+        for plc_changes in applied:
+            self.apply(plc_changes)
+            print(f'Configuration reloaded: {plc_changes!r}')
+        self.reload_count += len(applied)
+        return applied
+
+    def apply(self, changes: DeviceChanges):
+        """
+        Hands the changes of a PLC to the worker scanning it, or to its shard process
+
+        :param changes: Device Changes of the PLC
+        :return:
+        """
+        if self.supervisor is not None:
+            # Nothing scans the devices of this process, the registry is patched straight away
+            changes.apply(self.registry.controller(changes.plc_address))
+            self.registry.reindex()
+            self.supervisor.apply_changes(changes)
+            return
+
+        for worker in self.scheduler.workers:
+            if worker.plc_address == changes.plc_address:
+                patch_worker(worker, changes, registry=self.registry)
+
+    def _reload_tag_export(self, plc_address: str, tag_file: str):
+        """
+        :return: Device Changes of the PLC, None if the tag export couldn't be loaded
+        """
+        try:
+            # A changed tag export drops the cached tag definitions, they are uploaded again from this PLC only
+            controller = self.tag_database.load_controller(plc_address, tag_file)
+            self.tag_database.save()
+        except Exception as err:
+            self.error_count += 1
+            self._retry.add(plc_address)
+            print(f'Tag export {tag_file} of PLC {plc_address} not reloaded ({err!r}), retrying on the next check')
+            return None
+        self._retry.discard(plc_address)
+        self._hashes[plc_address] = controller.tag_file_hash
+
+        changes = DeviceChanges(plc_address)
+        changes.tag_definitions = controller.tags
+
+        # Kind of the Analog Devices depends on the tags of all the PLCs
+        tag_names = set().union(*(tags.tags for tags in self.tag_database.controllers.values() if tags.tags))
+        live = {DeviceRegistry.device_name(device): device for device in self.registry.controller(plc_address).devices
+                if not isinstance(device, FieldObjects.Tank)}
+        for device in create_devices(plc_address, controller.devices, tag_names, self.class_scan):
+            name = DeviceRegistry.device_name(device)
+            old = live.pop(name, None)
+            if old is None or device_kind(old) != device_kind(device):
+                if old is not None:
+                    changes.removed.append(name)
+                settings = self.relation_list.settings.get(name)
+                if settings is not None and isinstance(device, FieldObjects.AnalogInput):
+                    RelationList.apply(device, settings)
+                changes.added.append(device)
+            elif old.description != device.description:
+                changes.updated[name] = {'description': device.description}
+        changes.removed.extend(live)
+        return changes
+
+    def _reload_relation_list(self) -> bool:
+        """
+        :return: TRUE if the relation list was loaded
+        """
+        try:
+            self.relation_list.load()
+        except (OSError, ValueError) as err:
+            self.error_count += 1
+            self._retry.add(self.relation_list.filename)
+            print(f'Relation list {self.relation_list.filename} not reloaded ({err!r}), retrying on the next check')
+            return False
+        self._retry.discard(self.relation_list.filename)
+        return True
+
+    def _modified(self, filename: str) -> bool:
+        """
+        :return: TRUE if the modification time or the size of the file changed since the last call
+        """
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return False
+        signature = (stat.st_mtime_ns, stat.st_size)
+        modified = self._stats.get(filename) != signature
+        self._stats[filename] = signature
+        return modified
+
+    def _watch_loop(self):
+        while not self._stop_event.wait(self.check_time):
+            try:
+                self.check()
+            except Exception as err:
+                self.error_count += 1
+                print(f'Configuration reload failed ({err!r})')
+
@@ -0,0 +1,169 @@
+import FieldObjects
+
+
+class ControllerDevices:
+
+    def __init__(self, plc_address: str):
+        """
+        Partition of the field devices owned by a single PLC, holds the prebuilt list of tags to be read on every scan
+
+        :param plc_address: PLC IP/Slot number owning the devices
+        """
+
+        self.plc_address = plc_address
+        self.valves_sw = []  # Switching Valves
+        self.valves_anl = []  # Analog Valves
+        self.anl_inp = []  # Analog Inputs
+        self.tanks = []  # Tanks of the process model
+        self.devices = []  # All devices in scan order
+        self.read_tags = []  # Tags read from the PLC on every scan, without duplicates
+
+    def add(self, device):
+        """
+        Adds a device to the partition, build_tag_list() must be called once all devices have been added
+
+        :param device: Valve, Valve_Analog, AnalogInput or Tank object
+        :return:
+        """
+        if isinstance(device, FieldObjects.Valve):
+            self.valves_sw.append(device)
+        elif isinstance(device, FieldObjects.Valve_Analog):
+            self.valves_anl.append(device)
+        elif isinstance(device, FieldObjects.AnalogInput):
+            self.anl_inp.append(device)
+        elif isinstance(device, FieldObjects.Tank):
+            self.tanks.append(device)
+        else:
+            raise TypeError(f'Unsupported device type {type(device).__name__}')
+
+    def remove(self, device):
+        """
+        Removes a device from the partition, build_tag_list() must be called once all devices have been removed
+
+        :param device: Valve, Valve_Analog, AnalogInput or Tank object
+        :return:
+        """
+        for devices in (self.valves_sw, self.valves_anl, self.anl_inp, self.tanks):
+            if device in devices:
+                devices.remove(device)
+                return
+
+    def build_tag_list(self):
+        """
+        Builds the device scan order and gathers the input tags of every device into a single list without
+        duplicates, needs to be called again if devices or their tags are changed
+
+        :return:
+        """
+        self.devices = self.valves_sw + self.valves_anl + self.tanks + self.anl_inp
+        self.read_tags = list(dict.fromkeys(tag for device in self.devices for tag in device.scan_tags()))
+
+    def split(self, max_devices: int) -> list:
+        """
+        Splits the partition in smaller partitions of the same PLC, each one scanned over its own connection
+
+        :param max_devices: Maximum number of devices per partition
+        :return: List of ControllerDevices, only this partition if it's small enough
+        """
+        if len(self.devices) <= max_devices:
+            return [self]
+
+        partitions = []
+        for start in range(0, len(self.devices), max_devices):
+            partition = ControllerDevices(self.plc_address)
+            for device in self.devices[start:start + max_devices]:
+                partition.add(device)
+            partition.build_tag_list()
+            partitions.append(partition)
+        return partitions
+
+    def __len__(self):
+        return len(self.devices)
+
+
+class DeviceRegistry:
+
+    def __init__(self):
+        """
+        Registry of all the field devices, partitioned by PLC when the devices are added so each PLC connection only
+        ever iterates the devices it owns
+        """
+
+        self._controllers = {}  # PLC Address -> ControllerDevices
+        self._devices_by_name = {}  # Device Name -> Device
+
+    def add(self, device):
+        """
+        Adds a device to the partition of its PLC
+
+        :param device: Valve, Valve_Analog, AnalogInput or Tank object
+        :return:
+        """
+        partition = self._controllers.get(device.plc_address)
+        if partition is None:
+            partition = self._controllers[device.plc_address] = ControllerDevices(device.plc_address)
+        partition.add(device)
+        self._devices_by_name[self.device_name(device)] = device
+
+    def build_tag_lists(self):
+        """
+        Builds the tag lists of every partition
+
+        :return:
+        """
+        for partition in self._controllers.values():
+            partition.build_tag_list()
+
+    def reindex(self):
+        """
+        Indexes the devices by name again, needs to be called once devices are added to or removed from the
+        partitions directly
+
+        :return:
+        """
+        self._devices_by_name = {self.device_name(device): device
+                                 for partition in self._controllers.values()
+                                 for device in partition.valves_sw + partition.valves_anl + partition.tanks +
+                                 partition.anl_inp}
+
+    def controller(self, plc_address: str) -> ControllerDevices:
+        """
+        Returns the partition of a PLC, an empty partition is created if the PLC doesn't own any device
+
+        :param plc_address: PLC IP/Slot number
+        :return: ControllerDevices partition
+        """
+        partition = self._controllers.get(plc_address)
+        if partition is None:
+            partition = self._controllers[plc_address] = ControllerDevices(plc_address)
+        return partition
+
+    def controllers(self) -> list:
+        """
+        :return: List of the PLC addresses owning devices
+        """
+        return list(self._controllers)
+
+    def find(self, name: str):
+        """
+        Finds a device by name
+
+        :param name: Valve, Input or Tank name
+        :return: The device, None if not found
+        """
+        return self._devices_by_name.get(name)
+
+    @staticmethod
+    def device_name(device) -> str:
+        if isinstance(device, FieldObjects.AnalogInput):
+            return device.input_name
+        if isinstance(device, FieldObjects.Tank):
+            return device.name
+        return device.valve_name
+
+    def __iter__(self):
+        for partition in self._controllers.values():
+            yield from partition.devices
+
+    def __len__(self):
+        return sum(len(partition) for partition in self._controllers.values())
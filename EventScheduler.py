@@ -0,0 +1,81 @@
+import heapq
+import itertools
+
+
+class ScheduledEvent:
+    __slots__ = ('due_time', 'callback', 'active')
+
+    def __init__(self, due_time: float, callback):
+        """
+        Event waiting in an Event Scheduler
+
+        :param due_time: Time the event is due
+        :param callback: Function called without arguments when the event is due
+        """
+
+        self.due_time = due_time
+        self.callback = callback
+        self.active = True
+
+
+class EventScheduler:
+
+    def __init__(self):
+        """
+        Heap of timed events, only the events that are due are processed on every scan instead of checking a timer on
+        every device. Not thread safe, each scan worker owns its own scheduler.
+        """
+
+        self._heap = []
+        self._sequence = itertools.count()  # Keeps events due at the same time in scheduling order
+
+    def schedule(self, due_time: float, callback) -> ScheduledEvent:
+        """
+        Schedules a callback
+
+        :param due_time: Time the event is due
+        :param callback: Function called without arguments when the event is due
+        :return: The Scheduled Event, can be handed to cancel()
+        """
+        event = ScheduledEvent(due_time, callback)
+        heapq.heappush(self._heap, (due_time, next(self._sequence), event))
+        return event
+
+    @staticmethod
+    def cancel(event: ScheduledEvent):
+        """
+        Cancels a pending event, the entry is dropped from the heap when it comes due
+
+        :param event: Scheduled Event to cancel
+        :return:
+        """
+        if event is not None:
+            event.active = False
+
+    def run_due(self, now: float) -> int:
+        """
+        Runs all the events due at or before now, in due time order
+
+        :param now: Current time
+        :return: Number of events run
+        """
+        heap = self._heap
+        count = 0
+        while heap and heap[0][0] <= now:
+            event = heapq.heappop(heap)[2]
+            if event.active:
+                event.active = False
+                event.callback()
+                count += 1
+        return count
+
+    def next_due(self):
+        """
+        :return: Due time of the earliest pending event, None if there's none
+        """
+        while self._heap and not self._heap[0][2].active:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def __len__(self):
+        return sum(1 for entry in self._heap if entry[2].active)
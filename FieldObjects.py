@@ -1,18 +1,63 @@
-import time
-
 import pycomm3
 from pycomm3 import LogixDriver
 from pycomm3 import Tag
 
+import SimClock
+
 
 # class Utils:
 
+def read_tag_batch(plc: LogixDriver, tags: list) -> dict:
+    """
+    Reads a list of tags in a single batched call, Pycomm3 packs them into multi-service requests
+
+    :param plc: LogixDriver PLC Object, connection needs to be open before its handed in
+    :param tags: List of tag names to be read
+    :return: Dictionary of tag name -> Pycomm3 Tag
+    """
+    if not tags:
+        return {}
+
+    results = plc.read(*tags)
+    if len(tags) == 1:
+        results = [results]  # Pycomm3 returns a single Tag instead of a list when only one tag is requested
+
+    return dict(zip(tags, results))
+
+
+def write_tag_batch(plc: LogixDriver, write_data: list) -> list:
+    """
+    Writes a list of (tag name, value) pairs in a single batched call
+
+    :param plc: LogixDriver PLC Object, connection needs to be open before its handed in
+    :param write_data: List of (tag name, value) pairs
+    :return: List of Pycomm3 Tag results, in the same order as write_data
+    """
+    if not write_data:
+        return []
+
+    results = plc.write(*write_data)
+    if len(write_data) == 1:
+        results = [results]
+
+    return results
+
+
+# Scan priorities of a device, buckets of a higher priority are scanned first and are never deferred
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+PRIORITIES = {'high': PRIORITY_HIGH, 'normal': PRIORITY_NORMAL, 'low': PRIORITY_LOW}
 
 
 class Valve:
+    # Slotted to avoid a per-instance __dict__, large plants hold tens of thousands of devices
+    __slots__ = ('energise_cmd', 'opn_ind', 'cls_ind', 'opn_time', 'cls_time', 'valve_name', 'description',
+                 'valve_type', 'energise_cmd_tag', 'close_cmd_tag', 'open_ind_tag', 'close_ind_tag', 'plc_address',
+                 'timer', 'done_time', 'last_command', 'scheduler', '_travel_event', 'scan_period', 'priority')
 
     def __init__(self, valve_name: str, energise_cmd_tag: str, opn_ind_ls_tag: str, cls_ind_ls_tag: str,
-                 plc_address: str, nc_valve=False):
+                 plc_address: str, nc_valve=False, opn_time=1, cls_time=1):
         """
         Valve type object used to represent a Switching valve
 
@@ -23,24 +68,30 @@ class Valve:
         :param plc_address: PLC IP/Slot number to R/W Tag data
         :param nc_valve: Defines Valve LS behavior, defaults to TRUE for a normal valve, set to FALSE is behavior is
         inverted as with a Normally Open Valve
+        :param opn_time: Opening travel time before Open indication, in sec
+        :param cls_time: Closing travel time before Closed indication, in sec
         """
 
         self.energise_cmd = False  # Open Command Order Signal from PLC
         self.opn_ind = nc_valve  # Open Indication to Signal PLC
         self.cls_ind = ~nc_valve  # Closed Indication to Signal PLC
-        self.opn_time = 2  # Opening Travel time before Open indication
-        self.cls_time = 2  # Close Travel time before Open indication
+        self.opn_time = opn_time  # Opening Travel time before Open indication
+        self.cls_time = cls_time  # Close Travel time before Closed indication
         self.valve_name = valve_name
         self.description = ''
         self.valve_type = nc_valve  # False = Normally Closed Valve, Energise to Open / True = Normally Open Valve, Energise to Close
         self.energise_cmd_tag = energise_cmd_tag
+        self.close_cmd_tag = 'O' + valve_name[1:] + '_CL'
         self.open_ind_tag = opn_ind_ls_tag
         self.close_ind_tag = cls_ind_ls_tag
         self.plc_address = plc_address
         self.timer = 0  # Hold current time
         self.done_time = 0 # Holds Current time + delay
-        self.limitswitch_delay = 1  # In sec
         self.last_command = 0
+        self.scheduler = None  # Event Scheduler completing the travel, if None the timer is checked on every update
+        self._travel_event = None
+        self.scan_period = None  # Time between scans, in sec, None scans on the base cycle of the PLC
+        self.priority = PRIORITY_NORMAL
 
     def update(self, plc: LogixDriver):
         """
@@ -53,7 +104,7 @@ class Valve:
         self._read_from_plc(plc)
 
         # Process Data
-        self.energise(self.energise_cmd)
+        self.process()
 
         # Write data back to PLC
         self._write_to_plc(plc)
@@ -68,8 +119,48 @@ class Valve:
         # Take all data in
 
         # self.energise_cmd = plc.read(self.energise_cmd_tag).value or bool(plc.read(self.valve_name[:] + '.OUT1').value) or bool(plc.read(self.valve_name[:] + '.OUT2').value)
-        self.energise_cmd = plc.read(self.energise_cmd_tag).value or bool(plc.read('O' + self.valve_name[1:] + '_CL').value)
+        self.load_scan_data(read_tag_batch(plc, self.scan_tags()))
+
+    def scan_tags(self) -> list:
+        """
+        Tags to be read from the PLC on every scan
+
+        :return: List of tag names
+        """
+        return [self.energise_cmd_tag, self.close_cmd_tag]
+
+    def feedback_tags(self) -> list:
+        """
+        Tags written back to the PLC on every scan, the tags of feedback_data()
+
+        :return: List of tag names
+        """
+        return [self.open_ind_tag, self.close_ind_tag]
 
+    def load_scan_data(self, tag_data: dict):
+        """
+        Takes the scan data in from a batched read
+
+        :param tag_data: Dictionary of tag name -> Pycomm3 Tag, must contain all the tags from scan_tags()
+        :return:
+        """
+        self.energise_cmd = tag_data[self.energise_cmd_tag].value or bool(tag_data[self.close_cmd_tag].value)
+
+    def process(self):
+        """
+        Process the data taken in on the last scan
+
+        :return:
+        """
+        self.energise(self.energise_cmd)
+
+    def feedback_data(self) -> list:
+        """
+        Feedback to be written back to the PLC
+
+        :return: List of (tag name, value) pairs
+        """
+        return [(self.open_ind_tag, self.opn_ind), (self.close_ind_tag, self.cls_ind)]
 
     def energise(self, command: bool):
         """
@@ -83,25 +174,53 @@ class Valve:
             # Turn OFF Both LS and restart timer
             self.opn_ind = False
             self.cls_ind = False
-            self._reset_timer()
             self.last_command = self.energise_cmd
+            self._reset_timer()
 
-        if self._check_timer():
-            if not self.valve_type:  # Normally Closed Valve Type
-                if command:
-                    self.opn_ind = True
-                    self.cls_ind = False
-                else:
-                    self.opn_ind = False
-                    self.cls_ind = True
+        # With a scheduler the limit switches are set by the travel event instead
+        if self.scheduler is None and self._check_timer():
+            self._set_limit_switches(command)
 
-            if self.valve_type:  # Normally Open Valve Type
-                if command:
-                    self.opn_ind = False
-                    self.cls_ind = True
-                else:
-                    self.opn_ind = True
-                    self.cls_ind = False
+    def set_scheduler(self, scheduler):
+        """
+        Hands the valve travel over to an Event Scheduler, a pending travel is scheduled straight away
+
+        :param scheduler: EventScheduler object, None goes back to checking the timer on every update
+        :return:
+        """
+        if self.scheduler is not None:
+            self.scheduler.cancel(self._travel_event)
+        self.scheduler = scheduler
+        self._travel_event = None
+        if scheduler is not None:
+            self._travel_event = scheduler.schedule(self.done_time, self._travel_done)
+
+    def _travel_done(self):
+        self._travel_event = None
+        self._set_limit_switches(self.last_command)
+
+    def _set_limit_switches(self, command: bool):
+        """
+        Sets the limit switches to the end position of the command
+
+        :param command: TRUE or FALSE
+        :return:
+        """
+        if not self.valve_type:  # Normally Closed Valve Type
+            if command:
+                self.opn_ind = True
+                self.cls_ind = False
+            else:
+                self.opn_ind = False
+                self.cls_ind = True
+
+        if self.valve_type:  # Normally Open Valve Type
+            if command:
+                self.opn_ind = False
+                self.cls_ind = True
+            else:
+                self.opn_ind = True
+                self.cls_ind = False
 
     def _write_to_plc(self, plc: LogixDriver):
         """
@@ -113,15 +232,20 @@ class Valve:
         # with LogixDriver(self.plc_address) as plc:
         #     plc.write(self.open_ind_tag, self.opn_ind)
         #     plc.write(self.close_ind_tag, self.cls_ind)
-        plc.write(self.open_ind_tag, self.opn_ind)
-        plc.write(self.close_ind_tag, self.cls_ind)
+        plc.write(*self.feedback_data())
 
     def _reset_timer(self):
-        self.timer = time.time()
-        self.done_time = self.timer + self.limitswitch_delay
+        self.timer = SimClock.now()
+        # Energised NC valves and de-energised NO valves travel to open
+        opening = bool(self.last_command) != bool(self.valve_type)
+        self.done_time = self.timer + (self.opn_time if opening else self.cls_time)
+
+        if self.scheduler is not None:
+            self.scheduler.cancel(self._travel_event)
+            self._travel_event = self.scheduler.schedule(self.done_time, self._travel_done)
 
     def _check_timer(self):
-        self.timer = time.time()
+        self.timer = SimClock.now()
         if self.done_time - self.timer <= 0:
             return True  # Timer Done
         else:
@@ -129,7 +253,16 @@ class Valve:
 
 
 
+# SP scaling of the Control Valves, read from the UDT_zzAnaIN MIN/MAX members
+SCALING_REFRESH_TIME = 60.0  # Time between scaling reads, in sec
+SCALING_CHECK_TIME = 5.0  # Shortest time between scaling reads while the SP is out of the cached range, in sec
+
+
 class Valve_Analog:
+    __slots__ = ('valve_name', 'description', 'valve_sp_tag', 'valve_sp_value', 'valve_fbk_tag', 'valve_fbk_value', 'plc_address',
+                 '_tag_sp_data', 'opn_ind_ls_tag', 'cls_ind_ls_tag', 'opn_ind_ls_value',
+                 'cls_ind_ls_value', 'minRng', 'maxRng', 'scan_period', 'priority', 'sp_min', 'sp_max', 'scaling_time',
+                 'scaling_due')
 
     def __init__(self, valve_name, valve_sp_tag, valve_fbk_tag, opn_ind_ls_tag, cls_ind_ls_tag, plc_address):
         """
@@ -144,13 +277,13 @@ class Valve_Analog:
         """
 
         self.valve_name = valve_name
+        self.description = ''
         self.valve_sp_tag = valve_sp_tag
         self.valve_sp_value = 0
         self.valve_fbk_tag = valve_fbk_tag
         self.valve_fbk_value = 0
         self.plc_address = plc_address
         self._tag_sp_data = Tag
-        self._tag_data = Tag
         self.opn_ind_ls_tag = opn_ind_ls_tag
         self.cls_ind_ls_tag = cls_ind_ls_tag
         self.opn_ind_ls_value = 0
@@ -158,6 +291,13 @@ class Valve_Analog:
         self.minRng = 6240 + 100
         self.maxRng = 31208
         # self.maxRng = 24968 - 100
+        self.scan_period = None  # Time between scans, in sec, None scans on the base cycle of the PLC
+        self.priority = PRIORITY_NORMAL
+        # SP scaling of the valve UDT, read on a slow schedule instead of reading the whole UDT on every scan
+        self.sp_min = None  # None until the scaling has been read
+        self.sp_max = None
+        self.scaling_time = 0.0  # Time of the last scaling read
+        self.scaling_due = 0.0  # Time of the next scaling read, due on the first scan
 
 
     def update(self, plc: LogixDriver):
@@ -171,7 +311,7 @@ class Valve_Analog:
         self._read_from_plc(plc)
 
         # Process Data
-        self._process_data()
+        self.process()
 
         # Write data back to PLC
         self._write_to_plc(plc)
@@ -183,21 +323,89 @@ class Valve_Analog:
         :return:
         """
 
-        self._tag_sp_data = plc.read(self.valve_sp_tag)
-        self._tag_data = plc.read(self.valve_name)
+        refresh_scaling = self.scaling_due <= SimClock.now()
+        tags = self.scan_tags() + self.scaling_tags() if refresh_scaling else self.scan_tags()
+        tag_data = read_tag_batch(plc, tags)
+        if refresh_scaling:
+            self.load_scaling_data(tag_data)
+        self.load_scan_data(tag_data)
         # print(self._tag_sp_data)
 
+    def scan_tags(self) -> list:
+        """
+        Tags to be read from the PLC on every scan, the SP scaling is read apart when due, see scaling_tags()
+
+        :return: List of tag names
+        """
+        return [self.valve_sp_tag]
+
+    def feedback_tags(self) -> list:
+        """
+        Tags written back to the PLC on every scan, the tags of feedback_data()
+
+        :return: List of tag names
+        """
+        return [self.valve_fbk_tag, self.cls_ind_ls_tag, self.opn_ind_ls_tag]
+
+    def scaling_tags(self) -> list:
+        """
+        UDT members holding the SP scaling, read once and then every SCALING_REFRESH_TIME or when the SP goes out of
+        the cached range
+
+        :return: List of tag names
+        """
+        return [self.valve_name + '.MIN', self.valve_name + '.MAX']
+
+    def load_scaling_data(self, tag_data: dict):
+        """
+        Takes the SP scaling in from a read, the cached scaling is kept if the read failed and retried on the next scan
+
+        :param tag_data: Dictionary of tag name -> Pycomm3 Tag, must contain all the tags from scaling_tags()
+        :return:
+        """
+        min_data = tag_data[self.valve_name + '.MIN']
+        max_data = tag_data[self.valve_name + '.MAX']
+        if min_data.error is not None or max_data.error is not None:
+            return
+        self.sp_min = min_data.value
+        self.sp_max = max_data.value
+        self.scaling_time = SimClock.now()
+        self.scaling_due = self.scaling_time + SCALING_REFRESH_TIME
+
+    def load_scan_data(self, tag_data: dict):
+        """
+        Takes the scan data in from a batched read
+
+        :param tag_data: Dictionary of tag name -> Pycomm3 Tag, must contain all the tags from scan_tags()
+        :return:
+        """
+        self._tag_sp_data = tag_data[self.valve_sp_tag]
+
+    def process(self):
+        """
+        Process the data taken in on the last scan
+
+        :return:
+        """
+        self._process_data()
+
+    def feedback_data(self) -> list:
+        """
+        Feedback to be written back to the PLC
+
+        :return: List of (tag name, value) pairs
+        """
+        return [(self.valve_fbk_tag, self.valve_fbk_value),
+                (self.cls_ind_ls_tag, self.cls_ind_ls_value),
+                (self.opn_ind_ls_tag, self.opn_ind_ls_value)]
+
     def _write_to_plc(self, plc: LogixDriver):
         """
 
         :param plc: LogixDriver PLC Object, connection needs to be open before its handed in
         :return:
         """
-        print(self._tag_data)
-        print(f'"Channel is " {self._tag_data.value["Channel"]}')
-        plc.write((self.valve_fbk_tag, self.valve_fbk_value))
-        plc.write((self.cls_ind_ls_tag, self.cls_ind_ls_value))
-        plc.write((self.opn_ind_ls_tag, self.opn_ind_ls_value))
+        plc.write(*self.feedback_data())
         print(f'"Written Channel to " {self.valve_fbk_value}')
 
     def _process_data(self):
@@ -208,10 +416,13 @@ class Valve_Analog:
 
 
 
-        if self._tag_sp_data.type is not None:
-            max_rng = self._tag_data.value['MAX']
-            min_rng = self._tag_data.value['MIN']
+        if self._tag_sp_data.type is not None and self.sp_min is not None and self.sp_max != self.sp_min:
+            max_rng = self.sp_max
+            min_rng = self.sp_min
             self.valve_sp_value = self._tag_sp_data.value
+            if not min_rng <= self.valve_sp_value <= max_rng:
+                # The scaling may have changed in the PLC, checked again soon without reading it on every scan
+                self.scaling_due = min(self.scaling_due, self.scaling_time + SCALING_CHECK_TIME)
             self.valve_fbk_value = int(((24968 * (self.valve_sp_value - min_rng)) / (max_rng - min_rng)) + 6240)
             if self.valve_fbk_value <= self.minRng:
                 self.cls_ind_ls_value = True
@@ -226,7 +437,33 @@ class Valve_Analog:
 
 
 
+# Relation tags of an Analog Input, in column order of the relation list
+RELATION_SLOTS = ('ext_reference_tag1', 'ext_reference_tag2',
+                  'inc_condition_tag1', 'inc_condition_tag2', 'inc_condition_tag3',
+                  'dec_condition_tag1', 'dec_condition_tag2', 'dec_condition_tag3')
+_RELATION_DATA = tuple(slot + '_data' for slot in RELATION_SLOTS)
+UNSET_TAGS = ('0', '')  # Placeholders of relation tags not configured, never read from the PLC
+UNSET_TAG = Tag('0', None, None, 'Relation tag not configured')
+
+# Evaluation plans of an Analog Input, compiled once from its configuration
+PLAN_HOLD = 0  # Nothing to evaluate, the feedback keeps its value
+PLAN_FIXED = 1  # Fixed value
+PLAN_EXT_REFERENCE = 2  # Max of the External References
+PLAN_INTEGRATING_AND = 3  # Integrating process, all Increase/Decrease conditions must be TRUE
+PLAN_INTEGRATING_OR = 4  # Integrating process, any Increase/Decrease condition TRUE
+
+
 class AnalogInput:
+    __slots__ = ('input_name', 'description', 'feedback_tag', 'feedback_tag_value', 'plc_address', 'fixed_value', 'maxRng', 'minRng',
+                 'incROC', 'decROC', 'simulated_value', 'integrating_process', 'andormode',
+                 'ext_reference_tag1', 'ext_reference_tag2',
+                 'inc_condition_tag1', 'inc_condition_tag2', 'inc_condition_tag3',
+                 'dec_condition_tag1', 'dec_condition_tag2', 'dec_condition_tag3',
+                 'ext_reference_tag1_data', 'ext_reference_tag2_data',
+                 'inc_condition_tag1_data', 'inc_condition_tag2_data', 'inc_condition_tag3_data',
+                 'dec_condition_tag1_data', 'dec_condition_tag2_data', 'dec_condition_tag3_data',
+                 'increase_allowed', 'decrease_allowed', 'time_diff', 'time_last',
+                 'plan', 'plan_slots', 'inc_slots', 'dec_slots', 'scan_period', 'priority')
 
     def __init__(self, input_name, input_feedback_tag, plc_address, ext_reference_tag1='', ext_reference_tag2='',
                  inc_condition_tag1='', inc_condition_tag2='', inc_condition_tag3='', dec_condition_tag1='',
@@ -234,6 +471,7 @@ class AnalogInput:
                  andormode=0, fixed_value=0):
 
         self.input_name = input_name
+        self.description = ''
         self.feedback_tag = input_feedback_tag
         self.feedback_tag_value = 6240
         self.plc_address = plc_address
@@ -273,87 +511,168 @@ class AnalogInput:
         self.decrease_allowed = False
 
         self.time_diff = 0.0
-        self.time_last = time.time()
+        self.time_last = SimClock.now()
+
+        self.plan = PLAN_HOLD
+        self.plan_slots = ()  # (slot column, tag name) of the relation tags the plan needs
+        self.inc_slots = ()  # Increase condition slot columns evaluated
+        self.dec_slots = ()  # Decrease condition slot columns evaluated
+        self.compile()
+
+        self.scan_period = None  # Time between scans, in sec, None scans on the base cycle of the PLC
+        self.priority = PRIORITY_NORMAL
+
+    def compile(self):
+        """
+        Compiles the relation configuration into an evaluation plan and the list of tags it needs, must be called
+        again after the relation tags, integrating process or AND/OR mode are changed
+
+        :return:
+        """
+        tags = [getattr(self, slot) for slot in RELATION_SLOTS]
+        configured = [tag not in UNSET_TAGS for tag in tags]
+        integrating = self.integrating_process == 1
+
+        # Same branches and operator precedence as the checks _process_data used to do on every call
+        ext_mode = configured[0] or (configured[1] and self.integrating_process == 0)
+        inc_mode = configured[2] or configured[3] or (configured[4] and integrating)
+        dec_mode = configured[5] or configured[6] or (configured[7] and integrating)
+        fixed_mode = not configured[0] and not any(configured[2:])
+
+        self.inc_slots = ()
+        self.dec_slots = ()
+        if ext_mode:
+            self.plan = PLAN_EXT_REFERENCE
+            used = [0, 1]
+        elif inc_mode or dec_mode:
+            self.plan = PLAN_INTEGRATING_OR if self.andormode == 1 else PLAN_INTEGRATING_AND
+            self.inc_slots = tuple(col for col in (2, 3, 4) if inc_mode and configured[col])
+            self.dec_slots = tuple(col for col in (5, 6, 7) if dec_mode and configured[col])
+            used = list(self.inc_slots + self.dec_slots)
+        else:
+            self.plan = PLAN_FIXED if fixed_mode else PLAN_HOLD
+            used = []
+
+        self.plan_slots = tuple((col, tags[col]) for col in used if configured[col])
+        for attr in _RELATION_DATA:
+            setattr(self, attr, UNSET_TAG)
 
     def update(self, plc):
         self._read_from_plc(plc)
-        self._process_data()
+        self.process()
         self._write_to_plc(plc)
 
     def _read_from_plc(self, plc: LogixDriver):
 
-        self.ext_reference_tag1_data = plc.read(self.ext_reference_tag1)
-        self.ext_reference_tag2_data = plc.read(self.ext_reference_tag2)
+        self.load_scan_data(read_tag_batch(plc, self.scan_tags()))
 
-        self.inc_condition_tag1_data = plc.read(self.inc_condition_tag1)
-        self.inc_condition_tag2_data = plc.read(self.inc_condition_tag2)
-        self.inc_condition_tag3_data = plc.read(self.inc_condition_tag3)
+    def scan_tags(self) -> list:
+        """
+        Tags to be read from the PLC on every scan, only the ones the evaluation plan uses
 
-        self.dec_condition_tag1_data = plc.read(self.dec_condition_tag1)
-        self.dec_condition_tag2_data = plc.read(self.dec_condition_tag2)
-        self.dec_condition_tag3_data = plc.read(self.dec_condition_tag3)
+        :return: List of tag names
+        """
+        return [tag for _, tag in self.plan_slots]
 
-    def _write_to_plc(self, plc: LogixDriver):
+    def feedback_tags(self) -> list:
+        """
+        Tags written back to the PLC on every scan, the tags of feedback_data()
+
+        :return: List of tag names
+        """
+        return [self.feedback_tag]
+
+    def load_scan_data(self, tag_data: dict):
+        """
+        Takes the scan data in from a batched read
+
+        :param tag_data: Dictionary of tag name -> Pycomm3 Tag, must contain all the tags from scan_tags()
+        :return:
+        """
+        for col, tag in self.plan_slots:
+            setattr(self, _RELATION_DATA[col], tag_data[tag])
 
+    def process(self):
+        """
+        Process the data taken in on the last scan
+
+        :return:
+        """
+        self._process_data()
+
+    def feedback_data(self) -> list:
+        """
+        Feedback to be written back to the PLC, trims the signal and snapshots the time for the next call
+
+        :return: List of (tag name, value) pairs
+        """
         self._trim_signal()
+        self.time_last = SimClock.now()    # Routine finished, snapshot current time to be compared on next call
+
+        return [(self.feedback_tag, self.feedback_tag_value)]
+
+    def _write_to_plc(self, plc: LogixDriver):
+
         # print(f'"Channel is " {self._tag_data.value["Channel"]}')
-        plc.write((self.feedback_tag, self.feedback_tag_value))
+        plc.write(*self.feedback_data())
         # print(f'"Written Channel to " {self.valve_fbk_value}')
 
-        self.time_last = time.time()    # Routine finished, snapshot current time to be compared on next call
-
     def _process_data(self):
 
         self.increase_allowed = False
         self.decrease_allowed = False
 
-        self.time_diff = time.time() - self.time_last   # Calculate time difference between now and last update, used
+        self.time_diff = SimClock.now() - self.time_last   # Calculate time difference between now and last update, used
                                                         # to calculate amount of process units to change per call
 
-        # Check which tags are available and define signal treatment depending on what data is made available
+        # Signal treatment was decided by compile() from the tags configured
+        plan = self.plan
         # ==============================================
-        # Handle Non-Integrating Process
-        # If ExtReferenceTag1 or 2 is != 0 and tag exist, use External Reference
-        if self.ext_reference_tag1 != '0' or self.ext_reference_tag2 != '0' and self.integrating_process == 0:
+        # Sends FixedValue if no tags have been specified
+        if plan == PLAN_FIXED:
+            self.feedback_tag_value = self.fixed_value
+            return
+
+        # ==============================================
+        # Handle Non-Integrating Process, use External Reference
+        if plan == PLAN_EXT_REFERENCE:
             # Both tags are invalid condition
             if not self._check_tag(self.ext_reference_tag1_data) and not self._check_tag(self.ext_reference_tag2_data):
                 print('External Reference Tags are Invalid...')
                 return
 
-            # At least one tag is valid
-            if self._check_tag(self.ext_reference_tag1_data) or self._check_tag(self.ext_reference_tag2_data):
-                # Choose max between the two tagname values
-                self.feedback_tag_value = max(self._extract_tag_value(self.ext_reference_tag1_data),self._extract_tag_value(self.ext_reference_tag2_data),self.minRng)
-                self.simulated_value = self.feedback_tag_value
-                return
+            # At least one tag is valid, choose max between the two tagname values
+            self.feedback_tag_value = max(self._extract_tag_value(self.ext_reference_tag1_data),
+                                          self._extract_tag_value(self.ext_reference_tag2_data), self.minRng)
+            self.simulated_value = self.feedback_tag_value
+            return
 
+        if plan == PLAN_HOLD:
+            return
 
         # ==============================================
         # Handle Integrating Process
         # Check for data type, if real comes from analog
+        inc_data = [getattr(self, _RELATION_DATA[col]) for col in self.inc_slots]
+        dec_data = [getattr(self, _RELATION_DATA[col]) for col in self.dec_slots]
 
         # Handle Increase Condition Tags
-        # Check if there's at least a tagname available and if process is integrating type
-        if self.inc_condition_tag1 != '0' or self.inc_condition_tag2 != '0' or self.inc_condition_tag3 != '0' and self.integrating_process == 1:
-            self.increase_allowed = True
-            if self.andormode == 1: self.increase_allowed = False # OR Mode Selected
-            self._handle_integrating_inc_condition(self.inc_condition_tag1_data)
-            self._handle_integrating_inc_condition(self.inc_condition_tag2_data)
-            self._handle_integrating_inc_condition(self.inc_condition_tag3_data)
+        if inc_data:
+            self.increase_allowed = plan != PLAN_INTEGRATING_OR  # OR Mode starts FALSE
+            for tag in inc_data:
+                self._handle_integrating_inc_condition(tag)
 
         # Handle Decrease Condition Tags
-        if self.dec_condition_tag1 != '0' or self.dec_condition_tag2 != '0' or self.dec_condition_tag3 != '0' and self.integrating_process == 1:
-            self.decrease_allowed = True
-            if self.andormode == 1: self.decrease_allowed = False
-            self._handle_integrating_dec_condition(self.dec_condition_tag1_data)
-            self._handle_integrating_dec_condition(self.dec_condition_tag2_data)
-            self._handle_integrating_dec_condition(self.dec_condition_tag3_data)
+        if dec_data:
+            self.decrease_allowed = plan != PLAN_INTEGRATING_OR
+            for tag in dec_data:
+                self._handle_integrating_dec_condition(tag)
 
         # If all increment or decrement are not Boolean, set its allowed flag to FALSE, only Booleans can yield TRUE
-        if self.inc_condition_tag1_data.type != 'BOOL' and self.inc_condition_tag2_data.type != 'BOOL' and self.inc_condition_tag3_data.type != 'BOOL':
+        if not any(tag.type == 'BOOL' for tag in inc_data):
             self.increase_allowed = False
 
-        if self.dec_condition_tag1_data.type != 'BOOL' and self.dec_condition_tag2_data.type != 'BOOL' and self.dec_condition_tag3_data.type != 'BOOL':
+        if not any(tag.type == 'BOOL' for tag in dec_data):
             self.decrease_allowed = False
 
         # Check for Increase/Decrease allowed and adjust the feedback signal
@@ -367,12 +686,6 @@ class AnalogInput:
                 self.simulated_value = max(self.simulated_value, self.minRng)
 
             self.feedback_tag_value = self.simulated_value
-            return
-
-        # Sends FixedValue if no tags have been specified
-        if self.ext_reference_tag1 == '0' and self.ext_reference_tag1 == '0' and self.inc_condition_tag1 == '0' and self.inc_condition_tag2 == '0' and self.inc_condition_tag3 == '0' \
-                and self.dec_condition_tag1 == '0' and self.dec_condition_tag2 == '0' and self.dec_condition_tag3 == '0':
-            self.feedback_tag_value = self.fixed_value
 
     def _handle_integrating_dec_condition(self, tagname_data: Tag):
         if self._check_tag(tagname_data):
@@ -483,8 +796,80 @@ class AnalogInput:
     #     return int((24968 * engineering_value /100) + 6240)
 
 class Tank:
+    __slots__ = ('name', 'description', 'plc_address', 'level_tag', 'pressure_tag', 'volume', 'full_pressure',
+                 'pressure_range', 'level', 'pressure', 'links', 'minRng', 'maxRng', 'scan_period', 'priority')
+
+    def __init__(self, name: str, plc_address: str, level_tag: str, pressure_tag='0', volume=10.0, full_pressure=1.0,
+                 pressure_range=None, level=0.0):
+        """
+        Tank of the process model, its level and pressure are integrated by the Tank Network from the flows of the
+        Flow Links connected to it and written back as analog feedback
+
+        :param name: Tank Name
+        :param plc_address: PLC IP/Slot number the feedback is written to
+        :param level_tag: Level feedback tag name, UDT_zzAnaIN Channel, '0' if there's no level transmitter
+        :param pressure_tag: Bottom pressure feedback tag name, UDT_zzAnaIN Channel, '0' if there's no pressure
+        transmitter
+        :param volume: Volume at 100% level, in m3
+        :param full_pressure: Bottom pressure at 100% level, in bar
+        :param pressure_range: Pressure at the top of the transmitter range, in bar, full_pressure by default
+        :param level: Initial level, 0..100%
+        """
 
-    def __init__(self, name: str):
         self.name = name
-        self.level = 0  # Tank Level
-        self.pressure = 0  # Tank Pressure
+        self.description = ''
+        self.plc_address = plc_address
+        self.level_tag = level_tag
+        self.pressure_tag = pressure_tag
+        self.volume = volume
+        self.full_pressure = full_pressure
+        self.pressure_range = pressure_range or full_pressure
+        self.level = level  # Tank Level, 0..100%
+        self.pressure = full_pressure * level / 100  # Tank Bottom Pressure, in bar
+        self.links = []  # Flow Links connected to the tank
+        self.minRng = 6240
+        self.maxRng = 31208
+        self.scan_period = None  # Time between scans, in sec, None scans on the base cycle of the PLC
+        self.priority = PRIORITY_NORMAL
+
+    def scan_tags(self) -> list:
+        """
+        Tags to be read from the PLC on every scan, none, the tank is driven by the valves of its links
+
+        :return: List of tag names
+        """
+        return []
+
+    def feedback_tags(self) -> list:
+        """
+        Tags written back to the PLC on every scan, the tags of feedback_data()
+
+        :return: List of tag names
+        """
+        return [tag for tag in (self.level_tag, self.pressure_tag) if tag not in UNSET_TAGS]
+
+    def level_counts(self) -> int:
+        """
+        :return: Level in raw PLC counts
+        """
+        return int((self.maxRng - self.minRng) * self.level / 100 + self.minRng)
+
+    def pressure_counts(self) -> int:
+        """
+        :return: Pressure in raw PLC counts
+        """
+        pressure = max(min(self.pressure / self.pressure_range, 1.0), 0.0)
+        return int((self.maxRng - self.minRng) * pressure + self.minRng)
+
+    def feedback_data(self) -> list:
+        """
+        Feedback to be written back to the PLC
+
+        :return: List of (tag name, value) pairs
+        """
+        feedback = []
+        if self.level_tag not in UNSET_TAGS:
+            feedback.append((self.level_tag, self.level_counts()))
+        if self.pressure_tag not in UNSET_TAGS:
+            feedback.append((self.pressure_tag, self.pressure_counts()))
+        return feedback
@@ -0,0 +1,252 @@
+import math
+import threading
+import time
+from functools import reduce
+
+from pycomm3 import LogixDriver
+
+import SimClock
+from DeviceRegistry import ControllerDevices
+from FieldObjects import PRIORITY_HIGH
+from ScanEngine import ScanEngine, TagCache, WriteCache
+from ScanStats import ScanStats
+from TagIndex import TagIndex
+
+
+class RateBucket:
+
+    def __init__(self, period: float, priority: int, engine: ScanEngine):
+        """
+        Devices of a PLC scanned at the same rate and priority, one batched read and one batched write per scan
+
+        :param period: Time between scans, in sec
+        :param priority: FieldObjects.PRIORITY_HIGH, PRIORITY_NORMAL or PRIORITY_LOW
+        :param engine: Scan Engine of the devices of the bucket
+        """
+
+        self.period = period
+        self.priority = priority
+        self.engine = engine
+        self.next_due = None  # Deadline of the next scan, simulation time, None is due straight away
+        self.scan_count = 0
+        self.deferred_count = 0  # Scans put off to the next tick to keep the higher priority buckets on time
+        self.last_scan_time = 0.0  # Duration of the last scan, in sec, estimates the cost of the next one
+        self._scan_start = 0.0
+
+    def summary(self) -> dict:
+        return {'period': self.period,
+                'priority': self.priority,
+                'devices': len(self.engine.partition),
+                'tags': len(self.engine.read_tags),
+                'scans': self.scan_count,
+                'deferred': self.deferred_count,
+                'last_ms': self.last_scan_time * 1000}
+
+
+class MultiRateEngine:
+
+    def __init__(self, partition: ControllerDevices, default_period=0.5, vectorized_analog=True,
+                 write_refresh_time=None, stats: ScanStats = None, local_relations=True, tag_index: TagIndex = None):
+        """
+        Multi-rate scan of the devices owned by a single PLC. Devices are grouped in Rate Buckets by scan period and
+        priority, each bucket is a Scan Engine scanned on its own deadlines with one batched request, fast loops are
+        scanned more often and slow devices stop taking bandwidth every cycle.
+
+        Same interface as the Scan Engine, the worker scanning the PLC has to tick every cycle_time. On every tick the
+        due buckets are scanned in priority order, buckets below high priority are deferred to the next tick when the
+        estimated cost of the tick goes over the cycle time, unless they are already late by a full period.
+
+        :param partition: Devices owned by the PLC, taken from the Device Registry
+        :param default_period: Scan period of the devices without one, in sec
+        :param vectorized_analog: Steps the Analog Inputs of every bucket with an Analog Kernel
+        :param write_refresh_time: Time between full feedback refreshes of the Write Cache of every bucket, in sec,
+        None writes all the values every scan
+        :param stats: Records the timings of every scan phase and device class if given, shared by all the buckets
+        :param local_relations: Serves the Analog Input relation tags produced by devices of the PLC from their state,
+        also across buckets
+        :param tag_index: Tag Index of the PLC handed to the Scan Engine of every bucket
+        """
+
+        self.partition = partition
+        self.default_period = default_period
+        self.vectorized_analog = vectorized_analog
+        self.write_refresh_time = write_refresh_time
+        self.stats = stats
+        self.local_relations = local_relations
+        self.tag_index = tag_index
+        self.buckets = []  # Rate Buckets in scan order, highest priority and fastest first
+        self.cycle_time = default_period  # Tick of the worker, every bucket period is a multiple of it
+        self.read_tags = []  # Tags read by all the buckets
+        self.tag_cache = TagCache(stats)  # Tags read on the current tick, shared by the buckets
+        self._pending_changes = []  # Device changes applied before the next tick, see between_scans()
+        self._pending_lock = threading.Lock()
+        self.compile()
+
+    def compile(self):
+        """
+        Groups the devices of the partition in Rate Buckets, needs to be called again if the partition is rebuilt or
+        the scan period or priority of a device changes
+
+        :return:
+        """
+        groups = {}  # (period, priority) -> partition
+        for device in self.partition.devices:
+            period = device.scan_period or self.default_period
+            key = (period, device.priority)
+            if key not in groups:
+                groups[key] = ControllerDevices(self.partition.plc_address)
+            groups[key].add(device)
+
+        # Buckets kept from the last compile keep their Write Cache and deadline, a reload doesn't re-write every
+        # feedback or scan every bucket at once
+        previous = {(bucket.period, bucket.priority): bucket for bucket in self.buckets}
+        self.buckets = []
+        for (period, priority), part in sorted(groups.items(), key=lambda item: (item[0][1], item[0][0])):
+            part.build_tag_list()
+            kept = previous.get((period, priority))
+            if kept is not None:
+                write_cache = kept.engine.write_cache
+            else:
+                write_cache = WriteCache(self.write_refresh_time) if self.write_refresh_time is not None else None
+            engine = ScanEngine(part, self.vectorized_analog, write_cache, self.stats, self.local_relations,
+                                self.partition, self.tag_cache, self.tag_index)
+            bucket = RateBucket(period, priority, engine)
+            if kept is not None:
+                bucket.next_due = kept.next_due
+                bucket.scan_count = kept.scan_count
+                bucket.deferred_count = kept.deferred_count
+                bucket.last_scan_time = kept.last_scan_time
+            self.buckets.append(bucket)
+
+        # Greatest common divisor of the periods, in ms, so every deadline falls on a tick
+        periods = [round(bucket.period * 1000) for bucket in self.buckets] or [round(self.default_period * 1000)]
+        self.cycle_time = max(reduce(math.gcd, periods), 1) / 1000
+        self.read_tags = list(dict.fromkeys(tag for bucket in self.buckets for tag in bucket.engine.read_tags))
+
+    def reset(self):
+        """
+        Drops any state tied to the PLC connection, all the buckets are due on the next tick
+
+        :return:
+        """
+        for bucket in self.buckets:
+            bucket.engine.reset()
+            bucket.next_due = None
+
+    def between_scans(self, change):
+        """
+        Queues a change of the devices, applied by the worker right before its next tick so the devices never change
+        in the middle of a scan. The buckets are compiled again after the changes, so changed scan periods and
+        priorities move the devices to their new bucket. Can be called from any thread.
+
+        :param change: Function called without arguments
+        :return:
+        """
+        with self._pending_lock:
+            self._pending_changes.append(change)
+
+    def apply_pending(self) -> bool:
+        """
+        Applies the changes queued by between_scans()
+
+        :return: TRUE if there were changes
+        """
+        with self._pending_lock:
+            changes = self._pending_changes
+            self._pending_changes = []
+        if not changes:
+            return False
+        for change in changes:
+            change()
+        self.compile()
+        return True
+
+    def due(self, now: float) -> list:
+        """
+        Takes the buckets to be scanned on this tick and moves their deadlines to the next period
+
+        :param now: Current simulation time
+        :return: List of Rate Buckets in scan order
+        """
+        due = []
+        cost = 0.0
+        rate = SimClock.get_clock().rate
+        budget = self.cycle_time / rate if rate else math.inf  # Wall clock time of a tick, no limit on a stepped clock
+        for bucket in self.buckets:
+            if bucket.next_due is None:
+                bucket.next_due = now
+            if now + self.cycle_time / 2 < bucket.next_due:  # Ticks can wake up slightly before the deadline
+                continue
+            late = now - bucket.next_due >= bucket.period
+            if bucket.priority != PRIORITY_HIGH and due and not late and \
+                    cost + bucket.last_scan_time > budget:
+                bucket.deferred_count += 1
+                continue
+
+            cost += bucket.last_scan_time
+            # Drift-free, missed deadlines are skipped and the phase is kept
+            bucket.next_due += bucket.period * max(math.floor((now - bucket.next_due) / bucket.period) + 1, 1)
+            due.append(bucket)
+        return due
+
+    def scan(self, plc: LogixDriver):
+        """
+        Scans the buckets due, each one with its own batched read, process and batched write. Tags already read on
+        the tick by another bucket aren't requested again.
+
+        :param plc: LogixDriver PLC Object, connection needs to be open before its handed in
+        :return:
+        """
+        if self._pending_changes:
+            self.apply_pending()
+        self.tag_cache.new_cycle()
+        for bucket in self.due(SimClock.now()):
+            start = time.perf_counter()
+            bucket.engine.scan(plc)
+            self._scanned(bucket, time.perf_counter() - start)
+
+    def read(self, plc: LogixDriver) -> list:
+        """
+        Reads the input tags of the buckets due, one batched call per bucket for the tags not read yet on the tick
+
+        :param plc: LogixDriver PLC Object, connection needs to be open before its handed in
+        :return: List of (Rate Bucket, tag data) pairs
+        """
+        if self._pending_changes:
+            self.apply_pending()
+        self.tag_cache.new_cycle()
+        scan_data = []
+        for bucket in self.due(SimClock.now()):
+            bucket._scan_start = time.perf_counter()
+            scan_data.append((bucket, bucket.engine.read(plc)))
+        return scan_data
+
+    def process(self, scan_data: list) -> list:
+        """
+        :param scan_data: List of (Rate Bucket, tag data) pairs returned by read()
+        :return: List of (Rate Bucket, write data) pairs
+        """
+        return [(bucket, bucket.engine.process(tag_data)) for bucket, tag_data in scan_data]
+
+    def write(self, plc: LogixDriver, write_data: list):
+        """
+        Writes the feedback values of every bucket, one batched call per bucket
+
+        :param plc: LogixDriver PLC Object, connection needs to be open before its handed in
+        :param write_data: List of (Rate Bucket, write data) pairs returned by process()
+        :return:
+        """
+        for bucket, bucket_data in write_data:
+            bucket.engine.write(plc, bucket_data)
+            self._scanned(bucket, time.perf_counter() - bucket._scan_start)
+
+    def summary(self) -> list:
+        """
+        :return: Scan rate, size and counters of every bucket
+        """
+        return [bucket.summary() for bucket in self.buckets]
+
+    @staticmethod
+    def _scanned(bucket: RateBucket, duration: float):
+        bucket.scan_count += 1
+        bucket.last_scan_time = duration
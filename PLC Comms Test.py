@@ -1,28 +1,37 @@
+import os
 import time
 
 import pandas as pd
-from pycomm3 import LogixDriver
-from pycomm3 import CIPDriver
+from pycomm3 import CommError
+import AsyncRuntime
+import ConnectionPool
+import ControllerEmulator
+import DeviceConfig
+import DeviceRegistry
 import FieldObjects
+import MultiRateEngine
+import RelationList
+import ScanEngine
+import ScanStats
+import ShardSupervisor
+import SimClock
+import TagDatabase
+import TagIndex
+import TagRecorder
+import TankNetwork
 import logging as log, sys #colorama
 
 # ===== OPTIONS =====
 generate_csv = True
-csv_col_names = ['InputName',
-                 'FeedbackTag',
-                 'PLCAddress',
-                 'ExtReferenceTag1',
-                 'IncTag1',
-                 'IncTag2',
-                 'IncTag3',
-                 'DecTag1',
-                 'DecTag2',
-                 'DecTag3',
-                 'IncROC',
-                 'DecROC',
-                 'Integrating',
-                 'AndORMode',
-                 'FixedValue']
+vectorized_analog = True  # Steps all the Analog Inputs of a PLC in a single NumPy update per scan
+change_driven_writes = True  # Only writes feedback values that changed since the last write
+async_runtime = False  # Scans all the PLCs from a single asyncio event loop instead of one thread per PLC
+process_shards = 0  # Number of processes the PLCs are sharded across, 0 scans all of them in this process
+emulate_plcs = False  # Runs against in-process emulated controllers serving the tags of the exports, no PLC needed
+multi_rate_scan = True  # Scans every device on its own period and priority, see DEVICE_CLASS_SCAN
+record_tags = False  # Records the tag traffic of every PLC to RECORD_FILE, replayed offline with TagRecorder
+resolve_tags = True  # Checks the tags of every device against the tag database once, missing tags aren't read
+sim_clock = 'real'  # 'real', 'scaled' runs SIM_CLOCK_SCALE times faster, 'stepped' runs fixed steps as fast as possible
 
 # ===== PARAMETERS =====
 PLC_IP = ['10.20.20.201/3', '10.20.20.201/4', '10.20.20.201/5']
@@ -30,219 +39,270 @@ TAG_FILENAME = ['CLX_PCIBF5-Tags.CSV', 'CLX_PCIBF6-Tags.CSV','CLX_DistBF5-Tags.C
 # PLC_IP = ['10.20.20.201/3', '10.20.20.201/4', '10.20.20.201/5','10.20.20.211/3', '10.20.20.211/4', '10.20.20.211/5']
 # TAG_FILENAME = ['CLX_PCIBF5-Tags.CSV', 'CLX_PCIBF6-Tags.CSV','CLX_DistBF5-Tags.CSV','CLX_PCIBF5-Tags.CSV', 'CLX_PCIBF6-Tags.CSV','CLX_DistBF5-Tags.CSV']
 ANL_RELATION_TAG_FILE = 'analog_inputs_relation_list.csv'
-RECONNECT_TIME = 5  # PLC Re-Connection timer
-
-# ===== LOGGER SETUP =====
-# logging.basicConfig(filename='SimLog.log', format='%(asctime)s - [%(levelname)s] %(message)s', encoding='utf-8', level=logging.DEBUG)
-#log.basicConfig(format='%(asctime)s - [%(levelname)s] %(message)s', encoding='utf-8', level=log.INFO, handlers=[log.StreamHandler(stream=sys.stdout), log.FileHandler(filename='SimLog.log')])
-
-
-# ===== LOAD PLC TAGS =====
-# Opens a connection to each PLC, this uploads all the tags in memory, they are stored in a list which is going to be
-# passed in subsequent calls, this avoids the overhead of uploading the tags on every control Open connection
-# instruction
-
-plc_tags = []  # Stores a list of lists of tags per controller
-full_plc_tags = []  # Flat tag list from all controllers, used for global tag search
-
-# Tries to connect to all PLCs to gather the tag database, repeats if fails to connect
-plc_connection = False
-while plc_connection == False:
-    try:
-        for PLC in PLC_IP:
-            with LogixDriver(PLC, init_tags=True) as plc:
-                plc.open()
-                # log.info('Connection succeeded!')
-                # log.info('Reading tag database...')
-                plc_tags.append(plc.tags)
-                # log.info('Done!')
-        plc_connection = True
-    except:
-        print(f'PLC not found, retrying... in {RECONNECT_TIME} sec')
-        # log.warning(f'PLC not found, retrying... in {RECONNECT_TIME} sec')
-        time.sleep(RECONNECT_TIME)
-
-
-# Create Global Tag List
-full_plc_tags = [item for sublist in plc_tags for item in sublist]
-
-# ===========
-
-
-valves_sw = []  # Switching Valves
-valves_anl = []  # Analog Valves
-anl_inp = []  # Analog Inputs
-
-# READ CONTROLLER TAG CSV FILES
-# log.info('Reading Controller Tag CSV Files')
-for idx, TAG_FILE in enumerate(TAG_FILENAME):
-    df = pd.read_csv(TAG_FILE, encoding='Windows-1252', skiprows=6)
-
-    # df = pd.read_csv(TAG_FILENAME, encoding='Windows-1252', skiprows=6)
-
-    # Get all zz_vnc and zz_vno objects NO Valves and NC Valves
-    all_sw_valves = df[((df['DATATYPE'] == 'UDT_zzVNC') | (df['DATATYPE'] == 'UDT_zzVNO')) & (df.SCOPE.isnull())]
-    all_analog_valves = df[(df["DATATYPE"] == "UDT_zzAnaIN") & (df.SCOPE.isnull())]
-
-    print(all_sw_valves.head())
-    print(all_analog_valves.head())
-
-    # Create Valve Objects
-    valve_name = ''
-    energise_cmd_tag = ''
-    opn_ind_ls_tag = ''
-    cls_ind_ls_tag = ''
-    nc_valve = False
-    vlv_setpoint_tag = ''
-    vlv_feedback_tag = ''
-
-    # ============================
-    # For analog Valves the UDT is UDT_zzAnaIN (Valve Name)
-    # Output data is at ie. O5_1_1VC02_SET where valve name is A5_1_1VC02
-    # Feedback data is at ie 05_1_1VC01.Channel, Data must be returned in PLC RAW Counts 0-65535
-    # Value is in Engineering Units, it might have to be scaled to Output counts
-    # ============================
-    print('==============================')
-    print('Processing Switching Valves...')
-    for index, vlv in all_sw_valves.iterrows():
-        valve_name = vlv['NAME']
-        energise_cmd_tag = 'O' + valve_name[1:] + '_OP'
-        opn_ind_ls_tag = 'I' + valve_name[1:] + '_LS1'
-        cls_ind_ls_tag = 'I' + valve_name[1:] + '_LS2'
-
-        nc_valve = vlv['DATATYPE'] != 'UDT_zzVNC'
-
-        valves_sw.append(
-            FieldObjects.Valve(vlv['NAME'], energise_cmd_tag, opn_ind_ls_tag, cls_ind_ls_tag, PLC_IP[idx], nc_valve))
-        print(f'{vlv["NAME"]} - {energise_cmd_tag} - Valve NC is {nc_valve}')
-
-    print(f'{len(all_sw_valves)} Switching Valves identified in CSV {TAG_FILE}')
-    print(f'{len(valves_sw)} Switching Valves')
-
-    print('==============================')
-    print('Processing Analog Valves and Inputs...')
-    for index, vlv in all_analog_valves.iterrows():
-        valve_name = vlv['NAME']
-        vlv_setpoint_tag = 'O' + valve_name[1:] + '_SET'
-        vlv_feedback_tag = valve_name + '.Channel'
-        opn_ind_ls_tag = 'I' + valve_name[1:] + '_LS1'
-        cls_ind_ls_tag = 'I' + valve_name[1:] + '_LS2'
-
-        # Check if Setpoint tag exists in any taglist, if it does, create an Analog valve, otherwise is a regular
-        # analog input
-        # if vlv_setpoint_tag in full_plc_tags is FALSE, it is a Analog Input, if is TRUE, it is a Analog Valve
-
-        if vlv_setpoint_tag in full_plc_tags:  # TRUE = Valve
-            valves_anl.append(FieldObjects.Valve_Analog(vlv['NAME'], vlv_setpoint_tag, vlv_feedback_tag, opn_ind_ls_tag,
-                                                        cls_ind_ls_tag, PLC_IP[idx]))
-            print(f'{vlv["NAME"]} - {vlv_setpoint_tag} as Control Valve')
-        else:  # FALSE = Analog Input
-            anl_inp.append(FieldObjects.AnalogInput(valve_name, vlv_feedback_tag, PLC_IP[idx]))
-            print(f'{vlv["NAME"]} as Analog Input')
-    print(f'{len(all_analog_valves)} Analog Devices identified in CSV {TAG_FILE}')
-    print(f'{len(valves_anl)} Control Valves')
-    print(f'{len(anl_inp)} Analog Inputs')
-
-    print(CIPDriver.discover())
-    with LogixDriver(PLC_IP[idx]) as plc:
-        print(plc)
-        print(plc.info)
+CONFIG_RELOAD_TIME = 5  # Time between checks of the relation list and tag exports for changes, in sec, 0 disables
+TANK_FILE = 'tanks.csv'  # Tanks of the process model, optional
+TANK_LINK_FILE = 'tank_links.csv'  # Flow Links between the tanks and the valves throttling them, optional
+RECONNECT_TIME = 5  # PLC Re-Connection timer, doubled on every consecutive failure of a PLC
+MAX_RECONNECT_TIME = 60  # Longest time between re-connection attempts to a PLC, in sec
+KEEPALIVE_TIME = 10  # Idle time before a PLC connection sends a keepalive request, in sec, 0 disables it
+SCAN_CYCLE_TIME = 0.5  # Target time between the start of two consecutive scans, in sec
+WRITE_REFRESH_TIME = 10  # Time between full feedback refreshes when only changed values are written, in sec
+TAG_CACHE_FILE = 'tag_database.cache'  # Persistent cache of the tag exports and PLC tag databases
+TAG_CACHE_CHECK_FIRMWARE = True  # Connects to each PLC at startup to check the cached tags match its firmware
+TAG_CACHE_FORCE_UPLOAD = False  # Uploads the tag databases again, needed after a download without a new tag export
+STATS_LOG_TIME = 10  # Time between scan statistics log entries, in sec, 0 disables them
+EMULATOR_LATENCY = 0.005  # Round trip time of every request to an emulated controller, in sec
+EMULATOR_CONNECTION_SIZE = 4000  # Packet size limit of the emulated controllers, in bytes
+RECORD_FILE = 'tag_traffic.rec'  # Tag traffic recording, appended to, one file per shard process when sharded
+SIM_CLOCK_SCALE = 10  # Simulation seconds per wall clock second of the scaled clock
+SIM_CLOCK_STEP = 0.5  # Simulation time of every step of the stepped clock, in sec
+STATS_HTTP_PORT = 8765  # Scan statistics served as JSON on http://127.0.0.1:<port>/stats, None disables it
+# Scan period, in sec, and priority (High, Normal, Low) of every device class, a None period scans on SCAN_CYCLE_TIME.
+# Analog Inputs can override them with the optional ScanPeriod and Priority columns of the relation list
+DEVICE_CLASS_SCAN = {'Valve': (None, 'Normal'), 'Valve_Analog': (None, 'Normal'), 'AnalogInput': (None, 'Normal'),
+                     'Tank': (None, 'Normal')}
+
+# Shard processes import this script again when they start, everything past the options only runs in the main process
+if __name__ == '__main__':
+    # ===== SIMULATION CLOCK =====
+    # Set before any device is created, valve travels and analog/tank integration all follow this clock
+    if sim_clock == 'scaled':
+        SimClock.set_clock(SimClock.ScaledClock(SIM_CLOCK_SCALE))
+    elif sim_clock == 'stepped':
+        SimClock.set_clock(SimClock.SteppedClock(SIM_CLOCK_STEP))
+
+    # ===== LOGGER SETUP =====
+    # logging.basicConfig(filename='SimLog.log', format='%(asctime)s - [%(levelname)s] %(message)s', encoding='utf-8', level=logging.DEBUG)
+    log.basicConfig(format='%(asctime)s - [%(levelname)s] %(name)s: %(message)s', encoding='utf-8', level=log.INFO,
+                    handlers=[log.StreamHandler(stream=sys.stdout), log.FileHandler(filename='SimLog.log')])
+    log.getLogger('pycomm3').setLevel(log.WARNING)
+
+
+    # ===== LOAD PLC TAGS =====
+    # The tag database of each PLC is kept in a persistent cache, tag exports are only parsed again when their hash
+    # changes and tag definitions are only uploaded again when the tag export or the PLC firmware changes. A program
+    # download isn't reported by the PLC, export the tags again or set TAG_CACHE_FORCE_UPLOAD after one. The tag
+    # definitions are passed to the scan connections, this avoids the overhead of uploading the tags on every Open
+    # connection instruction
+
+    if emulate_plcs:
+        controller_emulator = ControllerEmulator.ControllerEmulator()
+        for idx, PLC in enumerate(PLC_IP):
+            controller_emulator.add_tag_export(PLC, TAG_FILENAME[idx], latency=EMULATOR_LATENCY,
+                                               connection_size=EMULATOR_CONNECTION_SIZE)
+        plc_driver = controller_emulator.driver
+        TAG_CACHE_FILE = 'emulated_' + TAG_CACHE_FILE  # Keeps the emulated tag definitions out of the real cache
+    else:
+        # Opens the connections with the tag definitions of the Tag Database
+        plc_driver = ConnectionPool.CachedTagDriver
+
+    tag_database = TagDatabase.TagDatabase(TAG_CACHE_FILE, plc_driver)
+    plc_tags = []  # Stores the tag definitions per controller
+    controller_tags = []  # Stores the cached tag data per controller
+
+    for idx, PLC in enumerate(PLC_IP):
+        # Tries to connect to the PLC to check the tag database, repeats if fails to connect
+        while True:
+            try:
+                controller_tags.append(tag_database.load_controller(PLC, TAG_FILENAME[idx], TAG_CACHE_CHECK_FIRMWARE,
+                                                                    TAG_CACHE_FORCE_UPLOAD))
+                break
+            except CommError:
+                print(f'PLC {PLC} not found, retrying... in {RECONNECT_TIME} sec')
+                # log.warning(f'PLC not found, retrying... in {RECONNECT_TIME} sec')
+                time.sleep(RECONNECT_TIME)
+        plc_tags.append(controller_tags[idx].tags)
+    tag_database.save()
+
+    # Global Tag Set from all controllers, used for global tag search
+    full_plc_tags = tag_database.tag_names
+
+    # ===========
+
+
+    valves_sw = []  # Switching Valves
+    valves_anl = []  # Analog Valves
+    anl_inp = []  # Analog Inputs
+
+    # Scan period and priority of every device class
+    class_scan = {name: (period, FieldObjects.PRIORITIES[priority.lower()])
+                  for name, (period, priority) in DEVICE_CLASS_SCAN.items()}
+
+    # CREATE DEVICES FROM THE CONTROLLER TAG CSV FILES
+    # log.info('Reading Controller Tag CSV Files')
+    for idx, TAG_FILE in enumerate(TAG_FILENAME):
+        # Switching Valves from the UDT_zzVNC/UDT_zzVNO tags, Control Valves and Analog Inputs from the UDT_zzAnaIN
+        # tags, a UDT_zzAnaIN is a Control Valve if its setpoint tag exists in any PLC
+        devices = DeviceConfig.create_devices(PLC_IP[idx], controller_tags[idx].devices, full_plc_tags, class_scan)
+        valves_sw += [device for device in devices if isinstance(device, FieldObjects.Valve)]
+        valves_anl += [device for device in devices if isinstance(device, FieldObjects.Valve_Analog)]
+        anl_inp += [device for device in devices if isinstance(device, FieldObjects.AnalogInput)]
+
+        print('==============================')
+        print(f'{len(devices)} Devices identified in CSV {TAG_FILE}')
+        print(f'{len(valves_sw)} Switching Valves')
+        print(f'{len(valves_anl)} Control Valves')
+        print(f'{len(anl_inp)} Analog Inputs')
+
+        print(f'PLC {PLC_IP[idx]} - Firmware revision {controller_tags[idx].firmware}')
         print('=================')
 
     # ===== GENERATE CSV =====
+    # Relation list template with every Analog Input of all the PLCs
     if generate_csv:
-        anl_inp_csv = []
-
-        for inp in anl_inp:
-            anl_inp_csv.append([inp.input_name, inp.feedback_tag, inp.plc_address, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0])
-
-        df_csv = pd.DataFrame(anl_inp_csv, columns=csv_col_names)
-        df_csv.to_csv('analog_inputs.csv', index=False)
-
-# Read in Relation CSV and update analog inputs data
-df_rel = pd.read_csv(ANL_RELATION_TAG_FILE, encoding='Windows-1252')
-print(df_rel.head())
-for index, row in df_rel.iterrows():
-    print(row['InputName'])
-    for inp in anl_inp:
-        if inp.input_name == row['InputName']:
-            inp.ext_reference_tag1 = str(row['ExtReferenceTag1'])
-            inp.ext_reference_tag2 = str(row['ExtReferenceTag2'])
-
-            inp.inc_condition_tag1 = str(row['IncTag1'])
-            inp.inc_condition_tag2 = str(row['IncTag2'])
-            inp.inc_condition_tag3 = str(row['IncTag3'])
-
-            inp.dec_condition_tag1 = str(row['DecTag1'])
-            inp.dec_condition_tag2 = str(row['DecTag2'])
-            inp.dec_condition_tag3 = str(row['DecTag3'])
-            inp.incROC = int(row['IncROC'])
-            inp.decROC = int(row['DecROC'])
-
-            inp.integrating_process = int(row['Integrating'])
-            inp.andormode = int(row['AndORMode'])
-
-            inp.fixed_value = row['FixedValue']
-
-# Connect to PLCs
-plc_objects = []
-def connect_to_PLCs():
-    plcs = []
-    for idx, PLC in enumerate(PLC_IP):
-        plcs.append(LogixDriver(PLC_IP[idx], init_tags=False))
-        plcs[idx].open()
-        print(plcs[idx].info)
-    return plcs
-
-plc_objects = connect_to_PLCs()
-
-while True:
-    # vlv1.update()
-    try:
-        for idx, plc in enumerate(plc_objects):
-            plc._tags = plc_tags[idx]  # Pass on the tag list uploaded at the beginning
-            # Update Switching Valves
-            for sw_vlv in valves_sw:
-                if sw_vlv.plc_address == PLC_IP[idx]:
-                    sw_vlv.update(plc)
-                    # time.sleep(0.05)
-                print(sw_vlv.valve_name)
-                if sw_vlv.valve_name == 'A5_2_1VBCM04':
-                    print('Valve name ', sw_vlv.valve_name)
-                    print('Open tag ', sw_vlv.open_ind_tag)
-                    print('Close tag ', sw_vlv.close_ind_tag)
-                    print('Output tag ', sw_vlv.energise_cmd_tag)
-
-            # Update Analog Valves
-            for anl_vlv in valves_anl:
-                if anl_vlv.plc_address == PLC_IP[idx]:
-                    anl_vlv.update(plc)
-                    # time.sleep(0.05)
-                print(anl_vlv.valve_name)
-                if anl_vlv.valve_name == 'A5_1_1FT3':
-                    print('Valve name ', anl_vlv.valve_name)
-                    print(f'"PLC Address " {anl_vlv.plc_address}')
-                    print(f'"Setpoint tag " {anl_vlv.valve_sp_tag} " - Value = " {anl_vlv.valve_sp_value}')
-                    print(f'"Feedback tag " {anl_vlv.valve_fbk_tag} " - Value = " {anl_vlv.valve_fbk_value}')
-
-            # Update Analog Inputs
-            for anl in anl_inp:
-                if anl.plc_address == PLC_IP[idx]:
-                    anl.update(plc)
-                    # time.sleep(0.05)
-                print(anl.input_name)
-                if anl.input_name == 'A5_1_1FT3':
-                    print('Valve name ', anl.input_name)
-                    print(f'"PLC Address " {anl.plc_address}')
-                    # print(f'"Setpoint tag " {anl_vlv.valve_sp_tag} " - Value = " {anl_vlv.valve_sp_value}')
-                    print(f'"Feedback tag " {anl.feedback_tag} " - Value = " {anl.feedback_tag}')
-    except:
-        print(f'Connection lost to PLC {PLC_IP[idx]}!')
-        try:
-            print("Trying to re-connect...")
-            plc_objects = connect_to_PLCs()
-        except:
-            print(f'Failed to connect to PLCs!, check that all PLCs are available, re-trying in {RECONNECT_TIME}sec...')
-            time.sleep(5)
-    time.sleep(0.5)
-
+        RelationList.write_template(anl_inp, 'analog_inputs.csv')
+
+    # Read in the Tank process model, tank levels and pressures are integrated from the flows through the valves
+    tanks = []
+    if os.path.exists(TANK_FILE):
+        df_tanks = pd.read_csv(TANK_FILE, encoding='Windows-1252', keep_default_na=False)
+        for index, row in df_tanks.iterrows():
+            tanks.append(FieldObjects.Tank(row['Name'], row['PLCAddress'], str(row['LevelTag']),
+                                           str(row['PressureTag']), float(row['Volume']), float(row['FullPressure']),
+                                           level=float(row['Level'])))
+            tanks[-1].scan_period, tanks[-1].priority = class_scan['Tank']
+        print(f'{len(tanks)} Tanks')
+
+        if os.path.exists(TANK_LINK_FILE):
+            tanks_by_name = {tank.name: tank for tank in tanks}
+            valves_by_name = {valve.valve_name: valve for valve in valves_sw + valves_anl}
+            df_links = pd.read_csv(TANK_LINK_FILE, encoding='Windows-1252', keep_default_na=False)
+            for index, row in df_links.iterrows():
+                # Empty From/To are a supply/drain, an empty Valve is a pipe always open
+                source = tanks_by_name[row['From']] if row['From'] else None
+                target = tanks_by_name[row['To']] if row['To'] else None
+                valve = valves_by_name.get(row['Valve']) if row['Valve'] else None
+                if row['Valve'] and valve is None:
+                    print(f'Flow Link {row["From"]} -> {row["To"]}: Valve {row["Valve"]} not found, pipe left open')
+                TankNetwork.FlowLink(source, target, valve, float(row['FlowCoefficient']),
+                                     float(row['SupplyPressure'] or 0.0))
+
+    # Register every device under the PLC that owns it, the tag list of each PLC is built once here instead of filtering
+    # all the devices on every scan
+    device_registry = DeviceRegistry.DeviceRegistry()
+    for device in valves_sw + valves_anl + tanks + anl_inp:
+        device_registry.add(device)
+
+    # Read in the Relation CSV and update the analog inputs data, the inputs are looked up by name in the registry.
+    # The optional ScanPeriod and Priority columns override the device class settings, empty cells keep them
+    relation_list = RelationList.RelationList(ANL_RELATION_TAG_FILE, *class_scan['AnalogInput'])
+    relation_list.load()
+    RelationList.RelationList.apply_changes(relation_list.diff(device_registry))
+    print(f'{len(relation_list.settings)} Analog Inputs configured in {ANL_RELATION_TAG_FILE}')
+    for name in relation_list.unknown_inputs(device_registry):
+        print(f'Relation list {ANL_RELATION_TAG_FILE} - {name}: not an Analog Input of any PLC, ignored')
+    device_registry.build_tag_lists()
+
+    # Resolve the tags of every device against the tag database of its PLC, the missing ones are reported once here and
+    # served as a failed read instead of being requested every scan
+    tag_indexes = {}
+    if resolve_tags and not process_shards:
+        for idx, PLC in enumerate(PLC_IP):
+            tag_indexes[PLC] = TagIndex.TagIndex(plc_tags[idx], PLC)
+            tag_indexes[PLC].report(device_registry.controller(PLC).devices)
+
+    # Create one Scan Engine per PLC, the tags of all its devices are read and written in a single batched call per scan
+    # and start one Scan Worker per PLC, each worker owns its connection and scans concurrently with the others
+    if process_shards:
+        # The devices are handed over to the shard processes, each one scans its PLCs and reports back
+        shard_supervisor = ShardSupervisor.ShardSupervisor(process_shards, vectorized_analog=vectorized_analog,
+                                                           write_refresh_time=WRITE_REFRESH_TIME if change_driven_writes
+                                                           else None, async_runtime=async_runtime,
+                                                           multi_rate=multi_rate_scan, max_backoff=MAX_RECONNECT_TIME,
+                                                           keepalive_time=KEEPALIVE_TIME,
+                                                           record_file=RECORD_FILE if record_tags else None,
+                                                           resolve_tags=resolve_tags)
+        for idx, PLC in enumerate(PLC_IP):
+            shard_supervisor.add_controller(PLC, device_registry.controller(PLC), plc_tags[idx], SCAN_CYCLE_TIME,
+                                            RECONNECT_TIME, plc_driver)
+        shard_supervisor.start()
+        scan_stats = shard_supervisor.stats
+    else:
+        # One managed session per PLC, a failed PLC backs off on its own without touching the sessions of the others
+        tag_recorder = TagRecorder.TagRecorder(RECORD_FILE) if record_tags else None
+        connection_pool = ConnectionPool.ConnectionPool(MAX_RECONNECT_TIME, KEEPALIVE_TIME, tag_recorder)
+        scan_scheduler = AsyncRuntime.AsyncScanScheduler(pool=connection_pool) if async_runtime \
+            else ScanEngine.ScanScheduler(connection_pool)
+        scan_stats = []  # Scan statistics per PLC
+        for idx, PLC in enumerate(PLC_IP):
+            scan_stats.append(ScanStats.ScanStats(PLC, SCAN_CYCLE_TIME))
+            if multi_rate_scan:
+                # One Scan Engine per rate bucket, the worker ticks on the greatest common divisor of the periods
+                scan_engine = MultiRateEngine.MultiRateEngine(device_registry.controller(PLC), SCAN_CYCLE_TIME,
+                                                              vectorized_analog,
+                                                              WRITE_REFRESH_TIME if change_driven_writes else None,
+                                                              scan_stats[-1], tag_index=tag_indexes.get(PLC))
+                scan_stats[-1].target_cycle_time = scan_engine.cycle_time
+            else:
+                write_cache = ScanEngine.WriteCache(WRITE_REFRESH_TIME) if change_driven_writes else None
+                scan_engine = ScanEngine.ScanEngine(device_registry.controller(PLC), vectorized_analog, write_cache,
+                                                    scan_stats[-1], tag_index=tag_indexes.get(PLC))
+            scan_scheduler.add_controller(PLC, scan_engine, plc_tags[idx], scan_stats[-1].target_cycle_time,
+                                          RECONNECT_TIME, plc_driver)
+            print(f'PLC {PLC} - {len(scan_engine.partition)} devices - '
+                  f'{len(scan_engine.read_tags)} tags per scan')
+            if multi_rate_scan:
+                for bucket in scan_engine.buckets:
+                    print(f'    Every {bucket.period}sec, priority {bucket.priority} - '
+                          f'{len(bucket.engine.partition)} devices - {len(bucket.engine.read_tags)} tags')
+        scan_scheduler.start()
+
+    # Rolling scan statistics of all PLCs, logged periodically and served on a local endpoint
+    stats_reporter = ScanStats.StatsReporter(scan_stats, STATS_LOG_TIME, STATS_HTTP_PORT)
+    stats_reporter.start()
+
+    # Hot reload of the relation list and the tag exports, only the devices changed are patched, between two scans of
+    # their PLC, the scans and the connections go on
+    if CONFIG_RELOAD_TIME:
+        config_reloader = DeviceConfig.ConfigReloader(device_registry, relation_list, tag_database,
+                                                      dict(zip(PLC_IP, TAG_FILENAME)), class_scan,
+                                                      scheduler=scan_scheduler if not process_shards else None,
+                                                      supervisor=shard_supervisor if process_shards else None,
+                                                      check_time=CONFIG_RELOAD_TIME)
+        config_reloader.start()
+
+    # Devices whose data is printed on every cycle for debugging, not available when they are scanned by shard processes
+    watch_sw_valve = device_registry.find('A5_2_1VBCM04') if not process_shards else None
+    watch_anl = device_registry.find('A5_1_1FT3') if not process_shards else None
+
+    while True:
+        # vlv1.update()
+        if watch_sw_valve is not None:
+            print('Valve name ', watch_sw_valve.valve_name)
+            print('Open tag ', watch_sw_valve.open_ind_tag)
+            print('Close tag ', watch_sw_valve.close_ind_tag)
+            print('Output tag ', watch_sw_valve.energise_cmd_tag)
+
+        if isinstance(watch_anl, FieldObjects.Valve_Analog):
+            print('Valve name ', watch_anl.valve_name)
+            print(f'"PLC Address " {watch_anl.plc_address}')
+            print(f'"Setpoint tag " {watch_anl.valve_sp_tag} " - Value = " {watch_anl.valve_sp_value}')
+            print(f'"Feedback tag " {watch_anl.valve_fbk_tag} " - Value = " {watch_anl.valve_fbk_value}')
+        elif isinstance(watch_anl, FieldObjects.AnalogInput):
+            print('Valve name ', watch_anl.input_name)
+            print(f'"PLC Address " {watch_anl.plc_address}')
+            print(f'"Feedback tag " {watch_anl.feedback_tag} " - Value = " {watch_anl.feedback_tag_value}')
+
+        if process_shards:
+            for shard in shard_supervisor.health():
+                print(f'Shard {shard["shard"]} (pid {shard["pid"]}) - Alive: {shard["alive"]}')
+                for worker in shard['workers']:
+                    print(f'    PLC {worker["key"]} - Scans: {worker["scan_count"]} - '
+                          f'Errors: {worker["error_count"]} - Reconnects: {worker["connection"]["reconnects"]} - '
+                          f'Last scan: {worker["last_scan_time"] * 1000:.1f}ms')
+        else:
+            for worker in scan_scheduler.workers:
+                print(f'PLC {worker.plc_address} - Scans: {worker.scan_count} - Errors: {worker.error_count} - '
+                      f'Reconnects: {worker.session.reconnect_count} - Last scan: {worker.last_scan_time * 1000:.1f}ms')
+                engines = [bucket.engine for bucket in worker.engine.buckets] if multi_rate_scan else [worker.engine]
+                write_caches = [engine.write_cache for engine in engines if engine.write_cache is not None]
+                if write_caches:
+                    print(f'    Writes sent: {sum(cache.written_count for cache in write_caches)} - '
+                          f'Skipped: {sum(cache.skipped_count for cache in write_caches)}')
+                if multi_rate_scan:
+                    print(f'    Tag cache hits: {worker.engine.tag_cache.hit_count} - '
+                          f'Misses: {worker.engine.tag_cache.miss_count}')
+                    for bucket in worker.engine.buckets:
+                        print(f'    Every {bucket.period}sec - Scans: {bucket.scan_count} - '
+                              f'Deferred: {bucket.deferred_count}')
+        time.sleep(SCAN_CYCLE_TIME)
@@ -0,0 +1,165 @@
+import os
+
+import pandas as pd
+
+import FieldObjects
+from DeviceRegistry import DeviceRegistry
+from TagDatabase import file_hash
+
+# Relation tag columns, in the order of FieldObjects.RELATION_SLOTS
+TAG_COLUMNS = ('ExtReferenceTag1', 'ExtReferenceTag2', 'IncTag1', 'IncTag2', 'IncTag3', 'DecTag1', 'DecTag2', 'DecTag3')
+# Integer columns -> AnalogInput attribute
+INT_COLUMNS = {'IncROC': 'incROC', 'DecROC': 'decROC', 'Integrating': 'integrating_process', 'AndORMode': 'andormode',
+               'FixedValue': 'fixed_value'}
+REQUIRED_COLUMNS = ('InputName',) + TAG_COLUMNS + tuple(INT_COLUMNS)
+TEMPLATE_COLUMNS = ('InputName', 'FeedbackTag', 'PLCAddress') + TAG_COLUMNS + tuple(INT_COLUMNS)
+
+
+def write_template(inputs: list, filename: str):
+    """
+    Writes a relation list with every Analog Input and nothing configured, to be filled in
+
+    :param inputs: List of AnalogInput objects of all the PLCs
+    :param filename: CSV file written
+    :return:
+    """
+    rows = [[inp.input_name, inp.feedback_tag, inp.plc_address] + [0] * (len(TEMPLATE_COLUMNS) - 3)
+            for inp in inputs]
+    pd.DataFrame(rows, columns=TEMPLATE_COLUMNS).to_csv(filename, index=False)
+
+
+class RelationList:
+
+    def __init__(self, filename: str, scan_period=None, priority=FieldObjects.PRIORITY_NORMAL,
+                 encoding='Windows-1252'):
+        """
+        Relation configuration of the Analog Inputs, loaded from the relation list CSV. All the columns are validated
+        and converted in one pass over the table, invalid cells are reported and fall back to not configured (tags) or
+        0 (numbers). The settings are applied to the inputs by name through an index, and can be reloaded when the
+        file changes without rebuilding the devices or uploading tags again.
+
+        :param filename: Relation list CSV
+        :param scan_period: Scan period of the inputs whose optional ScanPeriod cell is empty, in sec
+        :param priority: Priority of the inputs whose optional Priority cell is empty
+        :param encoding: Encoding of the CSV
+        """
+
+        self.filename = filename
+        self.scan_period = scan_period
+        self.priority = priority
+        self.encoding = encoding
+        self.settings = {}  # Input name -> {AnalogInput attribute: value}
+        self.file_hash = None  # Hash of the file when it was loaded
+        self.errors = []  # Problems found on the last load
+
+    def load(self) -> dict:
+        """
+        Reads and validates the relation list
+
+        :return: Input name -> {AnalogInput attribute: value}
+        """
+        file_hash_loaded = file_hash(self.filename)
+        df = pd.read_csv(self.filename, encoding=self.encoding, dtype=str, keep_default_na=False)
+        df.columns = [column.strip() for column in df.columns]
+        self.errors = []
+
+        missing = [column for column in REQUIRED_COLUMNS if column not in df.columns]
+        if missing:
+            raise ValueError(f'Relation list {self.filename} is missing the columns {", ".join(missing)}')
+
+        names = df['InputName'].str.strip()
+        duplicated = names[names.duplicated()].unique().tolist()
+        if duplicated:
+            self.errors.append(f'Inputs listed more than once, the last row is used: {", ".join(duplicated)}')
+
+        # Relation tags, empty cells aren't configured
+        columns = {}
+        for column, slot in zip(TAG_COLUMNS, FieldObjects.RELATION_SLOTS):
+            tags = df[column].str.strip()
+            columns[slot] = tags.where(tags != '', '0')
+
+        for column, attribute in INT_COLUMNS.items():
+            columns[attribute] = self._numbers(df[column], names, column, 0).astype('int64')
+
+        # Optional columns, empty cells take the defaults
+        if 'Priority' in df.columns:
+            priority = df['Priority'].str.strip().str.lower()
+            unknown = (priority != '') & ~priority.isin(FieldObjects.PRIORITIES.keys())
+            for name, value in zip(names[unknown], df['Priority'][unknown]):
+                self.errors.append(f'{name}: unknown Priority {value!r}')
+            columns['priority'] = priority.map(FieldObjects.PRIORITIES).fillna(self.priority).astype('int64')
+        else:
+            columns['priority'] = pd.Series(self.priority, index=df.index, dtype='int64')
+
+        if 'ScanPeriod' in df.columns:
+            periods = self._numbers(df['ScanPeriod'], names, 'ScanPeriod', None).tolist()
+        else:
+            periods = [None] * len(df)
+
+        self.settings = {}
+        for name, settings, period in zip(names, pd.DataFrame(columns).to_dict('records'), periods):
+            if name:
+                settings['scan_period'] = self.scan_period if pd.isna(period) else period
+                self.settings[name] = settings
+        self.file_hash = file_hash_loaded
+        for error in self.errors:
+            print(f'Relation list {self.filename} - {error}')
+        return self.settings
+
+    def changed(self) -> bool:
+        """
+        :return: TRUE if the file changed since it was loaded
+        """
+        return os.path.exists(self.filename) and file_hash(self.filename) != self.file_hash
+
+    def diff(self, registry: DeviceRegistry) -> dict:
+        """
+        Compares the settings loaded with the live inputs
+
+        :param registry: Device Registry holding the inputs
+        :return: AnalogInput -> settings, only the inputs whose settings differ
+        """
+        changed = {}
+        for name, settings in self.settings.items():
+            inp = registry.find(name)
+            if not isinstance(inp, FieldObjects.AnalogInput):
+                continue
+            if any(getattr(inp, attribute) != value for attribute, value in settings.items()):
+                changed[inp] = settings
+        return changed
+
+    def unknown_inputs(self, registry: DeviceRegistry) -> list:
+        """
+        :param registry: Device Registry holding the inputs
+        :return: Names listed that aren't Analog Inputs
+        """
+        return [name for name in self.settings if not isinstance(registry.find(name), FieldObjects.AnalogInput)]
+
+    @staticmethod
+    def apply(inp: FieldObjects.AnalogInput, settings: dict):
+        """
+        Applies the settings of an input and compiles its evaluation plan
+
+        :param inp: AnalogInput
+        :param settings: {AnalogInput attribute: value}
+        :return:
+        """
+        for attribute, value in settings.items():
+            setattr(inp, attribute, value)
+        inp.compile()
+
+    @staticmethod
+    def apply_changes(changes: dict):
+        """
+        :param changes: AnalogInput -> settings, as returned by diff()
+        :return:
+        """
+        for inp, settings in changes.items():
+            RelationList.apply(inp, settings)
+
+    def _numbers(self, cells: pd.Series, names: pd.Series, column: str, default) -> pd.Series:
+        values = pd.to_numeric(cells.str.strip(), errors='coerce')
+        invalid = values.isna() & (cells.str.strip() != '')
+        for name, cell in zip(names[invalid], cells[invalid]):
+            self.errors.append(f'{name}: invalid {column} {cell!r}, {default} used')
+        return values if default is None else values.fillna(default)
@@ -0,0 +1,566 @@
+import threading
+import time
+
+from pycomm3 import LogixDriver
+
+import SimClock
+from AnalogKernel import AnalogKernel
+from ConnectionPool import CachedTagDriver, ConnectionPool, ControllerSession
+from DependencyGraph import DependencyGraph
+from DeviceRegistry import ControllerDevices
+from EventScheduler import EventScheduler
+from FieldObjects import read_tag_batch, write_tag_batch
+from ScanStats import ScanStats, instrument_driver
+from TagIndex import TagIndex
+from TankNetwork import TankNetwork
+
+
+class WriteCache:
+
+    def __init__(self, refresh_time=10.0):
+        """
+        Last written value of every feedback tag, only values that changed since the last write are sent to the PLC.
+        All the values are sent again periodically to resync the PLC if they were changed from somewhere else.
+
+        :param refresh_time: Time between full refreshes, in sec, 0 sends everything on every scan
+        """
+
+        self.refresh_time = refresh_time
+        self.written_count = 0  # Values sent to the PLC
+        self.skipped_count = 0  # Values not sent since they didn't change
+        self._last_written = {}  # Tag name -> value
+        self._next_refresh = 0.0
+
+    def changed(self, write_data: list, now: float) -> list:
+        """
+        Filters the values that need to be written
+
+        :param write_data: List of (tag name, value) pairs produced by the scan
+        :param now: Current time
+        :return: List of (tag name, value) pairs that changed, or all of them if a full refresh is due
+        """
+        if now >= self._next_refresh:
+            self._next_refresh = now + self.refresh_time
+            changed = write_data
+        else:
+            last_written = self._last_written
+            changed = [(tag, value) for tag, value in write_data
+                       if tag not in last_written or last_written[tag] != value]
+
+        self.written_count += len(changed)
+        self.skipped_count += len(write_data) - len(changed)
+        return changed
+
+    def update(self, write_data: list, results: list):
+        """
+        Stores the values written successfully, failed writes are forgotten so they are retried on the next scan
+
+        :param write_data: List of (tag name, value) pairs written
+        :param results: List of Pycomm3 Tag results of the write
+        :return:
+        """
+        for (tag, value), result in zip(write_data, results):
+            if result.error is None:
+                self._last_written[tag] = value
+            else:
+                self._last_written.pop(tag, None)
+
+    def invalidate(self):
+        """
+        Forgets all written values, everything is sent on the next scan
+
+        :return:
+        """
+        self._last_written.clear()
+        self._next_refresh = 0.0
+
+
+class TagCache:
+
+    def __init__(self, stats: ScanStats = None):
+        """
+        Read-through cache of the tag values of one scan cycle, shared by all the engines scanning a PLC. Every distinct
+        tag is read once per cycle, engines reading a tag already read on the cycle get the cached value and only the
+        tags missing are requested, in one batched call. Tags written are dropped so they're read again.
+
+        :param stats: Records the hits and misses if given
+        """
+
+        self.stats = stats
+        self.hit_count = 0  # Tags served from the cache
+        self.miss_count = 0  # Tags read from the PLC
+        self.cycle_count = 0
+        self._values = {}  # Tag name -> Pycomm3 Tag read on the current cycle
+
+    def new_cycle(self):
+        """
+        Forgets the values read, called at the start of every scan cycle
+
+        :return:
+        """
+        self._values = {}
+        self.cycle_count += 1
+
+    def read(self, plc: LogixDriver, tags: list) -> dict:
+        """
+        :param plc: LogixDriver PLC Object, connection needs to be open before its handed in
+        :param tags: List of tag names to be read, without duplicates
+        :return: Dictionary of tag name -> Pycomm3 Tag
+        """
+        values = self._values
+        missing = [tag for tag in tags if tag not in values]
+        if missing:
+            values.update(read_tag_batch(plc, missing))
+        hits = len(tags) - len(missing)
+        self.hit_count += hits
+        self.miss_count += len(missing)
+        if self.stats is not None:
+            self.stats.record_tag_cache(hits, len(missing))
+        return {tag: values[tag] for tag in tags}
+
+    def invalidate(self, write_data: list):
+        """
+        Drops the values of the tags written
+
+        :param write_data: List of (tag name, value) pairs written
+        :return:
+        """
+        values = self._values
+        for tag, _ in write_data:
+            values.pop(tag, None)
+
+
+class ScanEngine:
+
+    def __init__(self, partition: ControllerDevices, vectorized_analog=True, write_cache: WriteCache = None,
+                 stats: ScanStats = None, local_relations=True, producers: ControllerDevices = None,
+                 tag_cache: TagCache = None, tag_index: TagIndex = None):
+        """
+        Batched scan of all the devices owned by a single PLC. Instead of every device issuing its own read/write
+        calls, the input tags of every device are gathered into one multi-tag read, each device processes the data
+        in memory and all the feedback values go out in one multi-tag write.
+
+        :param partition: Devices owned by the PLC, taken from the Device Registry
+        :param vectorized_analog: Steps all the Analog Inputs at once with an Analog Kernel instead of one by one
+        :param write_cache: Only writes the values that changed if given, otherwise all values are written every scan
+        :param stats: Records the timings of every scan phase and device class if given
+        :param local_relations: Serves the Analog Input relation tags produced by devices of the partition from their
+        state instead of reading them from the PLC, see Dependency Graph
+        :param producers: Devices that can serve local relation tags when the partition is only part of the devices of
+        the PLC, the partition by default
+        :param tag_cache: Reads through the Tag Cache of the cycle if given, the engines of a Multi Rate Engine share
+        one so the tags read by several buckets due on the same tick are read once
+        :param tag_index: Tag Index of the PLC, tags missing from the PLC aren't read and are served as a failed read,
+        feedback tags missing aren't written, and the Analog Kernels extract the values by the types resolved. Compile
+        again if it's replaced.
+        """
+
+        self.partition = partition
+        self.vectorized_analog = vectorized_analog
+        self.write_cache = write_cache
+        self.stats = stats
+        self.local_relations = local_relations
+        self.producers = producers
+        self.tag_cache = tag_cache
+        self.tag_index = tag_index
+        self.event_scheduler = EventScheduler()  # Valve travel events
+        self.dependency_graph = None
+        self.tank_network = None  # Process model of the tanks of the partition
+        self.read_tags = []  # Tags read from the PLC on every scan
+        self.missing_data = {}  # Tag name -> failed read served for the tags missing from the PLC, never read
+        self.missing_writes = set()  # Feedback tags missing from the PLC, never written
+        self.analog_levels = []  # Analog Inputs in evaluation order, one list per dependency level
+        self.analog_kernels = []  # Analog Kernel of every level
+        self._level_locals = []  # Local relation tags loaded before every level
+        self._device_groups = []  # (Device class name, devices) processed one by one
+        self._scaling_valves = []  # Control Valves whose SP scaling is read on the current scan
+        self._pending_changes = []  # Device changes applied before the next scan, see between_scans()
+        self._pending_lock = threading.Lock()
+        self.compile()
+
+    def compile(self):
+        """
+        Prepares the engine for the current devices of the partition, needs to be called again if the partition is
+        rebuilt
+
+        :return:
+        """
+        for valve in self.partition.valves_sw:
+            valve.set_scheduler(self.event_scheduler)
+
+        self._device_groups = [('Valve', self.partition.valves_sw), ('Valve_Analog', self.partition.valves_anl)]
+        self.tank_network = TankNetwork(self.partition.tanks) if self.partition.tanks else None
+
+        if self.local_relations:
+            self.dependency_graph = DependencyGraph(self.partition, self.producers)
+            self.read_tags = self.dependency_graph.external_tags
+            self.analog_levels = self.dependency_graph.levels
+            self._level_locals = self.dependency_graph.level_locals
+        else:
+            self.dependency_graph = None
+            self.read_tags = self.partition.read_tags
+            self.analog_levels = [self.partition.anl_inp] if self.partition.anl_inp else []
+            self._level_locals = [[] for _ in self.analog_levels]
+
+        self.missing_data = {}
+        if self.tag_index is not None:
+            self.missing_data = {tag: self.tag_index.missing_tag(tag) for tag in self.read_tags
+                                 if not self.tag_index.exists(tag)}
+            if self.missing_data:
+                self.read_tags = [tag for tag in self.read_tags if tag not in self.missing_data]
+            self.missing_writes = {tag for device in self.partition.devices for tag in device.feedback_tags()
+                                   if not self.tag_index.exists(tag)}
+        else:
+            self.missing_writes = set()
+
+        if self.vectorized_analog:
+            self.analog_kernels = [AnalogKernel(level, self.tag_index) for level in self.analog_levels]
+        else:
+            self.analog_kernels = []
+
+    def reset(self):
+        """
+        Drops any state tied to the PLC connection, called after a re-connection
+
+        :return:
+        """
+        if self.write_cache is not None:
+            self.write_cache.invalidate()
+
+    def between_scans(self, change):
+        """
+        Queues a change of the devices, applied by the worker scanning the engine right before its next scan so the
+        devices never change in the middle of a scan. The engine is compiled again after the changes. Can be called
+        from any thread.
+
+        :param change: Function called without arguments
+        :return:
+        """
+        with self._pending_lock:
+            self._pending_changes.append(change)
+
+    def apply_pending(self) -> bool:
+        """
+        Applies the changes queued by between_scans()
+
+        :return: TRUE if there were changes
+        """
+        with self._pending_lock:
+            changes = self._pending_changes
+            self._pending_changes = []
+        if not changes:
+            return False
+        for change in changes:
+            change()
+        self.compile()
+        return True
+
+    def scan(self, plc: LogixDriver):
+        """
+        Executes a full scan of the devices: batched read, process and batched write
+
+        :param plc: LogixDriver PLC Object, connection needs to be open before its handed in
+        :return:
+        """
+        self.write(plc, self.process(self.read(plc)))
+
+    def read(self, plc: LogixDriver) -> dict:
+        """
+        Reads the input tags of all the devices in one batched call, the SP scaling of the Control Valves due for a
+        refresh goes along in the same call
+
+        :param plc: LogixDriver PLC Object, connection needs to be open before its handed in
+        :return: Dictionary of Tag name -> Pycomm3 Tag
+        """
+        if self._pending_changes:
+            self.apply_pending()
+        start = time.perf_counter()
+        now = SimClock.now()
+        self._scaling_valves = [valve for valve in self.partition.valves_anl if valve.scaling_due <= now]
+        tags = self.read_tags
+        missing_data = self.missing_data
+        if self._scaling_valves:
+            scaling_tags = [tag for valve in self._scaling_valves for tag in valve.scaling_tags()]
+            if self.tag_index is not None:
+                missing_data = dict(missing_data)
+                missing_data.update((tag, self.tag_index.missing_tag(tag)) for tag in scaling_tags
+                                    if not self.tag_index.exists(tag))
+                scaling_tags = [tag for tag in scaling_tags if tag not in missing_data]
+            tags = list(dict.fromkeys(tags + scaling_tags))
+        tag_data = self.tag_cache.read(plc, tags) if self.tag_cache is not None else read_tag_batch(plc, tags)
+        if missing_data:
+            tag_data.update(missing_data)
+        if self.stats is not None:
+            self.stats.record_phase('read', time.perf_counter() - start)
+        return tag_data
+
+    def process(self, tag_data: dict) -> list:
+        """
+        Runs the logic of all the devices on the data read, no PLC communication
+
+        :param tag_data: Dictionary of Tag name -> Pycomm3 Tag returned by read()
+        :return: List of (tag name, value) feedback pairs to write
+        """
+        stats = self.stats
+        clock = time.perf_counter
+        start = clock()
+
+        for valve in self._scaling_valves:
+            valve.load_scaling_data(tag_data)
+        self._scaling_valves = []
+
+        for class_name, devices in self._device_groups:
+            group_start = clock()
+            for device in devices:
+                device.load_scan_data(tag_data)
+                device.process()
+            if stats is not None:
+                stats.record_device_class(class_name, clock() - group_start)
+
+        # Valve travels completed since the last scan
+        self.event_scheduler.run_due(SimClock.now())
+
+        # Tank levels and pressures follow the valves just processed, before the inputs that may read them
+        write_data = []
+        if self.tank_network is not None:
+            group_start = clock()
+            write_data.extend(self.tank_network.step())
+            self.tank_network.sync_tanks()
+            if stats is not None:
+                stats.record_device_class('TankNetwork', clock() - group_start)
+
+        # Analog Inputs level by level, the relation tags produced locally are loaded once their producers are done
+        group_start = clock()
+        for idx, level in enumerate(self.analog_levels):
+            if self.dependency_graph is not None:
+                self.dependency_graph.load_locals(tag_data, self._level_locals[idx])
+            if self.analog_kernels:
+                kernel = self.analog_kernels[idx]
+                write_data.extend(kernel.step(tag_data))
+                kernel.sync_inputs()
+            else:
+                for inp in level:
+                    inp.load_scan_data(tag_data)
+                    inp.process()
+        if stats is not None and self.analog_levels:
+            stats.record_device_class('AnalogKernel' if self.analog_kernels else 'AnalogInput', clock() - group_start)
+
+        for class_name, devices in self._device_groups:
+            for device in devices:
+                write_data.extend(device.feedback_data())
+        if not self.analog_kernels:
+            for level in self.analog_levels:
+                for inp in level:
+                    write_data.extend(inp.feedback_data())
+
+        if stats is not None:
+            stats.record_phase('process', clock() - start)
+        return write_data
+
+    def write(self, plc: LogixDriver, write_data: list):
+        """
+        Writes the feedback values back in one batched call, only the changed ones if there's a Write Cache
+
+        :param plc: LogixDriver PLC Object, connection needs to be open before its handed in
+        :param write_data: List of (tag name, value) pairs returned by process()
+        :return:
+        """
+        start = time.perf_counter()
+        if self.missing_writes:
+            # A failed write would be retried every scan and logged by pycomm3 every time
+            missing_writes = self.missing_writes
+            write_data = [item for item in write_data if item[0] not in missing_writes]
+        if self.tag_cache is not None:
+            self.tag_cache.invalidate(write_data)
+        if self.write_cache is not None:
+            write_data = self.write_cache.changed(write_data, time.time())
+            self.write_cache.update(write_data, write_tag_batch(plc, write_data))
+        else:
+            write_tag_batch(plc, write_data)
+        if self.stats is not None:
+            self.stats.record_phase('write', time.perf_counter() - start)
+
+
+class ControllerWorker(threading.Thread):
+
+    def __init__(self, plc_address: str, engine: ScanEngine, session: ControllerSession, cycle_time=0.5):
+        """
+        Scan worker that owns a session to a single PLC and the devices of its Scan Engine, scans on its own cadence
+        so a slow or failed PLC doesn't stall the workers of the other PLCs
+
+        :param plc_address: PLC IP/Slot number to R/W Tag data
+        :param engine: Scan Engine holding the devices owned by this PLC
+        :param session: Controller Session of the Connection Pool, opens the connection and backs off after failures
+        :param cycle_time: Target time between the start of two consecutive scans, in sec of simulation time
+        """
+        super().__init__(name=f'ScanWorker-{plc_address}', daemon=True)
+
+        self.plc_address = plc_address
+        self.engine = engine
+        self.session = session
+        self.cycle_time = cycle_time
+        self.scan_count = 0
+        self.error_count = 0
+        self.last_scan_time = 0.0  # Duration of the last scan, in sec
+        self._connect_count = 0  # Connection of the session the engine is synced with
+        self._next_step = None  # Simulation time of the next scan on a stepped clock
+        self._stop_event = threading.Event()
+
+    def run(self):
+        session = self.session
+        cycle_time = self.cycle_time / SimClock.get_clock().rate  # Wall clock time between scans
+        next_scan = time.time()
+        while not self._stop_event.is_set():
+            if not session.connected and session.retry_in() > 0:
+                self._stop_event.wait(session.retry_in())  # Backing off after a failure
+                next_scan = time.time()
+                continue
+
+            if self.engine.stats is not None:
+                self.engine.stats.record_jitter(time.time() - next_scan)
+            if not self.scan_once():
+                continue
+
+            # Keep a fixed cadence, if the scan overran the cycle time start the next one straight away
+            next_scan = max(next_scan + cycle_time, time.time())
+            self._stop_event.wait(next_scan - time.time())
+
+        session.close()
+
+    def scan_once(self) -> bool:
+        """
+        Scans the PLC once, the connection is opened first if needed. A failure closes the connection and starts the
+        backoff of the session.
+
+        :return: TRUE if the scan completed
+        """
+        session = self.session
+        scan_start = time.time()
+        try:
+            self.engine.scan(self._connect())
+            self.scan_count += 1
+            self.last_scan_time = time.time() - scan_start
+            if self.engine.stats is not None:
+                self.engine.stats.record_scan(self.last_scan_time)
+        except Exception as err:
+            self.error_count += 1
+            session.failed(err)
+            print(f'Connection lost to PLC {self.plc_address}! ({err!r}), '
+                  f're-trying in {session.backoff():.1f}sec...')
+            return False
+
+        session.keepalive()
+        return True
+
+    def step(self, now: float, tolerance=0.0) -> bool:
+        """
+        Scans the PLC if a scan is due at simulation time now, replaces run() on a stepped clock
+
+        :param now: Current simulation time
+        :param tolerance: Scans due up to this time after now are scanned too, in sec
+        :return: TRUE if the PLC was scanned
+        """
+        if self._next_step is not None and now + tolerance < self._next_step:
+            return False
+        if not self.session.connected and self.session.retry_in() > 0:
+            return False
+
+        self._next_step = now if self._next_step is None else max(self._next_step + self.cycle_time, now)
+        return self.scan_once()
+
+    def stop(self):
+        """
+        Requests the worker to stop after its current scan
+
+        :return:
+        """
+        self._stop_event.set()
+
+    def _connect(self):
+        plc = self.session.connect()
+        if self.session.connect_count != self._connect_count:
+            # New connection, the engine drops the state tied to the previous one
+            self._connect_count = self.session.connect_count
+            if self.engine.stats is not None:
+                instrument_driver(plc, self.engine.stats)
+            self.engine.reset()
+        return plc
+
+
+class ScanScheduler:
+
+    def __init__(self, pool: ConnectionPool = None):
+        """
+        Runs one Controller Worker per PLC connection concurrently, total cycle time is set by the slowest PLC instead
+        of the sum of all of them
+
+        :param pool: Connection Pool holding the session of every worker, a new one by default
+        """
+        self.workers = []
+        self.pool = pool if pool is not None else ConnectionPool()
+        self._stepped_thread = None
+        self._stop_event = threading.Event()
+
+    def add_controller(self, plc_address: str, engine: ScanEngine, plc_tags: dict, cycle_time=0.5, reconnect_time=5,
+                       driver=CachedTagDriver):
+        """
+        Adds a worker for a PLC
+
+        :param plc_address: PLC IP/Slot number to R/W Tag data
+        :param engine: Scan Engine holding the devices owned by this PLC
+        :param plc_tags: Tag database uploaded from the PLC at startup
+        :param cycle_time: Target time between the start of two consecutive scans, in sec
+        :param reconnect_time: Time to wait before the first re-connection attempt after a failure, doubled on every
+        consecutive failure, in sec
+        :param driver: Creates the PLC connections, CachedTagDriver or a stand-in with the same interface
+        :return: The Controller Worker created
+        """
+        session = self.pool.add(plc_address, plc_tags, driver, reconnect_time)
+        worker = ControllerWorker(plc_address, engine, session, cycle_time)
+        self.workers.append(worker)
+        return worker
+
+    def start(self):
+        clock = SimClock.get_clock()
+        if isinstance(clock, SimClock.SteppedClock):
+            # A single thread scans the PLCs in order and advances the clock, no worker thread is started
+            self._stepped_thread = threading.Thread(target=self._run_stepped, args=(clock,), name='SteppedScan',
+                                                    daemon=True)
+            self._stepped_thread.start()
+            return
+        for worker in self.workers:
+            worker.start()
+
+    def stop(self):
+        if self._stepped_thread is not None:
+            self._stop_event.set()
+            self._stepped_thread.join()
+            for worker in self.workers:
+                worker.session.close()
+            return
+        for worker in self.workers:
+            worker.stop()
+        for worker in self.workers:
+            worker.join()
+
+    def step(self, clock: SimClock.SteppedClock):
+        """
+        Scans every PLC due at the current time of the clock, in the order they were added, and advances the clock one
+        step. Drives the simulation deterministically, start() calls it in a loop on a stepped clock.
+
+        :param clock: Stepped Clock in use
+        :return:
+        """
+        now = clock.time()
+        for worker in self.workers:
+            worker.step(now, clock.step / 2)
+        clock.advance()
+
+    def _run_stepped(self, clock: SimClock.SteppedClock):
+        while not self._stop_event.is_set():
+            retry_in = [worker.session.retry_in() for worker in self.workers if not worker.session.connected]
+            if self.workers and len(retry_in) == len(self.workers) and min(retry_in) > 0:
+                # Every PLC is backing off, the simulation time is held until one of them can be scanned
+                self._stop_event.wait(min(retry_in))
+                continue
+            self.step(clock)
@@ -0,0 +1,221 @@
+import collections
+import http.server
+import json
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class RollingStat:
+    __slots__ = ('samples', 'count', 'total')
+
+    def __init__(self, window=100):
+        """
+        Rolling window of duration samples
+
+        :param window: Number of samples kept
+        """
+
+        self.samples = collections.deque(maxlen=window)
+        self.count = 0  # Samples recorded since start
+        self.total = 0.0  # Sum of all samples since start
+
+    def add(self, value: float):
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+
+    def summary(self) -> dict:
+        """
+        :return: Last, mean and max of the window, in ms
+        """
+        if not self.samples:
+            return {'last_ms': 0.0, 'mean_ms': 0.0, 'max_ms': 0.0}
+        samples = list(self.samples)
+        return {'last_ms': round(samples[-1] * 1000, 3),
+                'mean_ms': round(sum(samples) / len(samples) * 1000, 3),
+                'max_ms': round(max(samples) * 1000, 3)}
+
+
+class ScanStats:
+
+    def __init__(self, plc_address: str, target_cycle_time: float, window=100):
+        """
+        Scan statistics of a single PLC: timings per phase (read, process, write) and per device class, CIP requests
+        and bytes exchanged and cycle overruns
+
+        :param plc_address: PLC IP/Slot number
+        :param target_cycle_time: Scan cycle time budget, scans taking longer are counted as overruns, in sec
+        :param window: Number of samples kept for the rolling timings
+        """
+
+        self.plc_address = plc_address
+        self.target_cycle_time = target_cycle_time
+        self.window = window
+        self.phases = {'read': RollingStat(window), 'process': RollingStat(window), 'write': RollingStat(window),
+                       'scan': RollingStat(window)}
+        self.device_classes = {}  # Device class name -> RollingStat
+        self.jitter = RollingStat(window)  # Delay between the planned and the actual start of every scan
+        self.scans = 0
+        self.overruns = 0
+        self.requests = 0  # CIP requests sent
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.tag_cache_hits = 0  # Tags served by the Tag Cache of the cycle instead of being read again
+        self.tag_cache_misses = 0
+        self._lock = threading.Lock()  # Summaries are taken from other threads
+
+    def record_phase(self, phase: str, duration: float):
+        with self._lock:
+            self.phases[phase].add(duration)
+
+    def record_device_class(self, device_class: str, duration: float):
+        with self._lock:
+            stat = self.device_classes.get(device_class)
+            if stat is None:
+                stat = self.device_classes[device_class] = RollingStat(self.window)
+            stat.add(duration)
+
+    def record_scan(self, duration: float):
+        """
+        Records a complete scan and flags it if it overran the cycle time budget
+
+        :param duration: Scan duration, in sec
+        :return:
+        """
+        with self._lock:
+            self.phases['scan'].add(duration)
+            self.scans += 1
+            if duration > self.target_cycle_time:
+                self.overruns += 1
+                log.warning('PLC %s scan overrun: %.1fms > %.1fms', self.plc_address, duration * 1000,
+                            self.target_cycle_time * 1000)
+
+    def record_jitter(self, delay: float):
+        with self._lock:
+            self.jitter.add(delay)
+
+    def record_request(self, bytes_sent: int, bytes_received=0):
+        with self._lock:
+            self.requests += 1
+            self.bytes_sent += bytes_sent
+            self.bytes_received += bytes_received
+
+    def record_reply(self, bytes_received: int):
+        with self._lock:
+            self.bytes_received += bytes_received
+
+    def record_tag_cache(self, hits: int, misses: int):
+        with self._lock:
+            self.tag_cache_hits += hits
+            self.tag_cache_misses += misses
+
+    def summary(self) -> dict:
+        """
+        :return: Dictionary summarising the statistics, JSON serialisable
+        """
+        with self._lock:
+            return {'plc_address': self.plc_address,
+                    'target_cycle_ms': round(self.target_cycle_time * 1000, 3),
+                    'scans': self.scans,
+                    'overruns': self.overruns,
+                    'requests': self.requests,
+                    'requests_per_scan': round(self.requests / self.scans, 2) if self.scans else 0.0,
+                    'bytes_sent': self.bytes_sent,
+                    'bytes_received': self.bytes_received,
+                    'tag_cache_hits': self.tag_cache_hits,
+                    'tag_cache_misses': self.tag_cache_misses,
+                    'jitter': self.jitter.summary(),
+                    'phases': {phase: stat.summary() for phase, stat in self.phases.items()},
+                    'device_classes': {name: stat.summary() for name, stat in self.device_classes.items()}}
+
+
+def instrument_driver(plc, stats: ScanStats):
+    """
+    Counts the CIP requests sent through a LogixDriver connection and their size. The bound _send() and _receive()
+    methods of the connection are wrapped, every request goes through them, fragmented reads and writes included,
+    and the driver class itself is left untouched
+
+    :param plc: LogixDriver PLC Object
+    :param stats: ScanStats of the PLC
+    :return:
+    """
+    send = getattr(plc, '_send', None)
+    receive = getattr(plc, '_receive', None)
+    if send is None or receive is None:
+        return
+
+    def counted_send(message):
+        send(message)
+        stats.record_request(len(message or b''))
+
+    def counted_receive():
+        reply = receive()
+        stats.record_reply(len(reply or b''))
+        return reply
+
+    plc._send = counted_send
+    plc._receive = counted_receive
+
+
+class StatsReporter:
+
+    def __init__(self, stats: list, log_interval=10.0, http_port=None, http_host='127.0.0.1'):
+        """
+        Exposes the scan statistics of all PLCs as a periodic structured (JSON) log entry and optionally as a JSON
+        document served on http://<http_host>:<http_port>/stats
+
+        :param stats: List of ScanStats
+        :param log_interval: Time between log entries, in sec, 0 disables logging
+        :param http_port: Port of the local stats endpoint, None disables it
+        :param http_host: Interface the stats endpoint listens on, local only by default
+        """
+
+        self.stats = stats
+        self.log_interval = log_interval
+        self.http_port = http_port
+        self.http_host = http_host
+        self._server = None
+        self._stop_event = threading.Event()
+        self._log_thread = None
+
+    def summary(self) -> dict:
+        return {'time': time.time(), 'controllers': [stats.summary() for stats in self.stats]}
+
+    def start(self):
+        if self.log_interval:
+            self._log_thread = threading.Thread(target=self._log_loop, name='StatsReporter', daemon=True)
+            self._log_thread.start()
+
+        if self.http_port is not None:
+            reporter = self
+
+            class StatsHandler(http.server.BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.rstrip('/') != '/stats':
+                        self.send_error(404)
+                        return
+                    body = json.dumps(reporter.summary()).encode()
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, *args):
+                    pass  # Keep requests out of the console
+
+            self._server = http.server.ThreadingHTTPServer((self.http_host, self.http_port), StatsHandler)
+            threading.Thread(target=self._server.serve_forever, name='StatsServer', daemon=True).start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def _log_loop(self):
+        while not self._stop_event.wait(self.log_interval):
+            log.info('Scan stats %s', json.dumps(self.summary()))
@@ -0,0 +1,345 @@
+import multiprocessing
+import multiprocessing.connection
+import os
+import threading
+import time
+
+import SimClock
+from AsyncRuntime import AsyncScanScheduler
+from ConnectionPool import CachedTagDriver, ConnectionPool
+from DeviceConfig import DeviceChanges, patch_worker
+from DeviceRegistry import ControllerDevices
+from MultiRateEngine import MultiRateEngine
+from ScanEngine import ScanEngine, ScanScheduler, WriteCache
+from ScanStats import ScanStats
+from TagIndex import TagIndex
+from TagRecorder import TagRecorder
+
+
+class ShardItem:
+
+    def __init__(self, key: str, partition: ControllerDevices, plc_tags: dict, cycle_time: float, reconnect_time: float,
+                 driver):
+        """
+        Devices of a PLC, or part of them, scanned over one connection of a shard process
+
+        :param key: Unique name of the item, the PLC address or <PLC address>#<part> when a PLC is split
+        :param partition: Devices scanned
+        :param plc_tags: Tag database of the PLC
+        :param cycle_time: Target time between the start of two consecutive scans, in sec
+        :param reconnect_time: Time to wait before the first re-connection attempt after a failure, in sec
+        :param driver: Creates the PLC connections, has to be picklable
+        """
+
+        self.key = key
+        self.partition = partition
+        self.plc_tags = plc_tags
+        self.cycle_time = cycle_time
+        self.reconnect_time = reconnect_time
+        self.driver = driver
+
+
+class RemoteStats:
+    __slots__ = ('key', 'latest')
+
+    def __init__(self, key: str):
+        """
+        Latest scan statistics reported by a shard process, same summary() interface as ScanStats
+
+        :param key: Shard item key
+        """
+
+        self.key = key
+        self.latest = {'plc_address': key, 'scans': 0}
+
+    def summary(self) -> dict:
+        return self.latest
+
+
+def _shard_main(shard_id: int, items: list, options: dict, pipe):
+    """
+    Entry point of a shard process, scans its items and reports health and scan statistics back to the supervisor
+    until it receives a stop request or the supervisor is gone
+
+    :return:
+    """
+    SimClock.set_clock(options['clock'])
+    recorder = None
+    if options['record_file']:
+        # One recording per shard, the Replay Engine merges them back by time
+        root, ext = os.path.splitext(options['record_file'])
+        recorder = TagRecorder(f'{root}.shard{shard_id}{ext}')
+    pool = ConnectionPool(options['max_backoff'], options['keepalive_time'], recorder)
+    scheduler = AsyncScanScheduler(pool=pool) if options['async_runtime'] else ScanScheduler(pool)
+    stats = []
+    for item in items:
+        stats.append(ScanStats(item.key, item.cycle_time))
+        tag_index = None
+        if options['resolve_tags']:
+            tag_index = TagIndex(item.plc_tags, item.partition.plc_address)
+            tag_index.report(item.partition.devices)
+        if options['multi_rate']:
+            engine = MultiRateEngine(item.partition, item.cycle_time, options['vectorized_analog'],
+                                     options['write_refresh_time'], stats[-1], tag_index=tag_index)
+            stats[-1].target_cycle_time = engine.cycle_time
+        else:
+            write_cache = WriteCache(options['write_refresh_time']) if options['write_refresh_time'] is not None \
+                else None
+            engine = ScanEngine(item.partition, options['vectorized_analog'], write_cache, stats[-1],
+                                tag_index=tag_index)
+        scheduler.add_controller(item.partition.plc_address, engine, item.plc_tags, stats[-1].target_cycle_time,
+                                 item.reconnect_time, item.driver)
+    scheduler.start()
+
+    def report():
+        pipe.send({'shard': shard_id,
+                   'pid': os.getpid(),
+                   'time': time.time(),
+                   'workers': [{'key': item.key,
+                                'plc_address': worker.plc_address,
+                                'devices': len(item.partition),
+                                'scan_count': worker.scan_count,
+                                'error_count': worker.error_count,
+                                'last_scan_time': worker.last_scan_time,
+                                'connection': worker.session.summary()}
+                               for item, worker in zip(items, scheduler.workers)],
+                   'stats': [stat.summary() for stat in stats]})
+
+    try:
+        # Device Changes are patched between scans, anything else received, or the pipe closing, stops the shard
+        while True:
+            if not pipe.poll(options['report_interval']):
+                report()
+                continue
+            message = pipe.recv()
+            if not isinstance(message, tuple) or message[0] != 'changes':
+                break
+            _, changes, add_key = message
+            for item, worker in zip(items, scheduler.workers):
+                if item.partition.plc_address == changes.plc_address:
+                    patch_worker(worker, changes, item.key == add_key)
+    except (EOFError, OSError):
+        pass
+    finally:
+        scheduler.stop()
+        pool.close()
+        try:
+            report()
+        except OSError:
+            pass
+        pipe.close()
+
+
+class ShardSupervisor:
+
+    def __init__(self, processes=None, max_devices_per_shard=None, vectorized_analog=True, write_refresh_time=10.0,
+                 async_runtime=False, report_interval=1.0, multi_rate=False, max_backoff=60.0, keepalive_time=10.0,
+                 clock=None, record_file=None, resolve_tags=False):
+        """
+        Shards the PLCs across worker processes so the scans aren't limited to one core. Each process owns its
+        connections, devices and tag data and reports health and scan statistics back, processes that die are
+        restarted with the same shard. PLCs, or parts of a PLC, joined by a Flow Link are kept in the same process.
+
+        Processes are started with the forkserver start method where the platform allows it, spawn otherwise (Windows),
+        never forked from this process: the restarts would be forked from the monitor thread while other threads hold
+        the stdout or logging locks. Shard Items are pickled to the processes, and the script creating the supervisor
+        must guard its startup code with if __name__ == '__main__' since every process imports it again.
+
+        :param processes: Number of worker processes, one per CPU by default
+        :param max_devices_per_shard: PLCs with more devices are split in parts scanned over separate connections,
+        None never splits a PLC
+        :param vectorized_analog: Steps the Analog Inputs with an Analog Kernel
+        :param write_refresh_time: Time between full feedback refreshes of the Write Cache, in sec, None writes all the
+        values every scan
+        :param async_runtime: Scans the PLCs of a process from an asyncio event loop instead of one thread per PLC
+        :param report_interval: Time between health reports of every process, in sec
+        :param multi_rate: Scans the devices on their own period and priority with a Multi Rate Engine, the cycle time
+        of the PLCs is then the default period
+        :param max_backoff: Longest backoff between re-connection attempts to a PLC, in sec
+        :param keepalive_time: Idle time before a connection sends a keepalive request, in sec, 0 disables it
+        :param clock: Simulation clock of the processes, the clock in use by default. Every process runs its own copy,
+        stepped clocks advance independently in every process.
+        :param record_file: Records the tag traffic of every process to <record_file root>.shard<id><ext> if given
+        :param resolve_tags: Resolves the tags of the devices against the tag database of their PLC with a Tag Index,
+        the missing ones aren't read
+        """
+
+        self.processes = processes or os.cpu_count() or 1
+        self.max_devices_per_shard = max_devices_per_shard
+        self.options = {'vectorized_analog': vectorized_analog, 'write_refresh_time': write_refresh_time,
+                        'async_runtime': async_runtime, 'report_interval': report_interval, 'multi_rate': multi_rate,
+                        'max_backoff': max_backoff, 'keepalive_time': keepalive_time,
+                        'clock': clock if clock is not None else SimClock.get_clock(), 'record_file': record_file,
+                        'resolve_tags': resolve_tags}
+        self.items = []  # Shard Items
+        self.shards = []  # Shard Items of every process
+        self.stats = []  # Remote Stats of every Shard Item, can be handed to a Stats Reporter
+        self.restart_count = 0
+        self._stats_by_key = {}
+        self._reports = {}  # Shard id -> latest report
+        self._processes = []
+        # Pipe of every process, carries the reports and the stop request. Nothing is shared between the processes,
+        # a process killed at any point only breaks its own pipe.
+        self._pipes = []
+        self._context = multiprocessing.get_context(
+            'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+        self._stop_event = threading.Event()
+        self._monitor = None
+
+    def add_controller(self, plc_address: str, partition: ControllerDevices, plc_tags: dict, cycle_time=0.5,
+                       reconnect_time=5, driver=CachedTagDriver):
+        """
+        Adds the devices of a PLC
+
+        :param plc_address: PLC IP/Slot number to R/W Tag data
+        :param partition: Devices owned by the PLC, taken from the Device Registry
+        :param plc_tags: Tag database uploaded from the PLC at startup
+        :param cycle_time: Target time between the start of two consecutive scans, in sec
+        :param reconnect_time: Time to wait before the first re-connection attempt after a failure, doubled on every
+        consecutive failure, in sec
+        :param driver: Creates the PLC connections, has to be picklable
+        :return:
+        """
+        parts = partition.split(self.max_devices_per_shard) if self.max_devices_per_shard else [partition]
+        for idx, part in enumerate(parts):
+            key = plc_address if len(parts) == 1 else f'{plc_address}#{idx}'
+            self.items.append(ShardItem(key, part, plc_tags, cycle_time, reconnect_time, driver))
+            self._stats_by_key[key] = RemoteStats(key)
+            self.stats.append(self._stats_by_key[key])
+
+    def _plan(self):
+        # Items joined by a Flow Link go to the same process, every process works on its own copy of the devices, a
+        # tank or valve scanned by another process would never change
+        owner = {id(device): idx for idx, item in enumerate(self.items) for device in item.partition.devices}
+        group = list(range(len(self.items)))
+
+        def root(idx):
+            while group[idx] != idx:
+                idx = group[idx]
+            return idx
+
+        for idx, item in enumerate(self.items):
+            for tank in item.partition.tanks:
+                for link in tank.links:
+                    for device in (link.source, link.target, link.valve):
+                        if id(device) in owner:
+                            group[root(owner[id(device)])] = root(idx)
+        units = {}
+        for idx, item in enumerate(self.items):
+            units.setdefault(root(idx), []).append(item)
+
+        # Largest units first, each one to the least loaded process
+        shards = [[] for _ in range(min(self.processes, len(units)))]
+        loads = [0] * len(shards)
+        for unit in sorted(units.values(), key=lambda unit: sum(len(item.partition) for item in unit), reverse=True):
+            idx = loads.index(min(loads))
+            shards[idx].extend(unit)
+            loads[idx] += sum(len(item.partition) for item in unit)
+        return shards
+
+    def start(self):
+        self.shards = self._plan()
+        self._stop_event.clear()
+        self._processes = [None] * len(self.shards)
+        self._pipes = [None] * len(self.shards)
+        for shard_id in range(len(self.shards)):
+            self._spawn(shard_id)
+        self._monitor = threading.Thread(target=self._monitor_loop, name='ShardMonitor', daemon=True)
+        self._monitor.start()
+
+    def stop(self, timeout=10):
+        """
+        Stops all the processes after their current scan, processes still running after the timeout are terminated
+
+        :param timeout: Time to wait for the processes to stop, in sec
+        :return:
+        """
+        self._stop_event.set()
+        if self._monitor is not None:
+            self._monitor.join()
+        for pipe in self._pipes:
+            try:
+                pipe.send('stop')
+            except OSError:
+                pass
+
+        # Keep reading while waiting, a process can't exit until its final report is taken from the pipe
+        deadline = time.time() + timeout
+        while any(process.is_alive() for process in self._processes) and time.time() < deadline:
+            self._collect_reports(timeout=0.1)
+        self._collect_reports()
+        for process in self._processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+
+    def apply_changes(self, changes: DeviceChanges):
+        """
+        Hands the Device Changes of a PLC to the processes scanning it, patched between two scans. The items of this
+        process are patched as well so restarted processes start with the changes.
+
+        :param changes: Device Changes of the PLC
+        :return:
+        """
+        items = [item for item in self.items if item.partition.plc_address == changes.plc_address]
+        if not items:
+            return
+        # New devices go to the first part of a PLC split in parts
+        for item in items:
+            changes.apply(item.partition, item is items[0])
+            if changes.tag_definitions is not None:
+                item.plc_tags = changes.tag_definitions
+        for shard_id, shard in enumerate(self.shards):
+            if any(item in items for item in shard):
+                try:
+                    self._pipes[shard_id].send(('changes', changes, items[0].key))
+                except OSError:
+                    pass  # Process gone, restarted with the changes
+
+    def health(self) -> list:
+        """
+        :return: Health of every shard process: pid, alive, age of its last report and its workers
+        """
+        now = time.time()
+        health = []
+        for shard_id, process in enumerate(self._processes):
+            report = self._reports.get(shard_id)
+            health.append({'shard': shard_id,
+                           'pid': process.pid,
+                           'alive': process.is_alive(),
+                           'report_age': now - report['time'] if report else None,
+                           'workers': report['workers'] if report else []})
+        return health
+
+    def _spawn(self, shard_id: int):
+        pipe, child_pipe = self._context.Pipe()
+        process = self._context.Process(target=_shard_main, name=f'ScanShard-{shard_id}', daemon=True,
+                                        args=(shard_id, self.shards[shard_id], self.options, child_pipe))
+        process.start()
+        child_pipe.close()  # Only the child keeps its end open, the pipe reports EOF when the child is gone
+        self._processes[shard_id] = process
+        self._pipes[shard_id] = pipe
+
+    def _monitor_loop(self):
+        while not self._stop_event.is_set():
+            self._collect_reports(timeout=0.5)
+            for shard_id, process in enumerate(self._processes):
+                if not process.is_alive() and not self._stop_event.is_set():
+                    self.restart_count += 1
+                    print(f'Scan shard {shard_id} (pid {process.pid}) exited with code {process.exitcode}, '
+                          f'restarting it...')
+                    self._pipes[shard_id].close()
+                    process.join()
+                    self._spawn(shard_id)
+
+    def _collect_reports(self, timeout=0.0):
+        pipes = [pipe for pipe in self._pipes if not pipe.closed]
+        for pipe in multiprocessing.connection.wait(pipes, timeout):
+            try:
+                while pipe.poll():
+                    report = pipe.recv()
+                    self._reports[report['shard']] = report
+                    for stat in report['stats']:
+                        self._stats_by_key[stat['plc_address']].latest = stat
+            except (EOFError, OSError):
+                pipe.close()  # Process gone, the monitor restarts it
@@ -0,0 +1,131 @@
+import threading
+import time
+
+
+class RealClock:
+
+    def __init__(self):
+        """
+        Simulation time follows the wall clock
+        """
+        self.rate = 1.0  # Simulation seconds per wall clock second
+
+    def time(self) -> float:
+        """
+        :return: Current simulation time, in sec since the epoch
+        """
+        return time.time()
+
+
+class ScaledClock:
+
+    def __init__(self, scale=10.0, start=None):
+        """
+        Simulation time runs scale times faster than the wall clock, valves travel and levels integrate scale times
+        faster and the scan workers tick scale times more often, so the simulation keeps the same resolution
+
+        :param scale: Simulation seconds per wall clock second
+        :param start: Simulation time when the clock is created, the current time by default
+        """
+        if scale <= 0:
+            raise ValueError(f'Clock scale must be positive, got {scale}')
+
+        self.rate = scale
+        self._wall_start = time.time()  # Wall clock based, the clock is consistent in the shard processes
+        self._sim_start = self._wall_start if start is None else start
+
+    def time(self) -> float:
+        """
+        :return: Current simulation time, in sec since the epoch
+        """
+        return self._sim_start + (time.time() - self._wall_start) * self.rate
+
+
+class SteppedClock:
+
+    def __init__(self, step=0.5, start=None):
+        """
+        Simulation time only moves when the clock is advanced, by a fixed step. Scan Schedulers running on a stepped
+        clock scan their PLCs one after the other in a fixed order and advance the clock once every PLC due is done,
+        without waiting between steps, so the simulation runs as fast as the scans allow and repeats exactly.
+
+        :param step: Simulation time added on every advance(), in sec
+        :param start: Simulation time when the clock is created, the current time by default
+        """
+        if step <= 0:
+            raise ValueError(f'Clock step must be positive, got {step}')
+
+        self.rate = None  # Not tied to the wall clock
+        self.step = step
+        self.step_count = 0
+        self._now = time.time() if start is None else start
+        self._lock = threading.Lock()
+
+    def time(self) -> float:
+        """
+        :return: Current simulation time, in sec since the epoch
+        """
+        return self._now
+
+    def advance(self, steps=1) -> float:
+        """
+        Moves the simulation time forward
+
+        :param steps: Number of steps
+        :return: New simulation time
+        """
+        with self._lock:
+            self.step_count += steps
+            self._now += self.step * steps
+            return self._now
+
+    def advance_to(self, new_time: float) -> float:
+        """
+        Moves the simulation time forward to a given time, the replay of a recording follows the recorded times
+
+        :param new_time: Simulation time, times before the current one are ignored
+        :return: New simulation time
+        """
+        with self._lock:
+            self._now = max(self._now, new_time)
+            return self._now
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']  # Handed to shard processes
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+_clock = RealClock()
+
+
+def now() -> float:
+    """
+    Simulation time used by all the devices, replaces time.time() in the device logic
+
+    :return: Current time of the simulation clock, in sec since the epoch
+    """
+    return _clock.time()
+
+
+def get_clock():
+    """
+    :return: Simulation clock in use, RealClock, ScaledClock or SteppedClock
+    """
+    return _clock
+
+
+def set_clock(clock):
+    """
+    Replaces the simulation clock of the process. Needs to be set before the devices are created, their timers start
+    from the time of the clock in use when they are created.
+
+    :param clock: RealClock, ScaledClock or SteppedClock
+    :return:
+    """
+    global _clock
+    _clock = clock
@@ -0,0 +1,168 @@
+import hashlib
+import os
+import pickle
+
+from pycomm3 import LogixDriver
+
+import TagExport
+
+CACHE_VERSION = 3  # Bump when the layout of the cached data changes, older cache files are then ignored
+DEVICE_DATATYPES = ('UDT_zzVNC', 'UDT_zzVNO', 'UDT_zzAnaIN')  # Controller scoped UDTs turned into field devices
+
+
+def file_hash(filename: str) -> str:
+    """
+    Calculates the hash of a file, used to detect changes on the RSLogix tag exports
+
+    :param filename: File to hash
+    :return: Hex digest
+    """
+    sha = hashlib.sha1()
+    with open(filename, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 16), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def parse_tag_export(tag_file: str) -> list:
+    """
+    Extracts the controller scoped device tags from an RSLogix 5000 tag export
+
+    :param tag_file: RSLogix 5000 CSV tag export
+    :return: List of (name, datatype, description) tuples
+    """
+    return TagExport.read_devices(tag_file, DEVICE_DATATYPES, scope='')
+
+
+def controller_firmware(plc: LogixDriver) -> tuple:
+    """
+    Identifies the controller and its firmware, a change means the tag database has to be uploaded again. A program
+    download or an online edit changes neither, the tag export has to be exported again (or the upload forced) for
+    the tag definitions to be uploaded again.
+
+    :param plc: LogixDriver PLC Object, connection needs to be open before its handed in
+    :return: (controller name, major firmware revision, minor firmware revision)
+    """
+    revision = plc.info.get('revision', {})
+    return plc.info.get('name'), revision.get('major'), revision.get('minor')
+
+
+class ControllerTags:
+
+    def __init__(self, plc_address: str, tag_file: str, tag_file_hash: str, devices: list):
+        """
+        Cached tag data of a single PLC
+
+        :param plc_address: PLC IP/Slot number
+        :param tag_file: RSLogix 5000 CSV tag export of the PLC program
+        :param tag_file_hash: Hash of the tag export when it was parsed
+        :param devices: List of (name, datatype, description) tuples parsed from the tag export
+        """
+
+        self.plc_address = plc_address
+        self.tag_file = tag_file
+        self.tag_file_hash = tag_file_hash
+        self.devices = devices
+        self.firmware = None  # Controller name and firmware revision the tag definitions were uploaded from
+        self.tags = None  # Pycomm3 tag definitions, tag name -> definition
+
+
+class TagDatabase:
+
+    def __init__(self, cache_file: str, driver=LogixDriver):
+        """
+        Persistent cache of the PLC tag databases and the device tags parsed from the RSLogix tag exports. Parsed data
+        is reused while the tag export hash doesn't change and uploaded tag definitions while neither the tag export
+        nor the controller firmware change, so a warm start doesn't upload tags from any PLC. The PLC doesn't report
+        program downloads, the tag export has to be exported again after one, or the upload forced.
+
+        :param cache_file: File holding the cache
+        :param driver: Creates the PLC connections, LogixDriver or a stand-in with the same interface
+        """
+
+        self.cache_file = cache_file
+        self.driver = driver
+        self.controllers = {}  # PLC Address -> ControllerTags
+        self.tag_names = set()  # Tag names of all the loaded PLCs, used for global tag search
+        self._modified = False
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.cache_file, 'rb') as file:
+                data = pickle.load(file)
+        except FileNotFoundError:
+            return
+        except Exception as err:
+            print(f'Tag database cache {self.cache_file} is unreadable ({err!r}), rebuilding it...')
+            return
+
+        if data.get('version') != CACHE_VERSION:
+            print(f'Tag database cache {self.cache_file} is outdated, rebuilding it...')
+            return
+        self.controllers = data['controllers']
+
+    def save(self):
+        """
+        Writes the cache back to disk if anything changed, the file is replaced atomically
+
+        :return:
+        """
+        if not self._modified:
+            return
+
+        temp_file = self.cache_file + '.tmp'
+        with open(temp_file, 'wb') as file:
+            pickle.dump({'version': CACHE_VERSION, 'controllers': self.controllers}, file,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_file, self.cache_file)
+        self._modified = False
+
+    def load_controller(self, plc_address: str, tag_file: str, check_firmware=True,
+                        force_upload=False) -> ControllerTags:
+        """
+        Loads the tag data of a PLC, from the cache when still valid
+
+        :param plc_address: PLC IP/Slot number
+        :param tag_file: RSLogix 5000 CSV tag export of the PLC program
+        :param check_firmware: Connects to the PLC (without uploading tags) to check the cached tag definitions
+        were uploaded from the same controller and firmware, if FALSE cached tag definitions are used without connecting
+        :param force_upload: Uploads the tag definitions again even if the cached ones are still valid
+        :return: ControllerTags of the PLC
+        """
+        tag_file_hash = file_hash(tag_file)
+        controller = self.controllers.get(plc_address)
+
+        if controller is None or controller.tag_file != tag_file or controller.tag_file_hash != tag_file_hash:
+            # New or changed tag export, the cached tag definitions are dropped as well since the program changed
+            print(f'Parsing tag export {tag_file}...')
+            controller = ControllerTags(plc_address, tag_file, tag_file_hash, parse_tag_export(tag_file))
+            self.controllers[plc_address] = controller
+            self._modified = True
+
+        if force_upload and controller.tags is not None:
+            controller.tags = None
+            self._modified = True
+        if controller.tags is None or check_firmware:
+            self._sync_controller(controller)
+
+        self.tag_names.update(controller.tags)
+        return controller
+
+    def _sync_controller(self, controller: ControllerTags):
+        """
+        Uploads the tag definitions of a PLC if there's none cached or if the controller firmware changed
+
+        :param controller: ControllerTags of the PLC
+        :return:
+        """
+        with self.driver(controller.plc_address, init_tags=False) as plc:
+            firmware = controller_firmware(plc)
+            if controller.tags is not None and firmware == controller.firmware:
+                return
+
+            print(f'Uploading tag database from PLC {controller.plc_address}...')
+            plc.get_tag_list(program='*')
+            controller.tags = plc.tags
+            controller.firmware = firmware
+            self._modified = True
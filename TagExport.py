@@ -0,0 +1,110 @@
+import csv
+import re
+from typing import NamedTuple, Optional
+
+EXPORT_ENCODING = 'Windows-1252'
+
+# RSLogix 5000 escape sequences used in descriptions and comments
+_ESCAPES = {'$N': '\n', '$L': '\n', '$R': '\r', '$T': '\t', '$P': '\f', '$Q': '"', "$'": "'", '$$': '$'}
+_ESCAPE_PATTERN = re.compile(r"\$([0-9A-Fa-f]{2}|[NLRTPQ'$])")
+
+
+class TagRecord(NamedTuple):
+    scope: str  #: Program name, empty for controller scoped tags
+    name: str
+    description: str
+    datatype: str
+    specifier: str  #: Tag attributes
+
+
+class AliasRecord(NamedTuple):
+    scope: str
+    name: str
+    description: str
+    alias_for: str  #: Tag or member the alias points to
+
+
+class CommentRecord(NamedTuple):
+    scope: str
+    name: str  #: Base tag the comment belongs to
+    description: str
+    specifier: str  #: Member or bit of the base tag being commented
+
+
+def unescape(text: str) -> str:
+    """
+    Replaces the RSLogix 5000 escape sequences ($N, $Q, $hh...) of a description
+
+    :param text: Raw description from the export
+    :return: Description text
+    """
+    if '$' not in text:
+        return text
+
+    def _replace(match):
+        code = match.group(1)
+        if len(code) == 2:
+            return chr(int(code, 16))
+        return _ESCAPES['$' + code]
+
+    return _ESCAPE_PATTERN.sub(_replace, text)
+
+
+def read_tag_export(tag_file: str, record_types=('TAG', 'ALIAS', 'COMMENT'), datatypes=None, scope: Optional[str] = None):
+    """
+    Streams an RSLogix 5000 CSV tag export line by line, memory use doesn't depend on the size of the export
+
+    :param tag_file: RSLogix 5000 CSV tag export
+    :param record_types: Record types to yield, any of 'TAG', 'ALIAS' and 'COMMENT'
+    :param datatypes: If given, only TAG records with one of these datatypes are yielded
+    :param scope: If given, only records of this scope are yielded, '' for controller scoped records
+    :return: Generator of TagRecord, AliasRecord and CommentRecord
+    """
+    record_types = frozenset(record_types)
+    datatypes = frozenset(datatypes) if datatypes is not None else None
+
+    with open(tag_file, 'r', encoding=EXPORT_ENCODING, newline='') as file:
+        for row in csv.reader(file):
+            # Remarks, version and header lines of every section are skipped here as well as unwanted records
+            if not row or row[0] not in record_types or len(row) < 6:
+                continue
+            record_type, row_scope, name, description, datatype, specifier = row[:6]
+            if scope is not None and row_scope != scope:
+                continue
+
+            if record_type == 'TAG':
+                if datatypes is not None and datatype not in datatypes:
+                    continue
+                yield TagRecord(row_scope, name, unescape(description), datatype, specifier)
+            elif record_type == 'ALIAS':
+                yield AliasRecord(row_scope, name, unescape(description), specifier)
+            else:
+                yield CommentRecord(row_scope, name, unescape(description), specifier)
+
+
+def read_devices(tag_file: str, datatypes, scope='') -> list:
+    """
+    Extracts the device tags from an RSLogix 5000 tag export. Devices without a tag description take it from the I/O
+    comments referencing them, these are written as '=<device id without prefix letter>$N<text>'
+
+    :param tag_file: RSLogix 5000 CSV tag export
+    :param datatypes: Datatypes of the device tags
+    :param scope: Scope of the device tags, '' for controller scoped tags
+    :return: List of (name, datatype, description) tuples in export order
+    """
+    datatypes = frozenset(datatypes)
+    devices = []
+    io_comments = {}  # Device id -> comment texts, only comments referencing a device id are kept
+
+    for record in read_tag_export(tag_file, ('TAG', 'COMMENT')):
+        if isinstance(record, TagRecord):
+            if record.datatype in datatypes and record.scope == scope:
+                devices.append(record)
+        elif record.description.startswith('='):
+            device_id, _, text = record.description[1:].partition('\n')
+            text = text.strip()
+            if text and text not in io_comments.setdefault(device_id, []):
+                io_comments[device_id].append(text)
+
+    return [(device.name, device.datatype, device.description or ' / '.join(io_comments.get(device.name[1:], [])))
+            for device in devices]
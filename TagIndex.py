@@ -0,0 +1,139 @@
+from pycomm3 import Tag
+
+from DeviceRegistry import DeviceRegistry
+
+# Tag type codes of the values the devices use
+TYPE_NONE = 0  # Tag doesn't exist, failed to read or not used by the evaluation plan
+TYPE_BOOL = 1
+TYPE_REAL = 2
+TYPE_UDT = 3  # UDT_zzAnaIN, value is taken from the Channel member
+TYPE_OTHER = 4
+
+TYPE_CODES = {'BOOL': TYPE_BOOL, 'REAL': TYPE_REAL, 'UDT_zzAnaIN': TYPE_UDT}
+INTEGER_TYPES = ('SINT', 'INT', 'DINT', 'LINT', 'USINT', 'UINT', 'UDINT', 'ULINT')  # Bits addressed as Tag.<bit>
+ATOMIC_TYPES = INTEGER_TYPES + ('BOOL', 'REAL', 'LREAL')
+TAG_NOT_IN_DATABASE = 'Tag not found in the tag database'
+
+
+class TagHandle:
+    __slots__ = ('name', 'exists', 'data_type', 'members', 'code')
+
+    def __init__(self, name: str, exists: bool, data_type: str = None, members=()):
+        """
+        Tag resolved against the tag database of its PLC
+
+        :param name: Tag name as configured
+        :param exists: FALSE if the tag, or one of its members, isn't in the tag database
+        :param data_type: Data type name of the value, None if unknown (members of structures without a template)
+        :param members: Member path below the base tag, array indexes left out
+        """
+
+        self.name = name
+        self.exists = exists
+        self.data_type = data_type
+        self.members = members
+        # Type code of the value, None if it has to be taken from the Tag read
+        if not exists:
+            self.code = TYPE_NONE
+        elif data_type is None:
+            self.code = None
+        else:
+            self.code = TYPE_CODES.get(data_type, TYPE_OTHER)
+
+    def __repr__(self):
+        return f'TagHandle({self.name!r}, exists={self.exists}, data_type={self.data_type!r})'
+
+
+class TagIndex:
+
+    def __init__(self, tag_definitions: dict, plc_address=''):
+        """
+        Type and existence index of the tags of a PLC, built once from the tag definitions of the Tag Database so the
+        scans don't have to find out on every cycle, from the Tag read, whether a tag exists and what it holds. Tags
+        missing from the PLC are dropped from the scans and served as a failed read.
+
+        Tag names are resolved like Logix does: not case sensitive, structure members (Tag.Member), array elements
+        (Tag[n]), bits of integers (Tag.n) and program scoped tags (Program:Name.Tag).
+
+        :param tag_definitions: Pycomm3 tag definitions of the PLC (LogixDriver.tags)
+        :param plc_address: PLC IP/Slot number, used in the reports
+        """
+
+        self.plc_address = plc_address
+        self.tag_definitions = tag_definitions
+        self._bases = {name.lower(): name for name in tag_definitions}  # Logix names aren't case sensitive
+        self._handles = {}  # Tag name -> Tag Handle, every tag is resolved once
+        self._missing = {}  # Tag name -> Pycomm3 Tag served instead of reading a missing tag
+
+    def resolve(self, tag: str) -> TagHandle:
+        """
+        :param tag: Tag name
+        :return: Tag Handle of the tag
+        """
+        handle = self._handles.get(tag)
+        if handle is None:
+            handle = self._handles[tag] = self._resolve(tag)
+        return handle
+
+    def exists(self, tag: str) -> bool:
+        return self.resolve(tag).exists
+
+    def missing_tag(self, tag: str) -> Tag:
+        """
+        :param tag: Tag name missing from the PLC
+        :return: Pycomm3 Tag the same as a failed read of the tag
+        """
+        result = self._missing.get(tag)
+        if result is None:
+            result = self._missing[tag] = Tag(tag, None, None, TAG_NOT_IN_DATABASE)
+        return result
+
+    def report(self, devices: list) -> dict:
+        """
+        Resolves the tags read and written by the devices and prints the missing ones, once per tag with the devices
+        using it
+
+        :param devices: Devices of the PLC
+        :return: Missing tag name -> names of the devices using it
+        """
+        missing = {}
+        for device in devices:
+            name = DeviceRegistry.device_name(device)
+            tags = device.scan_tags() + (device.scaling_tags() if hasattr(device, 'scaling_tags') else []) + \
+                device.feedback_tags()
+            for tag in dict.fromkeys(tags):
+                if not self.exists(tag):
+                    missing.setdefault(tag, []).append(name)
+        for tag, names in missing.items():
+            print(f'PLC {self.plc_address} - Tag {tag} not found, dropped from the scan (used by {", ".join(names)})')
+        return missing
+
+    def _resolve(self, tag: str) -> TagHandle:
+        parts = tag.split('.')
+        if parts[0].lower().startswith('program:') and len(parts) > 1:
+            parts = [parts[0] + '.' + parts[1]] + parts[2:]
+        base = self._bases.get(parts[0].split('[', 1)[0].lower())
+        if base is None:
+            return TagHandle(tag, False)
+
+        data_type = self.tag_definitions[base].get('data_type')
+        members = []
+        for part in parts[1:]:
+            member = part.split('[', 1)[0]
+            if isinstance(data_type, dict):
+                internal = {name.lower(): definition for name, definition in data_type.get('internal_tags', {}).items()}
+                definition = internal.get(member.lower())
+                if definition is None:
+                    return TagHandle(tag, False)
+                data_type = definition.get('data_type')
+            elif data_type in INTEGER_TYPES and member.isdigit():
+                data_type = 'BOOL'
+            elif data_type in ATOMIC_TYPES:
+                return TagHandle(tag, False)
+            else:
+                # Structure without a template, the member can't be checked
+                return TagHandle(tag, True, None, tuple(members + [member]))
+            members.append(member)
+
+        type_name = data_type.get('name') if isinstance(data_type, dict) else data_type
+        return TagHandle(tag, True, type_name, tuple(members))
@@ -0,0 +1,338 @@
+import heapq
+import json
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+
+from pycomm3 import Tag
+
+import SimClock
+
+RECORDING_MAGIC = b'PCIREC\x01\x01'  # File header, the last byte is the format version
+CHUNK_HEADER = struct.Struct('<4sIII')  # b'CHNK', compressed payload size, record count, CRC32 of the payload
+# Payload of a chunk: UTF-8 JSON {"names": [string table], "records": [[time, PLC index, op, [tag indexes], values]]},
+# plain typed data only so a recording from another machine can be replayed safely
+CHUNK_MARK = b'CHNK'
+
+# Operation of a record
+OP_READ = 0
+OP_WRITE = 1
+
+
+class TagRecorder:
+
+    def __init__(self, filename: str, chunk_records=500, chunk_time=1.0, compression=6):
+        """
+        Append-only binary log of the tag traffic of the PLC connections. Records are buffered and written in chunks,
+        each chunk compressed on its own with zlib by a writer thread so the scans only pay for the buffering. A
+        recording cut short by a crash is readable up to its last complete chunk.
+
+        Every record holds the simulation time, the PLC address and the tags read (with their value, type and error)
+        or written (with their value). Tag names are stored once per chunk. Values are stored as plain JSON data,
+        structures as dicts and arrays as lists.
+
+        :param filename: Recording file, appended to if it exists
+        :param chunk_records: Records buffered before a chunk is written
+        :param chunk_time: Longest time a record stays buffered, in sec
+        :param compression: zlib compression level, 1 (fastest) to 9 (smallest)
+        """
+
+        self.filename = filename
+        self.chunk_records = chunk_records
+        self.chunk_time = chunk_time
+        self.compression = compression
+        self.record_count = 0
+        self.chunk_count = 0
+        self.bytes_written = 0
+        self._records = []
+        self._chunk_start = time.monotonic()
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+
+        new_file = not os.path.exists(filename) or os.path.getsize(filename) == 0
+        if not new_file:
+            with open(filename, 'rb') as file:
+                if file.read(len(RECORDING_MAGIC)) != RECORDING_MAGIC:
+                    raise ValueError(f'{filename} is not a tag recording of this format version, can\'t append to it')
+        self._file = open(filename, 'ab')
+        if new_file:
+            self._file.write(RECORDING_MAGIC)
+            self._file.flush()
+        self._writer = threading.Thread(target=self._write_loop, name='TagRecorder', daemon=True)
+        self._writer.start()
+
+    def record_read(self, plc_address: str, tags: tuple, results):
+        """
+        :param plc_address: PLC IP/Slot number
+        :param tags: Tag names read
+        :param results: Pycomm3 Tag, or list of them, returned by the read
+        :return:
+        """
+        if not isinstance(results, list):
+            results = [results]
+        self._add(plc_address, OP_READ, tags, tuple((result.value, result.type, result.error) for result in results))
+
+    def record_write(self, plc_address: str, write_data: tuple):
+        """
+        :param plc_address: PLC IP/Slot number
+        :param write_data: (tag name, value) pairs written
+        :return:
+        """
+        self._add(plc_address, OP_WRITE, tuple(tag for tag, _ in write_data), tuple(value for _, value in write_data))
+
+    def attach(self, plc, plc_address: str):
+        """
+        Records every read and write done through a connection, the bound read() and write() methods of the
+        connection are wrapped so the driver class itself is left untouched
+
+        :param plc: LogixDriver PLC Object, or a stand-in with the same interface
+        :param plc_address: PLC IP/Slot number recorded with the traffic
+        :return:
+        """
+        read = plc.read
+        write = plc.write
+
+        def recorded_read(*tags):
+            results = read(*tags)
+            self.record_read(plc_address, tags, results)
+            return results
+
+        def recorded_write(*write_data):
+            results = write(*write_data)
+            self.record_write(plc_address, write_data)
+            return results
+
+        plc.read = recorded_read
+        plc.write = recorded_write
+
+    def flush(self):
+        """
+        Hands the buffered records to the writer thread
+
+        :return:
+        """
+        with self._lock:
+            records = self._take()
+        if records:
+            self._queue.put(records)
+
+    def close(self):
+        """
+        Writes the buffered records and closes the file, the connections attached must be closed first
+
+        :return:
+        """
+        self.flush()
+        self._queue.put(None)
+        self._writer.join()
+        self._file.close()
+
+    def summary(self) -> dict:
+        return {'filename': self.filename,
+                'records': self.record_count,
+                'chunks': self.chunk_count,
+                'bytes': self.bytes_written}
+
+    def _add(self, plc_address: str, op: int, tags: tuple, values: tuple):
+        records = None
+        with self._lock:
+            # Timestamped under the lock, the records of a file are always in time order
+            self._records.append((SimClock.now(), plc_address, op, tags, values))
+            self.record_count += 1
+            if len(self._records) >= self.chunk_records or \
+                    time.monotonic() - self._chunk_start >= self.chunk_time:
+                records = self._take()
+        if records:
+            self._queue.put(records)
+
+    def _take(self) -> list:
+        records = self._records
+        self._records = []
+        self._chunk_start = time.monotonic()
+        return records
+
+    def _write_loop(self):
+        while True:
+            records = self._queue.get()
+            if records is None:
+                break
+            chunk = encode_chunk(records, self.compression)
+            self._file.write(chunk)
+            self._file.flush()
+            self.chunk_count += 1
+            self.bytes_written += len(chunk)
+
+
+def encode_chunk(records: list, compression=6) -> bytes:
+    """
+    :param records: List of (time, PLC address, operation, tag names, values) records
+    :param compression: zlib compression level
+    :return: Chunk header and compressed payload
+    """
+    names = {}  # PLC addresses and tag names -> index in the string table of the chunk
+    packed = []
+    for record_time, plc_address, op, tags, values in records:
+        packed.append((record_time, names.setdefault(plc_address, len(names)), op,
+                       [names.setdefault(tag, len(names)) for tag in tags], values))
+    data = json.dumps({'names': list(names), 'records': packed}, separators=(',', ':'), default=_plain_value)
+    payload = zlib.compress(data.encode(), compression)
+    return CHUNK_HEADER.pack(CHUNK_MARK, len(payload), len(records), zlib.crc32(payload)) + payload
+
+
+def _plain_value(value):
+    # Values without a JSON type: NumPy scalars written by the kernels and raw bytes of unknown data types
+    if isinstance(value, (bytes, bytearray)):
+        return list(value)
+    if hasattr(value, 'item'):
+        return value.item()
+    raise TypeError(f'Value {value!r} of type {type(value).__name__} can\'t be recorded')
+
+
+def read_recording(filename: str):
+    """
+    Reads the records of a recording in the order they were recorded, stops at the first incomplete or corrupt chunk
+
+    :param filename: Recording file
+    :return: Generator of (time, PLC address, operation, tag names, values) records
+    """
+    with open(filename, 'rb') as file:
+        if file.read(len(RECORDING_MAGIC)) != RECORDING_MAGIC:
+            raise ValueError(f'{filename} is not a tag recording')
+        while True:
+            header = file.read(CHUNK_HEADER.size)
+            if len(header) < CHUNK_HEADER.size:
+                return
+            mark, size, count, crc = CHUNK_HEADER.unpack(header)
+            payload = file.read(size)
+            if mark != CHUNK_MARK or len(payload) < size or zlib.crc32(payload) != crc:
+                print(f'Recording {filename} truncated, {count} records of the last chunk dropped')
+                return
+            data = json.loads(zlib.decompress(payload))
+            names = data['names']
+            for record_time, plc_idx, op, tag_ids, values in data['records']:
+                if op == OP_READ:
+                    values = tuple(tuple(result) for result in values)
+                yield record_time, names[plc_idx], op, tuple(names[idx] for idx in tag_ids), tuple(values)
+
+
+class ReplayDriver:
+
+    def __init__(self, plc_address: str):
+        """
+        Stand-in for a LogixDriver connection serving the tag values of a recording, exposes the read() and write()
+        calls of the LogixDriver interface the devices use. Reads get the latest recorded value of every tag, writes
+        only keep the last value written.
+
+        :param plc_address: PLC IP/Slot number of the recording replayed
+        """
+
+        self.plc_address = plc_address
+        self.values = {}  # Tag name -> Pycomm3 Tag, latest recorded read
+        self.recorded_writes = {}  # Tag name -> latest recorded write value
+        self.written = {}  # Tag name -> value written by the replay
+        self.read_count = 0
+        self.write_count = 0
+
+    def load(self, op: int, tags: tuple, values: tuple):
+        """
+        Applies a recorded read or write
+
+        :return:
+        """
+        if op == OP_READ:
+            for tag, (value, datatype, error) in zip(tags, values):
+                self.values[tag] = Tag(tag, value, datatype, error)
+        else:
+            self.recorded_writes.update(zip(tags, values))
+
+    def read(self, *tags):
+        self.read_count += len(tags)
+        results = [self.values.get(tag) or Tag(tag, None, None, 'Tag not recorded') for tag in tags]
+        return results[0] if len(tags) == 1 else results
+
+    def write(self, *write_data):
+        self.write_count += len(write_data)
+        self.written.update(write_data)
+        results = [Tag(tag, value, None, None) for tag, value in write_data]
+        return results[0] if len(write_data) == 1 else results
+
+    def divergence(self) -> list:
+        """
+        :return: Tags whose last value written by the replay differs from the last recorded write
+        """
+        return [tag for tag, value in self.recorded_writes.items()
+                if tag in self.written and self.written[tag] != value]
+
+
+class ReplayEngine:
+
+    def __init__(self, filenames: list):
+        """
+        Feeds recordings back into the simulator at full speed, no PLC needed. The simulation clock is set to a
+        stepped clock following the recorded times, and every recorded read of a PLC triggers one scan of its engine
+        on a Replay Driver holding the recorded values, so the device logic sees the same inputs at the same times as
+        on the recorded run.
+
+        :param filenames: Recordings to replay, several ones (the recordings of the shard processes) are merged by
+        time
+        """
+
+        self.filenames = filenames
+        self.drivers = {}  # PLC address -> Replay Driver
+        self.clock = None
+        self.scan_count = 0
+        self.record_count = 0
+        self.sim_time = 0.0  # Recorded time span replayed, in sec
+        self.wall_time = 0.0  # Time taken by the replay, in sec
+
+    def records(self):
+        """
+        :return: Generator of the records of all the recordings, in time order
+        """
+        return heapq.merge(*(read_recording(filename) for filename in self.filenames), key=lambda record: record[0])
+
+    def replay(self, engines: dict) -> dict:
+        """
+        Replays the recordings through the engines of the PLCs recorded, one scan per recorded read
+
+        :param engines: PLC address -> Scan Engine or Multi Rate Engine, or any object with a scan(plc) method.
+        Recorded PLCs without an engine are skipped.
+        :return: Summary of the replay
+        """
+        first_time = None
+        start_time = SimClock.now()  # Devices created before the replay started their timers around now
+        self.clock = SimClock.SteppedClock(1.0, start_time)
+        SimClock.set_clock(self.clock)
+        start = time.perf_counter()
+        for record_time, plc_address, op, tags, values in self.records():
+            if plc_address not in engines:
+                continue
+            if first_time is None:
+                first_time = record_time
+            driver = self.drivers.get(plc_address)
+            if driver is None:
+                driver = self.drivers[plc_address] = ReplayDriver(plc_address)
+
+            # Recorded times are shifted onto the start of the replay
+            self.clock.advance_to(start_time + record_time - first_time)
+            self.sim_time = record_time - first_time
+            self.record_count += 1
+            driver.load(op, tags, values)
+            if op == OP_READ:
+                engines[plc_address].scan(driver)
+                self.scan_count += 1
+
+        self.wall_time = time.perf_counter() - start
+        return self.summary()
+
+    def summary(self) -> dict:
+        return {'records': self.record_count,
+                'scans': self.scan_count,
+                'sim_time': self.sim_time,
+                'wall_time': self.wall_time,
+                'speed': self.sim_time / self.wall_time if self.wall_time else 0.0,
+                'divergent_tags': {plc_address: len(driver.divergence())
+                                   for plc_address, driver in self.drivers.items()}}
@@ -0,0 +1,198 @@
+import numpy as np
+
+import FieldObjects
+import SimClock
+
+# Raw PLC counts range of a Control Valve feedback, 0..100% open
+VALVE_RAW_MIN = 6240
+VALVE_RAW_SPAN = 24968
+LAMINAR_PRESSURE = 0.01  # Pressure difference below which the flow is laminar, linear in dP, in bar
+
+
+class FlowLink:
+
+    def __init__(self, source, target, valve=None, coefficient=1.0, supply_pressure=0.0):
+        """
+        Pipe between two tanks, or between a tank and the outside of the model. The flow follows the pressure
+        difference between both ends: coefficient * opening * sqrt(dP), in m3/s with dP in bar, linear in dP below
+        LAMINAR_PRESSURE.
+
+        :param source: Tank upstream, None for a supply at supply_pressure
+        :param target: Tank downstream, None for a drain at atmospheric pressure
+        :param valve: Valve or Valve_Analog throttling the flow, None if the pipe is always open
+        :param coefficient: Flow fully open with a 1 bar difference, in m3/s
+        :param supply_pressure: Pressure of the supply when there's no source tank, in bar
+        """
+        if source is None and target is None:
+            raise ValueError('A Flow Link needs a tank on at least one end')
+
+        self.source = source
+        self.target = target
+        self.valve = valve
+        self.coefficient = coefficient
+        self.supply_pressure = supply_pressure
+        for tank in (source, target):
+            if tank is not None:
+                tank.links.append(self)
+
+    def opening(self) -> float:
+        """
+        :return: Opening of the valve, 0..1
+        """
+        valve = self.valve
+        if valve is None:
+            return 1.0
+        if isinstance(valve, FieldObjects.Valve_Analog):
+            return min(max((valve.valve_fbk_value - VALVE_RAW_MIN) / VALVE_RAW_SPAN, 0.0), 1.0)
+        return 1.0 if valve.opn_ind else 0.0
+
+
+class TankNetwork:
+
+    def __init__(self, tanks: list):
+        """
+        Array backed process model of a group of tanks and the Flow Links connected to them, the levels and pressures
+        of all the tanks are integrated in a single batched step per scan.
+
+        Tanks at the other end of a link that aren't in the group are boundaries, their pressure of the last scan is
+        used and they are integrated by their own Tank Network.
+
+        Every step conserves the volume of the group: a link moves no more than what equalises the pressures at both
+        ends, the links of a tank are scaled down together so its pressure never overshoots those of its neighbours,
+        and no tank gives away more than it holds. Only an overflow above 100% is lost.
+
+        :param tanks: List of Tank objects, compile() must be called again if they or their links change
+        """
+
+        self.tanks = tanks
+        self.links = []
+        self.compile()
+
+    def compile(self):
+        """
+        Builds the link arrays and the initial state from the Tank objects
+
+        :return:
+        """
+        tanks = self.tanks
+        index = {id(tank): idx for idx, tank in enumerate(tanks)}
+        self.links = list({id(link): link for tank in tanks for link in tank.links}.values())
+
+        # Ends of every link, -1 for the ends outside the group. The pressures of those are refreshed on every step.
+        self._source = np.array([index.get(id(link.source), -1) for link in self.links], dtype=np.intp)
+        self._target = np.array([index.get(id(link.target), -1) for link in self.links], dtype=np.intp)
+        self._boundary_sources = [(row, link.source) for row, link in enumerate(self.links)
+                                  if link.source is not None and self._source[row] < 0]
+        self._boundary_targets = [(row, link.target) for row, link in enumerate(self.links)
+                                  if link.target is not None and self._target[row] < 0]
+        self._source_pressure = np.array([link.supply_pressure if link.source is None else 0.0
+                                          for link in self.links], dtype=np.float64)
+        self._target_pressure = np.zeros(len(self.links), dtype=np.float64)
+        self._coefficient = np.array([link.coefficient for link in self.links], dtype=np.float64)
+
+        self.volume = np.array([tank.volume for tank in tanks], dtype=np.float64)
+        self.full_pressure = np.array([tank.full_pressure for tank in tanks], dtype=np.float64)
+        # Pressure change per m3 moved in or out of every tank, in bar/m3. Supplies and drains don't change pressure,
+        # boundary tanks take the one of their own network.
+        self._stiffness = self.full_pressure / self.volume
+        self._boundary_source_stiffness = np.array([self._end_stiffness(link.source) for link in self.links],
+                                                   dtype=np.float64)
+        self._boundary_target_stiffness = np.array([self._end_stiffness(link.target) for link in self.links],
+                                                   dtype=np.float64)
+        self.level = np.array([tank.level for tank in tanks], dtype=np.float64)
+        self.pressure = self.full_pressure * self.level / 100
+        self.time_last = SimClock.now()
+
+        # Feedback written every step, tags not configured are left out
+        self._level_rows = [idx for idx, tank in enumerate(tanks) if tank.level_tag not in FieldObjects.UNSET_TAGS]
+        self._level_tags = [tanks[idx].level_tag for idx in self._level_rows]
+        self._pressure_rows = [idx for idx, tank in enumerate(tanks)
+                               if tank.pressure_tag not in FieldObjects.UNSET_TAGS]
+        self._pressure_tags = [tanks[idx].pressure_tag for idx in self._pressure_rows]
+        self._raw_min = np.array([tank.minRng for tank in tanks], dtype=np.float64)
+        self._raw_span = np.array([tank.maxRng - tank.minRng for tank in tanks], dtype=np.float64)
+        self._pressure_range = np.array([tank.pressure_range for tank in tanks], dtype=np.float64)
+
+    def step(self, now=None) -> list:
+        """
+        Integrates the levels and pressures of all the tanks once
+
+        :param now: Time of the step, defaults to the current time of the simulation clock
+        :return: List of (tag name, value) pairs to be written back to the PLC
+        """
+        if not self.tanks:
+            return []
+
+        now = SimClock.now() if now is None else now
+        time_diff = now - self.time_last
+        self.time_last = now
+        n = len(self.tanks)
+
+        # Pressure at both ends of every link
+        own_source = self._source >= 0
+        own_target = self._target >= 0
+        for row, tank in self._boundary_sources:
+            self._source_pressure[row] = tank.pressure
+        for row, tank in self._boundary_targets:
+            self._target_pressure[row] = tank.pressure
+        source_pressure = np.where(own_source, self.pressure[self._source], self._source_pressure)
+        target_pressure = np.where(own_target, self.pressure[self._target], self._target_pressure)
+
+        # Volume moved by every link over the time since the last step, negative volumes go backwards. The flow is
+        # linear below LAMINAR_PRESSURE so it settles instead of chattering around equal pressures
+        opening = np.fromiter((link.opening() for link in self.links), dtype=np.float64, count=len(self.links))
+        difference = source_pressure - target_pressure
+        magnitude = np.abs(difference)
+        head = np.where(magnitude < LAMINAR_PRESSURE, magnitude / np.sqrt(LAMINAR_PRESSURE), np.sqrt(magnitude))
+        transfer = self._coefficient * opening * head * time_diff
+
+        # No more than the volume that equalises both ends
+        stiffness = (np.where(own_source, self._stiffness[self._source], self._boundary_source_stiffness) +
+                     np.where(own_target, self._stiffness[self._target], self._boundary_target_stiffness))
+        equalising = np.divide(magnitude, stiffness, out=np.full(len(self.links), np.inf), where=stiffness > 0)
+        transfer = np.minimum(transfer, equalising)
+
+        # Share of its equalising volume every link moves, the links of a tank share at most one so its new pressure
+        # is a weighted average of its own and its neighbours' and never overshoots
+        share = np.divide(transfer, equalising, out=np.zeros(len(self.links)), where=equalising > 0)
+        load = (np.bincount(self._source[own_source], weights=share[own_source], minlength=n) +
+                np.bincount(self._target[own_target], weights=share[own_target], minlength=n))
+        scale = 1.0 / np.maximum(load, 1.0)
+        transfer *= np.minimum(np.where(own_source, scale[self._source], 1.0),
+                               np.where(own_target, scale[self._target], 1.0))
+
+        # No tank gives away more than it holds
+        held = self.level * self.volume / 100
+        upstream = np.where(difference >= 0, self._source, self._target)
+        own_upstream = upstream >= 0
+        given = np.bincount(upstream[own_upstream], weights=transfer[own_upstream], minlength=n)
+        available = np.minimum(np.divide(held, given, out=np.ones(n), where=given > 0), 1.0)
+        transfer *= np.where(own_upstream, available[upstream], 1.0)
+
+        # Net volume change of every tank
+        transfer *= np.sign(difference)
+        inflow = np.bincount(self._target[own_target], weights=transfer[own_target], minlength=n)
+        outflow = np.bincount(self._source[own_source], weights=transfer[own_source], minlength=n)
+        self.level = np.clip((held + inflow - outflow) / self.volume * 100, 0.0, 100.0)
+        self.pressure = self.full_pressure * self.level / 100
+
+        level_counts = (self._raw_span * self.level / 100 + self._raw_min).astype(np.int64)
+        pressure_counts = (self._raw_span * np.clip(self.pressure / self._pressure_range, 0.0, 1.0) +
+                           self._raw_min).astype(np.int64)
+        return (list(zip(self._level_tags, level_counts[self._level_rows].tolist())) +
+                list(zip(self._pressure_tags, pressure_counts[self._pressure_rows].tolist())))
+
+    @staticmethod
+    def _end_stiffness(tank) -> float:
+        # Supplies and drains hold their pressure whatever flows through them
+        return tank.full_pressure / tank.volume if tank is not None else 0.0
+
+    def sync_tanks(self):
+        """
+        Copies the state back to the Tank objects so their public attributes stay readable
+
+        :return:
+        """
+        for tank, level, pressure in zip(self.tanks, self.level.tolist(), self.pressure.tolist()):
+            tank.level = level
+            tank.pressure = pressure
@@ -0,0 +1,131 @@
+"""
+Device store benchmark, measures the memory footprint per device and the update speed of the field objects with
+a large number of simulated devices, no PLC needed.
+
+    python benchmarks/device_store.py --devices 10000
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pycomm3 import Tag
+
+import FieldObjects
+from AnalogKernel import AnalogKernel
+
+
+def build_valves(count: int) -> list:
+    valves = []
+    for idx in range(count):
+        name = f'A9_{idx}_1VB01'
+        valves.append(FieldObjects.Valve(name, 'O' + name[1:] + '_OP', 'I' + name[1:] + '_LS1', 'I' + name[1:] + '_LS2',
+                                         '127.0.0.1/0', idx % 2 == 0))
+    return valves
+
+
+def build_control_valves(count: int) -> list:
+    valves = []
+    for idx in range(count):
+        name = f'A9_{idx}_1VC02'
+        valves.append(FieldObjects.Valve_Analog(name, 'O' + name[1:] + '_SET', name + '.Channel',
+                                                'I' + name[1:] + '_LS1', 'I' + name[1:] + '_LS2', '127.0.0.1/0'))
+    return valves
+
+
+def build_analog_inputs(count: int) -> list:
+    # Mix of the configurations found in the relation list: fixed value, external reference and integrating
+    inputs = []
+    for idx in range(count):
+        name = f'A9_{idx}_1PIT1'
+        if idx % 3 == 0:
+            inputs.append(FieldObjects.AnalogInput(name, name + '.Channel', '127.0.0.1/0', '0', '0', '0', '0', '0',
+                                                   '0', '0', '0', fixed_value=9000))
+        elif idx % 3 == 1:
+            inputs.append(FieldObjects.AnalogInput(name, name + '.Channel', '127.0.0.1/0', f'A9_{idx}_1VC07', '0',
+                                                   '0', '0', '0', '0', '0', '0'))
+        else:
+            inputs.append(FieldObjects.AnalogInput(name, name + '.Channel', '127.0.0.1/0', '0', '0',
+                                                   f'I9_{idx}_1VB01_LS1', f'I9_{idx}_1VS13_LS1', '0',
+                                                   f'I9_{idx}_1VBCM06_LS1', '0', '0', 500, 25, 1, 0, 8000))
+    return inputs
+
+
+def build_tag_data(devices: list) -> dict:
+    tag_data = {}
+    for device in devices:
+        tags = device.scan_tags() + device.scaling_tags() if isinstance(device, FieldObjects.Valve_Analog) \
+            else device.scan_tags()
+        for tag in tags:
+            if tag == '0':
+                tag_data[tag] = Tag(tag, None, None, 'Tag doesn\'t exist')
+            elif tag.endswith('_SET'):
+                tag_data[tag] = Tag(tag, 42.0, 'REAL')
+            elif tag.endswith('.MIN') or tag.endswith('.MAX'):
+                tag_data[tag] = Tag(tag, 0.0 if tag.endswith('.MIN') else 100.0, 'REAL')
+            elif tag.startswith('A'):
+                tag_data[tag] = Tag(tag, {'Channel': 16000, 'MAX': 100.0, 'MIN': 0.0}, 'UDT_zzAnaIN')
+            else:
+                tag_data[tag] = Tag(tag, True, 'BOOL')
+    return tag_data
+
+
+def measure_footprint(builder, count: int) -> float:
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    devices = builder(count)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    del devices
+    return size / count
+
+
+def measure_update(devices: list, tag_data: dict, cycles: int) -> float:
+    start = time.perf_counter()
+    for _ in range(cycles):
+        for device in devices:
+            device.load_scan_data(tag_data)
+            device.process()
+            device.feedback_data()
+    return (time.perf_counter() - start) / cycles
+
+
+def measure_kernel(inputs: list, tag_data: dict, cycles: int) -> float:
+    kernel = AnalogKernel(inputs)
+    start = time.perf_counter()
+    for _ in range(cycles):
+        kernel.step(tag_data)
+    return (time.perf_counter() - start) / cycles
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Field objects memory and update speed benchmark')
+    parser.add_argument('--devices', type=int, default=10000, help='Number of devices of each class')
+    parser.add_argument('--cycles', type=int, default=10, help='Number of update cycles to average')
+    args = parser.parse_args()
+
+    print(f'===== {args.devices} devices per class =====')
+    print('Memory per device (bytes, including tag name strings)')
+    for label, builder in (('Valve', build_valves), ('Valve_Analog', build_control_valves),
+                           ('AnalogInput', build_analog_inputs)):
+        print(f'  {label:<14} {measure_footprint(builder, args.devices):8.0f}')
+
+    print('Update time per cycle (ms)')
+    valves = build_valves(args.devices)
+    control_valves = build_control_valves(args.devices)
+    inputs = build_analog_inputs(args.devices)
+    tag_data = build_tag_data(valves + control_valves + inputs)
+    for valve in control_valves:
+        valve.load_scaling_data(tag_data)
+    print(f'  {"Valve":<14} {measure_update(valves, tag_data, args.cycles) * 1000:8.1f}')
+    print(f'  {"Valve_Analog":<14} {measure_update(control_valves, tag_data, args.cycles) * 1000:8.1f}')
+    print(f'  {"AnalogInput":<14} {measure_update(inputs, tag_data, args.cycles) * 1000:8.1f}')
+    print(f'  {"AnalogKernel":<14} {measure_kernel(build_analog_inputs(args.devices), tag_data, args.cycles) * 1000:8.1f}')
+
+
+if __name__ == '__main__':
+    main()
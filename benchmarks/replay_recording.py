@@ -0,0 +1,86 @@
+"""
+Replays a tag traffic recording through the device logic at full speed, no PLC or emulator needed, to profile and
+benchmark the scan processing against captured input. The devices are rebuilt the same way as when they were recorded.
+
+    python benchmarks/scan_emulated.py --controllers 3 --devices 1000 --record traffic.rec
+    python benchmarks/replay_recording.py traffic.rec --controllers 3 --devices 1000
+    python benchmarks/replay_recording.py tag_traffic.rec --plc 10.20.20.201/3=CLX_PCIBF5-Tags.CSV --profile 25
+"""
+import argparse
+import cProfile
+import os
+import pstats
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import ScanEngine
+from DeviceRegistry import DeviceRegistry
+from TagRecorder import ReplayEngine
+from scan_emulated import TAG_FILES, export_controller, synthetic_controller
+
+
+def build_engines(args) -> dict:
+    """
+    :return: PLC address -> Scan Engine of the devices recorded
+    """
+    emulator_args = {'latency': 0.0, 'jitter': 0.0, 'connection_size': 4000}
+    controllers = []
+    if args.plc:
+        for plc in args.plc:
+            plc_address, tag_file = plc.split('=', 1)
+            controllers.append(export_controller(plc_address, os.path.join(ROOT, tag_file), emulator_args))
+    else:
+        for idx in range(args.controllers):
+            plc_address = f'127.0.0.1/{idx}'
+            if args.source == 'exports':
+                controllers.append(export_controller(plc_address, os.path.join(ROOT, TAG_FILES[idx % 3]),
+                                                     emulator_args))
+            else:
+                controllers.append(synthetic_controller(plc_address, args.devices, emulator_args, args.tanks))
+
+    registry = DeviceRegistry()
+    for _, devices in controllers:
+        for device in devices:
+            registry.add(device)
+    registry.build_tag_lists()
+    return {plc_address: ScanEngine.ScanEngine(registry.controller(plc_address), not args.per_object_analog)
+            for plc_address in registry.controllers()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replays a tag traffic recording through the device logic')
+    parser.add_argument('recordings', nargs='+', help='Recording files, the files of the shard processes are merged')
+    parser.add_argument('--plc', nargs='+',
+                        help='ADDRESS=TAG_EXPORT of every PLC of a simulator recording, the devices are built without '
+                             'the relation list so the inputs configured there show up as divergent')
+    parser.add_argument('--controllers', type=int, default=1, help='Controllers of a scan_emulated.py recording')
+    parser.add_argument('--devices', type=int, default=1000, help='Devices per controller of a synthetic recording')
+    parser.add_argument('--tanks', type=int, default=0, help='Tanks per controller of a synthetic recording')
+    parser.add_argument('--source', choices=('synthetic', 'exports'), default='synthetic',
+                        help='Devices of a scan_emulated.py recording')
+    parser.add_argument('--per-object-analog', action='store_true', help='Disables the vectorized Analog Kernel')
+    parser.add_argument('--profile', type=int, metavar='N', help='Profiles the replay and prints the top N functions')
+    args = parser.parse_args()
+
+    engines = build_engines(args)
+    replay = ReplayEngine(args.recordings)
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler is not None:
+        profiler.enable()
+    summary = replay.replay(engines)
+    if profiler is not None:
+        profiler.disable()
+
+    print(f'{summary["records"]} records - {summary["scans"]} scans - {summary["sim_time"]:.1f}sec recorded '
+          f'replayed in {summary["wall_time"]:.2f}sec ({summary["speed"]:.0f}x), '
+          f'{summary["scans"] / summary["wall_time"] if summary["wall_time"] else 0.0:.0f} scans/sec')
+    for plc_address, count in summary['divergent_tags'].items():
+        print(f'    PLC {plc_address} - {count} tags written differently than recorded')
+    if profiler is not None:
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(args.profile)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+"""
+End-to-end scan benchmark, runs the scan workers against emulated controllers and measures the scan time, requests and
+bytes per scan and the CPU used for 1, 3 and N controllers, no PLC needed.
+
+    python benchmarks/scan_emulated.py --controllers 1 3 10 --devices 100 1000 10000
+    python benchmarks/scan_emulated.py --source exports --controllers 1 3 --json results.json
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import AsyncRuntime
+import FieldObjects
+import ScanEngine
+import ScanStats
+import SimClock
+import TagRecorder
+import TagDatabase
+import TankNetwork
+from ConnectionPool import ConnectionPool
+from ControllerEmulator import ControllerEmulator, EmulatedController
+from DeviceRegistry import DeviceRegistry
+
+TAG_FILES = ['CLX_PCIBF5-Tags.CSV', 'CLX_PCIBF6-Tags.CSV', 'CLX_DistBF5-Tags.CSV']
+
+
+def synthetic_controller(plc_address: str, count: int, emulator_args: dict, tanks=0) -> tuple:
+    """
+    Builds a controller with count devices: 40% switching valves, 20% control valves and 40% analog inputs using the
+    configurations found in the relation list (fixed value, external reference and integrating), plus a chain of tanks
+    fed from a supply and drained through the control valves
+
+    :return: (Emulated Controller, list of devices)
+    """
+    tag_types = {}
+    devices = []
+    for idx in range(count):
+        kind = idx % 5
+        if kind < 2:
+            name = f'A9_{idx}_1VB01'
+            tag_types.update({name: 'UDT_zzVNC', 'O' + name[1:] + '_OP': 'BOOL', 'O' + name[1:] + '_CL': 'BOOL',
+                              'I' + name[1:] + '_LS1': 'BOOL', 'I' + name[1:] + '_LS2': 'BOOL'})
+            devices.append(FieldObjects.Valve(name, 'O' + name[1:] + '_OP', 'I' + name[1:] + '_LS1',
+                                              'I' + name[1:] + '_LS2', plc_address))
+        elif kind == 2:
+            name = f'A9_{idx}_1VC02'
+            tag_types.update({name: 'UDT_zzAnaIN', 'O' + name[1:] + '_SET': 'REAL',
+                              'I' + name[1:] + '_LS1': 'BOOL', 'I' + name[1:] + '_LS2': 'BOOL'})
+            devices.append(FieldObjects.Valve_Analog(name, 'O' + name[1:] + '_SET', name + '.Channel',
+                                                     'I' + name[1:] + '_LS1', 'I' + name[1:] + '_LS2', plc_address))
+        else:
+            name = f'A9_{idx}_1PIT1'
+            tag_types[name] = 'UDT_zzAnaIN'
+            if idx % 3 == 0:
+                devices.append(FieldObjects.AnalogInput(name, name + '.Channel', plc_address, '0', '0', '0', '0', '0',
+                                                        '0', '0', '0', fixed_value=9000))
+            elif idx % 3 == 1:
+                reference = f'A9_{idx}_1VC07'
+                tag_types[reference] = 'UDT_zzAnaIN'
+                devices.append(FieldObjects.AnalogInput(name, name + '.Channel', plc_address, reference, '0', '0',
+                                                        '0', '0', '0', '0', '0'))
+            else:
+                inc_tag, dec_tag = f'I9_{idx}_1VB01_LS1', f'I9_{idx}_1VBCM06_LS1'
+                tag_types.update({inc_tag: 'BOOL', dec_tag: 'BOOL'})
+                devices.append(FieldObjects.AnalogInput(name, name + '.Channel', plc_address, '0', '0', inc_tag, '0',
+                                                        '0', dec_tag, '0', '0', 500, 25, 1, 0, 8000))
+
+    control_valves = [device for device in devices if isinstance(device, FieldObjects.Valve_Analog)]
+    previous = None
+    for idx in range(tanks):
+        name = f'A9_{idx}_1LIT1'
+        tag_types.update({name: 'UDT_zzAnaIN', name[:-4] + 'PIT1': 'UDT_zzAnaIN'})
+        tank = FieldObjects.Tank(name, plc_address, name + '.Channel', name[:-4] + 'PIT1.Channel', level=50.0)
+        valve = control_valves[idx % len(control_valves)] if control_valves else None
+        TankNetwork.FlowLink(previous, tank, valve, 0.05, supply_pressure=2.0)
+        devices.append(tank)
+        previous = tank
+    if previous is not None:
+        TankNetwork.FlowLink(previous, None, None, 0.05)
+    return EmulatedController(plc_address, tag_types, **emulator_args), devices
+
+
+def export_controller(plc_address: str, tag_file: str, emulator_args: dict) -> tuple:
+    """
+    Builds a controller and its devices from an RSLogix tag export, the same way the simulator does
+
+    :return: (Emulated Controller, list of devices)
+    """
+    controller = EmulatedController.from_tag_export(plc_address, tag_file, **emulator_args)
+    devices = []
+    for name, datatype, _ in TagDatabase.parse_tag_export(tag_file):
+        if datatype in ('UDT_zzVNC', 'UDT_zzVNO'):
+            devices.append(FieldObjects.Valve(name, 'O' + name[1:] + '_OP', 'I' + name[1:] + '_LS1',
+                                              'I' + name[1:] + '_LS2', plc_address, datatype != 'UDT_zzVNC'))
+        elif 'O' + name[1:] + '_SET' in controller.tag_types:
+            devices.append(FieldObjects.Valve_Analog(name, 'O' + name[1:] + '_SET', name + '.Channel',
+                                                     'I' + name[1:] + '_LS1', 'I' + name[1:] + '_LS2', plc_address))
+        else:
+            devices.append(FieldObjects.AnalogInput(name, name + '.Channel', plc_address))
+    return controller, devices
+
+
+def run_scenario(controllers: int, devices: int, args) -> dict:
+    if args.clock == 'scaled':
+        SimClock.set_clock(SimClock.ScaledClock(args.clock_scale))
+    elif args.clock == 'stepped':
+        SimClock.set_clock(SimClock.SteppedClock(args.cycle_time))
+    else:
+        SimClock.set_clock(SimClock.RealClock())
+    emulator = ControllerEmulator()
+    registry = DeviceRegistry()
+    emulator_args = {'latency': args.latency, 'jitter': args.jitter, 'connection_size': args.connection_size}
+
+    for idx in range(controllers):
+        plc_address = f'127.0.0.1/{idx}'
+        if args.source == 'exports':
+            controller, plc_devices = export_controller(plc_address, os.path.join(ROOT, TAG_FILES[idx % 3]),
+                                                        emulator_args)
+        else:
+            controller, plc_devices = synthetic_controller(plc_address, devices, emulator_args, args.tanks)
+        emulator.add_controller(controller)
+        for device in plc_devices:
+            registry.add(device)
+    registry.build_tag_lists()
+
+    pool = ConnectionPool(recorder=TagRecorder.TagRecorder(args.record) if args.record else None)
+    scheduler = AsyncRuntime.AsyncScanScheduler(pool=pool) if args.runtime == 'async' \
+        else ScanEngine.ScanScheduler(pool)
+    stats = []
+    for plc_address in registry.controllers():
+        stats.append(ScanStats.ScanStats(plc_address, args.cycle_time, window=100000))
+        engine = ScanEngine.ScanEngine(registry.controller(plc_address), not args.per_object_analog,
+                                       ScanEngine.WriteCache(), stats[-1])
+        scheduler.add_controller(plc_address, engine, emulator.controllers[plc_address].tag_definitions(),
+                                 args.cycle_time, 1, emulator.driver)
+
+    cpu_start, wall_start, sim_start = time.process_time(), time.perf_counter(), SimClock.now()
+    scheduler.start()
+    time.sleep(args.duration)
+    scheduler.stop()
+    pool.close()
+    cpu, wall = time.process_time() - cpu_start, time.perf_counter() - wall_start
+    simulated = SimClock.now() - sim_start
+
+    scans = sum(stat.scans for stat in stats)
+    scan_times = sorted(sample for stat in stats for sample in stat.phases['scan'].samples)
+    return {'controllers': controllers,
+            'devices_per_controller': len(registry) // controllers,
+            'scans': scans,
+            'scan_mean_ms': sum(scan_times) / len(scan_times) * 1000 if scan_times else 0.0,
+            'scan_p95_ms': scan_times[int(len(scan_times) * 0.95)] * 1000 if scan_times else 0.0,
+            'requests_per_scan': sum(stat.requests for stat in stats) / scans if scans else 0.0,
+            'kbytes_per_scan': sum(stat.bytes_sent + stat.bytes_received for stat in stats) / scans / 1024
+            if scans else 0.0,
+            'overruns': sum(stat.overruns for stat in stats),
+            'jitter_max_ms': max(stat.jitter.summary()['max_ms'] for stat in stats),
+            'cpu_percent': cpu / wall * 100,
+            'sim_speed': simulated / wall}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end scan benchmark against emulated controllers')
+    parser.add_argument('--controllers', type=int, nargs='+', default=[1, 3, 10], help='Numbers of controllers')
+    parser.add_argument('--devices', type=int, nargs='+', default=[100, 1000, 10000],
+                        help='Numbers of devices per controller, ignored with --source exports')
+    parser.add_argument('--tanks', type=int, default=0, help='Tanks per controller, ignored with --source exports')
+    parser.add_argument('--source', choices=('synthetic', 'exports'), default='synthetic',
+                        help='Synthetic devices or the devices of the CLX tag exports')
+    parser.add_argument('--duration', type=float, default=5, help='Run time of every scenario, in sec')
+    parser.add_argument('--cycle-time', type=float, default=0.5, help='Target scan cycle time, in sec')
+    parser.add_argument('--latency', type=float, default=0.005, help='Round trip time of every request, in sec')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Random extra round trip time, in sec')
+    parser.add_argument('--connection-size', type=int, default=4000, help='Packet size limit, in bytes')
+    parser.add_argument('--runtime', choices=('threads', 'async'), default='threads',
+                        help='One scan thread per controller or a single asyncio event loop')
+    parser.add_argument('--clock', choices=('real', 'scaled', 'stepped'), default='real',
+                        help='Simulation clock, stepped scans back to back one cycle time apart')
+    parser.add_argument('--clock-scale', type=float, default=10, help='Speed of the scaled clock')
+    parser.add_argument('--per-object-analog', action='store_true', help='Disables the vectorized Analog Kernel')
+    parser.add_argument('--record', help='Records the tag traffic to this file, replayed with replay_recording.py')
+    parser.add_argument('--json', help='Also writes the results to this file, to track regressions')
+    args = parser.parse_args()
+
+    logging.getLogger('ScanStats').setLevel(logging.ERROR)  # Overruns are counted, not logged
+    device_counts = [None] if args.source == 'exports' else args.devices
+    if args.record and len(args.controllers) * len(device_counts) > 1:
+        parser.error('--record needs a single scenario, one number of controllers and devices')
+
+    print(f'{"PLCs":>5} {"Devices":>8} {"Scans":>6} {"Mean ms":>8} {"P95 ms":>8} {"Req/scan":>9} {"kB/scan":>8} '
+          f'{"Overruns":>9} {"Jitter ms":>10} {"CPU %":>6} {"Speed":>6}')
+    results = []
+    for controllers in args.controllers:
+        for devices in device_counts:
+            result = run_scenario(controllers, devices, args)
+            results.append(result)
+            print(f'{result["controllers"]:>5} {result["devices_per_controller"]:>8} {result["scans"]:>6} '
+                  f'{result["scan_mean_ms"]:>8.1f} {result["scan_p95_ms"]:>8.1f} {result["requests_per_scan"]:>9.1f} '
+                  f'{result["kbytes_per_scan"]:>8.1f} {result["overruns"]:>9} {result["jitter_max_ms"]:>10.1f} '
+                  f'{result["cpu_percent"]:>6.1f} {result["sim_speed"]:>5.1f}x')
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump({'arguments': vars(args), 'results': results}, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()